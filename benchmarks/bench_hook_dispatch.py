@@ -0,0 +1,66 @@
+"""
+Benchmark: dispatching hooks with many loaded plugins, each one
+handling only a few hook types, using the :py:class:`PluginManager`
+dispatch index vs. asking every plugin for matching handlers.
+
+Usage::
+
+    python benchmarks/bench_hook_dispatch.py [NUM_PLUGINS] [NUM_HOOK_TYPES]
+"""
+
+import sys
+import timeit
+
+from datacat.utils.plugin_manager import HookExecutionResult, PluginManager
+
+
+class DummyPlugin(object):
+    def __init__(self, hook_types):
+        self._hooks = dict(
+            (hook_type, [lambda *a, **kw: None]) for hook_type in hook_types)
+
+    def call_hook_async(self, hook_type, *args, **kwargs):
+        for handler in self._hooks.get(hook_type, ()):
+            yield HookExecutionResult(self, handler(*args, **kwargs), None)
+
+
+def call_hook_unindexed(manager, hook_type, *args, **kwargs):
+    """Dispatch, the old way: walk all the plugins"""
+
+    results = []
+    for plugin in manager:
+        results.extend(plugin.call_hook_async(hook_type, *args, **kwargs))
+    return results
+
+
+def main():
+    num_plugins = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    num_hook_types = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    hook_types = ['hook_{0}'.format(i) for i in xrange(num_hook_types)]
+
+    # Each plugin handles two hook types
+    plugins = [DummyPlugin([hook_types[i % num_hook_types],
+                            hook_types[(i * 7 + 3) % num_hook_types]])
+               for i in xrange(num_plugins)]
+    manager = PluginManager(plugins)
+
+    print("Dispatching {0} hook types over {1} plugins"
+          .format(num_hook_types, num_plugins))
+
+    def run_indexed():
+        for hook_type in hook_types:
+            manager.call_hook(hook_type, 1, {'foo': 'bar'})
+
+    def run_unindexed():
+        for hook_type in hook_types:
+            call_hook_unindexed(manager, hook_type, 1, {'foo': 'bar'})
+
+    for name, func in [('unindexed', run_unindexed),
+                       ('indexed', run_indexed)]:
+        elapsed = min(timeit.repeat(func, number=1000, repeat=3)) / 1000
+        print("{0:>12}: {1:.1f}us per dispatch".format(
+            name, elapsed / num_hook_types * 1e6))
+
+
+if __name__ == '__main__':
+    main()
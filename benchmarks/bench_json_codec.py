@@ -0,0 +1,69 @@
+"""
+Benchmark: JSON encoding / decoding of typical dataset configurations,
+using all the available backends of :py:mod:`datacat.utils.json_codec`.
+
+Usage::
+
+    python benchmarks/bench_json_codec.py [NUM_DATASETS]
+"""
+
+import datetime
+import sys
+import timeit
+
+from datacat.utils.json_codec import BACKENDS, JSONCodec
+
+
+def make_dataset(i):
+    return {
+        'id': i,
+        'ctime': datetime.datetime(2014, 10, 7, 12, 0, 0),
+        'mtime': datetime.datetime(2014, 10, 7, 12, 30, 0),
+        'configuration': {
+            'metadata': {
+                'title': u'Dataset number {0}'.format(i),
+                'description': u'Some longer description ' * 10,
+                'author': u'Provincia Autonoma di Trento',
+                'tags': [u'geo', u'roads', u'osm', u'trentino'],
+                'license': u'CC-BY-4.0',
+            },
+            'resources': [
+                {'url': 'internal:///{0}'.format(i * 10 + n),
+                 'mimetype': 'application/zip'}
+                for n in xrange(5)],
+            'geo': {
+                'enabled': True,
+                'importer': 'find_shapefiles',
+                'srid': 4326,
+            },
+        },
+    }
+
+
+def main():
+    num_datasets = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    datasets = [make_dataset(i) for i in xrange(num_datasets)]
+
+    print("Encoding / decoding {0} dataset configurations"
+          .format(num_datasets))
+
+    for name in BACKENDS:
+        try:
+            codec = JSONCodec(name)
+        except ValueError:
+            print("{0:>12}: not available".format(name))
+            continue
+
+        encoded = codec.dumps(datasets)
+        dumps_time = min(timeit.repeat(
+            lambda: codec.dumps(datasets), number=10, repeat=3)) / 10
+        loads_time = min(timeit.repeat(
+            lambda: codec.loads(encoded), number=10, repeat=3)) / 10
+
+        print("{0:>12}: dumps {1:.4f}s ({2}), loads {3:.4f}s ({4})".format(
+            name, dumps_time, codec.encoder_name,
+            loads_time, codec.decoder_name))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+Benchmark: resolving the accessor class for resource URLs, with the
+accessors map cached on the application vs. importing the accessor
+classes (and parsing the whole URL) for each URL.
+
+Usage::
+
+    python benchmarks/bench_resource_accessors.py [NUM_URLS]
+"""
+
+import sys
+import timeit
+from urlparse import urlparse
+
+from flask import Flask, current_app
+
+from datacat.settings import default
+from datacat.utils.plugin_loading import import_object
+from datacat.utils.resource_access import (
+    _get_scheme, get_resource_accessors)
+
+
+def get_resource_accessors_uncached():
+    """Resolve the accessors, the old way: on every call"""
+
+    accessors = current_app.config['RESOURCE_ACCESSORS']
+    _accessors = {}
+    for key, val in accessors.iteritems():
+        if isinstance(val, basestring):
+            val = import_object(val)
+        _accessors[key] = val
+    return _accessors
+
+
+def main():
+    num_urls = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    urls = ['internal:///{0}'.format(i) if i % 2 else
+            'http://example.com/{0}'.format(i) for i in xrange(num_urls)]
+
+    app = Flask(__name__)
+    app.config['RESOURCE_ACCESSORS'] = dict(default.RESOURCE_ACCESSORS)
+
+    print("Resolving accessors for {0} URLs".format(num_urls))
+
+    def run_uncached():
+        for url in urls:
+            get_resource_accessors_uncached()[urlparse(url).scheme]
+
+    def run_cached():
+        for url in urls:
+            get_resource_accessors()[_get_scheme(url)]
+
+    with app.app_context():
+        for name, func in [('uncached', run_uncached),
+                           ('cached', run_cached)]:
+            elapsed = min(timeit.repeat(func, number=1, repeat=3))
+            print("{0:>12}: {1:.2f}us per URL".format(
+                name, elapsed / num_urls * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -4,7 +4,6 @@ Mostly wrappers around database queries, etc.
 """
 
 import hashlib
-import json
 from datetime import datetime
 
 from flask import g, current_app
@@ -12,7 +11,10 @@ from flask.config import Config
 from werkzeug import LocalProxy
 from werkzeug.exceptions import NotFound
 
-from datacat.db import querybuilder, connect, create_tables, drop_tables
+from datacat.db import (
+    querybuilder, search, connect, create_tables, drop_tables, get_counters)
+from datacat.db.instrumentation import get_cursor_factory
+from datacat.utils import json_codec
 from datacat.utils.files import file_read_chunks
 
 
@@ -25,23 +27,54 @@ class DatacatCore(object):
     @property
     def db(self):
         if getattr(self, '_db', None) is None:
-            self._db = connect(**self.config['DATABASE'])
+            self._db = connect(
+                cursor_factory=get_cursor_factory(self.config),
+                **self.config['DATABASE'])
             self._db.autocommit = False
         return self._db
 
     @property
     def admin_db(self):
         if getattr(self, '_admin_db', None) is None:
-            self._admin_db = connect(**self.config['DATABASE'])
+            self._admin_db = connect(
+                cursor_factory=get_cursor_factory(self.config),
+                **self.config['DATABASE'])
             self._admin_db.autocommit = True
         return self._admin_db
 
+    @property
+    def _search_language(self):
+        return self.config.get('SEARCH_LANGUAGE', 'english')
+
     def create_tables(self):
         create_tables(self.admin_db)
 
     def drop_tables(self):
         drop_tables(self.admin_db)
 
+    # ------------------------------------------------------------
+    # Counters
+    # ------------------------------------------------------------
+
+    def get_counters(self):
+        """
+        Get the values of all the counters, as a dictionary.
+
+        Counters are maintained by triggers, so reading them
+        doesn't require any table scan.
+        """
+        with self.db:
+            return get_counters(self.db)
+
+    def count_datasets(self):
+        return self.get_counters()['dataset.count']
+
+    def count_resources(self):
+        return self.get_counters()['resource.count']
+
+    def count_resource_bytes(self):
+        return self.get_counters()['resource.bytes']
+
     # ------------------------------------------------------------
     # Resource data CRUD
     # ------------------------------------------------------------
@@ -69,7 +102,7 @@ class DatacatCore(object):
             data = {
                 'ctime': datetime.now(),
                 'mtime': datetime.now(),
-                'metadata': json.dumps(metadata),
+                'metadata': json_codec.dumps(metadata),
                 'mimetype': mimetype or 'application/octet-stream',
                 'data_oid': oid,
                 'hash': 'sha1:{0}'.format(resource_hash.hexdigest()),
@@ -113,7 +146,7 @@ class DatacatCore(object):
         }
 
         if metadata is not None:
-            data['metadata'] = json.dumps(metadata)
+            data['metadata'] = json_codec.dumps(metadata)
         if mimetype is not None:
             data['mimetype'] = mimetype
 
@@ -176,6 +209,17 @@ class DatacatCore(object):
     def delete_dataset(self, dataset_id):
         return self._dsres_delete('dataset', dataset_id)
 
+    def search_datasets(self, text, offset=0, limit=20):
+        """
+        Full-text search over dataset titles / descriptions.
+
+        :return: a ``(results, total_count)`` tuple
+        """
+        with self.db, self.db.cursor() as cur:
+            return search.search_datasets(
+                cur, text, language=self._search_language,
+                offset=offset, limit=limit)
+
     def add_dataset_resource(self, dataset_id, resource_id, order=0):
         data = {
             'dataset_id': dataset_id,
@@ -212,24 +256,29 @@ class DatacatCore(object):
 
     def _dsres_create(self, name, obj):
         data = {
-            'configuration': json.dumps(obj),
+            'configuration': json_codec.dumps(obj),
             'ctime': datetime.now(),
             'mtime': datetime.now(),
         }
         query = querybuilder.insert(name, data)
         with self.db, self.db.cursor() as cur:
             cur.execute(query, data)
-            return cur.fetchone()[0]
+            obj_id = cur.fetchone()[0]
+            if name == 'dataset':
+                search.index_dataset(cur, obj_id, self._search_language)
+            return obj_id
 
     def _dsres_update(self, name, obj_id, obj):
         data = {
             'id': obj_id,
-            'configuration': json.dumps(obj),
+            'configuration': json_codec.dumps(obj),
             'mtime': datetime.now(),
         }
         query = querybuilder.update(name, data)
         with self.db, self.db.cursor() as cur:
             cur.execute(query, data)
+            if name == 'dataset':
+                search.index_dataset(cur, obj_id, self._search_language)
 
     def _dsres_get(self, name, obj_id):
         query = querybuilder.select_pk(name)
@@ -1,26 +1,59 @@
 from collections import MutableMapping
-import json
+from contextlib import contextmanager
 import functools
+import hashlib
 
 from flask import g
 import psycopg2
 import psycopg2.extras
 from werkzeug.local import LocalProxy
 
-from .schema import ALL_TABLES
+from datacat.utils import json_codec
 
+from .instrumentation import get_cursor_factory
+from .schema import ALL_TABLES, COUNTERS
 
-def connect(database, user=None, password=None, host='localhost', port=5432):
+# Key, in the info table, of the version of the schema the database
+# tables were created with (see :py:func:`get_schema_version`).
+SCHEMA_VERSION_KEY = 'core.schema_version'
+
+
+def connect(database, user=None, password=None, host='localhost', port=5432,
+            cursor_factory=None):
+    if cursor_factory is None:
+        cursor_factory = psycopg2.extras.DictCursor
     conn = psycopg2.connect(database=database, user=user, password=password,
                             host=host, port=port)
-    conn.cursor_factory = psycopg2.extras.DictCursor
+    conn.cursor_factory = cursor_factory
+
+    # Decode json columns using the configured codec
+    psycopg2.extras.register_default_json(conn, loads=json_codec.loads)
+    psycopg2.extras.register_default_jsonb(conn, loads=json_codec.loads)
+
     conn.autocommit = False
     return conn
 
 
+def get_schema_version():
+    """
+    Get the version of the schema definition (a hash of the SQL used
+    to create it), to tell whether the database tables are up to date
+    without inspecting them.
+    """
+
+    sql = '\n'.join(table.get_create_sql()
+                    for table in ALL_TABLES.itervalues())
+    return hashlib.sha1(sql).hexdigest()[:16]
+
+
 def create_tables(conn):
     """
-    Create database schema for a given connection.
+    Create database schema for a given connection, recording
+    the schema version in the info table.
+
+    DDL is transactional in PostgreSQL: the whole schema is created in
+    a single transaction, so that other sessions never see it partially
+    created (and nothing is left behind if it fails).
     """
 
     # We need to be in autocommit mode (i.e. out of transactions)
@@ -36,9 +69,16 @@ def create_tables(conn):
     # but maybe a plugin should be used to handle that..
     # ------------------------------------------------------------
 
-    with conn.cursor() as cur:
-        for table_name, table in ALL_TABLES.iteritems():
-            cur.execute(table.get_create_sql())
+    conn.autocommit = False
+    try:
+        with conn, conn.cursor() as cur:
+            for table_name, table in ALL_TABLES.iteritems():
+                cur.execute(table.get_create_sql())
+            cur.execute("""
+            INSERT INTO "info" ("key", "value") VALUES (%s, %s);
+            """, (SCHEMA_VERSION_KEY, json_codec.dumps(get_schema_version())))
+    finally:
+        conn.autocommit = True
 
 
 def drop_tables(conn):
@@ -50,6 +90,118 @@ def drop_tables(conn):
             cur.execute(table.get_drop_sql())
 
 
+def get_info(conn, keys):
+    """
+    Read multiple keys from the info table, with a single query.
+
+    :return: a dictionary mapping keys to (decoded) values; missing
+        keys are omitted.
+    """
+
+    with conn.cursor() as cur:
+        cur.execute("""
+        SELECT "key", "value" FROM "info" WHERE "key" = ANY(%s);
+        """, (list(keys),))
+        return dict((row['key'], json_codec.loads(row['value']))
+                    for row in cur)
+
+
+def set_info(conn, values):
+    """
+    Write multiple keys to the info table, with a single query
+    (inserting or replacing them).
+
+    :param values: a dictionary mapping keys to values
+    """
+
+    keys = list(values)
+    with conn.cursor() as cur:
+        cur.execute("""
+        INSERT INTO "info" ("key", "value")
+        SELECT * FROM unnest(%s::varchar[], %s::text[])
+        ON CONFLICT ("key") DO UPDATE SET "value" = EXCLUDED."value";
+        """, (keys, [json_codec.dumps(values[key]) for key in keys]))
+
+
+@contextmanager
+def advisory_lock(conn, key):
+    """
+    Hold a (session-level) PostgreSQL advisory lock, waiting for it to
+    be released by other sessions; used to coordinate processes sharing
+    the same database. The lock is released when exiting the context,
+    or if the connection is closed.
+
+    :param conn: a connection with autocommit on, as the lock must
+        not depend on transactions.
+    :param key: the lock key (a 64-bit integer)
+    """
+
+    if not conn.autocommit:
+        raise ValueError("Was expecting a connection with autocommit on")
+
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_advisory_lock(%s);", (key,))
+    try:
+        yield
+    finally:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_unlock(%s);", (key,))
+
+
+def get_counters(conn, names=None):
+    """
+    Read values from the (trigger-maintained) counters table.
+
+    :param conn: the database connection
+    :param names:
+        list of counter names to be read. ``None`` (default) means "all".
+    :return: a dictionary mapping counter names to values.
+    """
+
+    if names is None:
+        names = COUNTERS
+
+    with conn.cursor() as cur:
+        cur.execute("""
+        SELECT "name", "value" FROM "counter" WHERE "name" = ANY(%s);
+        """, (list(names),))
+        return dict((row['name'], row['value']) for row in cur)
+
+
+def get_counter(conn, name):
+    """Read the value of a single counter"""
+
+    try:
+        return get_counters(conn, [name])[name]
+    except KeyError:
+        raise KeyError(name)
+
+
+def reconcile_counters(conn):
+    """
+    Recompute all the counters from the actual table contents.
+
+    This requires full table scans; it is meant to be run periodically
+    (or after bulk operations bypassing the triggers) in order to fix
+    any drift in the counter values.
+
+    The ``<table>.changes`` counters are left alone: they can't be
+    recomputed, and only need to change.
+    """
+
+    with conn, conn.cursor() as cur:
+        cur.execute("""
+        LOCK TABLE "counter" IN EXCLUSIVE MODE;
+        UPDATE "counter" SET "value" = (SELECT count(*) FROM "dataset")
+        WHERE "name" = 'dataset.count';
+        UPDATE "counter" SET "value" = (SELECT count(*) FROM "resource")
+        WHERE "name" = 'resource.count';
+        UPDATE "counter"
+        SET "value" = (SELECT coalesce(sum("size"), 0) FROM "resource")
+        WHERE "name" = 'resource.bytes';
+        """)
+
+
 def _cached(key_name):
     def decorator(func):
         @functools.wraps(func)
@@ -64,7 +216,8 @@ def _cached(key_name):
 @_cached('_database')
 def get_db():
     from flask import current_app
-    c = connect(**current_app.config['DATABASE'])
+    c = connect(cursor_factory=get_cursor_factory(current_app.config),
+                **current_app.config['DATABASE'])
     c.autocommit = False
     return c
 
@@ -72,11 +225,61 @@ def get_db():
 @_cached('_admin_database')
 def get_admin_db():
     from flask import current_app
-    c = connect(**current_app.config['DATABASE'])
+    c = connect(cursor_factory=get_cursor_factory(current_app.config),
+                **current_app.config['DATABASE'])
     c.autocommit = True
     return c
 
 
+def close_context_connections():
+    """
+    Close the database connections cached in the current application
+    context, if any: to be called by threads running in their own
+    application context (connections are not closed automatically).
+    """
+
+    for conn in detach_context_connections().itervalues():
+        conn.close()
+
+
+def detach_context_connections():
+    """
+    Remove the database connections cached in the current application
+    context, in order to reuse them in a later one (see
+    :py:func:`attach_context_connections`).
+
+    :return: a dict of connections, by name
+    """
+
+    connections = {}
+    for name in ('_database', '_admin_database'):
+        conn = getattr(g, name, None)
+        if conn is not None:
+            connections[name] = conn
+            delattr(g, name)
+    return connections
+
+
+def attach_context_connections(connections):
+    """
+    Cache connections previously returned by
+    :py:func:`detach_context_connections` in the current application
+    context. Connections that were closed are discarded, and any
+    transaction left open is rolled back.
+    """
+
+    for name, conn in connections.iteritems():
+        if conn.closed:
+            continue
+        try:
+            if not conn.autocommit:
+                conn.rollback()
+        except psycopg2.Error:
+            conn.close()  # Broken connection
+            continue
+        setattr(g, name, conn)
+
+
 class DbInfoDict(MutableMapping):
     def __init__(self, db):
         self._db = db
@@ -89,13 +292,13 @@ class DbInfoDict(MutableMapping):
             row = cur.fetchone()
             if row is None:
                 raise KeyError(key)
-        return json.loads(row['value'])
+        return json_codec.loads(row['value'])
 
     def __setitem__(self, key, value):
         # Note that the update would be void if anybody deleted
         # the key between the two queries! -- but we can be optimistic
         # as key deletes are quite infrequent..
-        value = json.dumps(value)
+        value = json_codec.dumps(value)
         try:
             with self._db, self._db.cursor() as cur:
                 cur.execute("""
@@ -123,7 +326,7 @@ class DbInfoDict(MutableMapping):
         with self._db.cursor() as cur:
             cur.execute("SELECT key, value FROM info;")
             for row in cur:
-                yield row['key'], json.loads(row['value'])
+                yield row['key'], json_codec.loads(row['value'])
 
     def __len__(self):
         with self._db.cursor() as cur:
@@ -0,0 +1,128 @@
+"""
+Change feed over datasets and resources.
+
+Every insert / update / delete on the ``dataset`` and ``resource``
+tables is recorded by a trigger in the ``change_log`` table, along with
+a monotonically increasing sequence number and the id of the writing
+transaction (deletes are recorded too, as "tombstones").
+
+Sequence numbers are allocated at insert time, but transactions can
+commit in a different order: a client that just remembered the highest
+sequence number seen could miss changes from transactions that were
+still in progress at the time of the poll. To avoid that, changes are
+returned only for transactions older than the oldest transaction still
+running (the ``xmin`` of the current snapshot), ordered by transaction
+id and sequence number. The position in the feed is returned to clients
+as an opaque token, to be passed back to get the following changes.
+"""
+
+from collections import namedtuple
+
+
+class ChangeToken(namedtuple('ChangeToken', 'txid,seq')):
+    """
+    Position in the change feed: all the changes up to (and including)
+    this transaction id / sequence number have been seen.
+    """
+
+    __slots__ = []
+
+    def __str__(self):
+        return '{0}.{1}'.format(self.txid, self.seq)
+
+    @classmethod
+    def parse(cls, token):
+        """
+        Parse a token string, as returned by ``str(token)``.
+
+        :raise ValueError: if the token is not valid
+        """
+
+        if not token:
+            return cls(0, 0)
+        txid, seq = token.split('.')
+        return cls(int(txid), int(seq))
+
+
+def get_collection_version(cur, table):
+    """
+    Get information that can be used to build a validator (eg. an ETag)
+    for the whole collection of objects in a table, with a single cheap
+    query (all the values are read from the counters).
+
+    :param table: name of the table (``dataset`` or ``resource``)
+    :return:
+        a dict with ``count`` and ``changes`` (a counter bumped by each
+        insert / update / delete, see :py:mod:`datacat.db.schema`)
+        keys.
+    """
+
+    if table not in ('dataset', 'resource'):
+        raise ValueError("Invalid table name: {0}".format(table))
+
+    cur.execute("""
+    SELECT
+        (SELECT "value" FROM "counter" WHERE "name" = %(count)s) AS count,
+        (SELECT "value" FROM "counter" WHERE "name" = %(changes)s)
+        AS changes;
+    """, dict(count=table + '.count', changes=table + '.changes'))
+    return dict(cur.fetchone())
+
+
+def get_changes(cur, since=None, limit=100):
+    """
+    Get changes from the change log.
+
+    :param cur: a cursor for the database connection
+    :param since: a :py:class:`ChangeToken` (``None`` means "from start")
+    :param limit: maximum number of changes to be returned
+
+    :return:
+        a ``(changes, next_token, complete)`` tuple. ``changes`` is a
+        list of dicts (with ``type``, ``id``, ``operation``, ``seq`` and
+        ``time`` keys), containing only the last change for each object;
+        ``complete`` will be ``False`` if the limit was reached and more
+        changes can be retrieved right away using the returned token.
+    """
+
+    if since is None:
+        since = ChangeToken(0, 0)
+
+    cur.execute("""
+    SELECT txid_snapshot_xmin(txid_current_snapshot()) AS xmin;
+    """)
+    xmin = cur.fetchone()['xmin']
+
+    cur.execute("""
+    SELECT "seq", "txid", "object_type", "object_id", "operation", "ctime"
+    FROM "change_log"
+    WHERE ("txid", "seq") > (%(txid)s, %(seq)s) AND "txid" < %(xmin)s
+    ORDER BY "txid" ASC, "seq" ASC
+    LIMIT %(limit)s;
+    """, dict(txid=since.txid, seq=since.seq, xmin=xmin, limit=limit))
+    rows = cur.fetchall()
+
+    if len(rows) < limit:
+        # We got all the changes from transactions that are known
+        # to be finished: next time, start from the snapshot xmin.
+        # Sequence numbers start from 1, so (xmin, 0) means "everything
+        # from transactions before xmin".
+        next_token = max(ChangeToken(xmin, 0), since)
+        complete = True
+    else:
+        next_token = ChangeToken(rows[-1]['txid'], rows[-1]['seq'])
+        complete = False
+
+    # Only keep the last change for each object
+    changes = {}
+    for row in rows:
+        changes[row['object_type'], row['object_id']] = {
+            'type': row['object_type'],
+            'id': row['object_id'],
+            'operation': row['operation'],
+            'seq': row['seq'],
+            'time': row['ctime'],
+        }
+
+    changes = sorted(changes.itervalues(), key=lambda x: x['seq'])
+    return changes, next_token, complete
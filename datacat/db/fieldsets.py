@@ -0,0 +1,114 @@
+"""
+Sparse fieldsets: selection of a subset of the fields of the objects
+returned by the API (usually via the ``fields`` query string argument).
+
+Fields are specified as a comma-separated list of names; values of
+JSON columns can be traversed using dots, eg.
+``id,configuration.metadata.title``.
+
+Selection is pushed down to the database: only the needed columns
+are fetched, and sub-values of JSON columns are extracted by PostgreSQL
+(using the ``#>`` operator), so that unneeded data is never transferred
+nor serialized. Objects are then rebuilt, nested as per the field
+paths, using :py:func:`build_object`.
+"""
+
+FIELD_ALIAS = '_f{0}'
+
+
+def parse_fields(spec, columns, json_columns=(), prefix=()):
+    """
+    Parse a fields specification.
+
+    :param spec:
+        The fields specification string, eg. ``id,metadata.title``.
+
+    :param columns:
+        Names of the columns that can be selected. Since they end up
+        in the query, this must **not** come from user input.
+
+    :param json_columns:
+        Names of the (selectable) columns containing JSON values,
+        that can be traversed using dotted paths.
+
+    :param prefix:
+        Path to be prepended to all the fields (eg. ``('metadata',)``
+        to select fields relative to the ``metadata`` column).
+
+    :return:
+        a sorted list of paths (tuples of names). Paths contained in
+        other selected paths are removed.
+
+    :raise ValueError: if the specification is not valid
+    """
+
+    paths = set()
+    for field in spec.split(','):
+        field = field.strip()
+        if not field:
+            continue
+
+        path = tuple(prefix) + tuple(field.split('.'))
+        if not all(path):
+            raise ValueError("Invalid field: {0}".format(field))
+        if path[0] not in columns:
+            raise ValueError("Unknown field: {0}".format(field))
+        if len(path) > 1 and path[0] not in json_columns:
+            raise ValueError("Not a JSON field: {0}".format(path[0]))
+        paths.add(path)
+
+    if not paths:
+        raise ValueError("No fields selected")
+
+    selected = []
+    for path in sorted(paths):
+        if not any(path[:len(x)] == x for x in selected):
+            selected.append(path)
+    return selected
+
+
+def select_fields_sql(paths):
+    """
+    Build the ``SELECT`` list expressions for a list of field paths.
+
+    Sub-paths are passed as query arguments, named after the aliases
+    of the selected values.
+
+    :return: a ``(expressions, query_args)`` tuple
+    """
+
+    expressions, query_args = [], {}
+    for i, path in enumerate(paths):
+        alias = FIELD_ALIAS.format(i)
+        if len(path) == 1:
+            expressions.append('"{0}" AS {1}'.format(path[0], alias))
+        else:
+            expressions.append('"{0}" #> %({1})s AS {1}'.format(
+                path[0], alias))
+            query_args[alias] = list(path[1:])
+    return expressions, query_args
+
+
+def build_object(paths, row, prefix=()):
+    """
+    Build a (nested) object from the values selected using the
+    expressions from :py:func:`select_fields_sql`.
+
+    :param paths: the selected paths, as passed to ``select_fields_sql``
+    :param row: a row (mapping) returned by the query
+    :param prefix: common path prefix, not to be included in the object
+    """
+
+    obj = {}
+    for i, path in enumerate(paths):
+        path = path[len(prefix):]
+        value = row[FIELD_ALIAS.format(i)]
+        if not path:
+            # The whole object was selected
+            return value
+
+        container = obj
+        for name in path[:-1]:
+            container = container.setdefault(name, {})
+        container[path[-1]] = value
+    return obj
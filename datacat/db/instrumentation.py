@@ -0,0 +1,232 @@
+"""
+Per-query instrumentation for database cursors.
+
+The instrumented cursor class is installed through the ``cursor_factory``
+argument of :py:func:`datacat.db.connect`. For each executed statement
+it records a fingerprint, the duration, the row count and the endpoint
+being served, collecting them in a per-request query log.
+
+Statements slower than a configured threshold are logged to the
+``datacat.db.instrumentation`` logger, optionally along with the output
+of ``EXPLAIN (ANALYZE, BUFFERS)``.
+
+When the ``DATABASE_INSTRUMENTATION`` setting is off (the default),
+:py:func:`get_cursor_factory` returns ``None`` and connections use
+plain ``DictCursor`` objects, adding no overhead at all.
+"""
+
+from collections import namedtuple
+import logging
+import re
+import time
+
+from flask import g, has_app_context, has_request_context, request
+import psycopg2.extensions
+import psycopg2.extras
+
+logger = logging.getLogger(__name__)
+
+_FINGERPRINT_SUBSTITUTIONS = [
+    # Query placeholders, string and numeric literals
+    (re.compile(r"%(?:\([a-zA-Z0-9_]+\))?s"), '?'),
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r"\b[0-9]+(?:\.[0-9]+)?\b"), '?'),
+
+    # Lists of values, eg. in "IN (...)" or "VALUES (...)"
+    (re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)"), '(?)'),
+
+    # Whitespace
+    (re.compile(r"\s+"), ' '),
+]
+
+# Queries that must not be run again by EXPLAIN ANALYZE: row locks,
+# and functions with side effects (sequences, large objects, locks).
+_NOT_EXPLAINABLE_RE = re.compile(
+    r"\bFOR\s+(?:NO\s+KEY\s+)?(?:UPDATE|SHARE)\b"
+    r"|\bFOR\s+KEY\s+SHARE\b"
+    r"|\b(?:nextval|setval|lo_\w+|pg_(?:try_)?advisory_\w+)\s*\(",
+    re.IGNORECASE)
+
+
+class QueryRecord(namedtuple('QueryRecord',
+                             'fingerprint,duration,rowcount,endpoint')):
+    """Named tuple representing an executed query"""
+
+    __slots__ = []
+
+
+def fingerprint_query(query):
+    """
+    Normalize a query, removing literal values, so that queries
+    differing only in their arguments have the same fingerprint.
+
+    >>> fingerprint_query("SELECT * FROM t WHERE id = %(id)s")
+    'SELECT * FROM t WHERE id = ?'
+    """
+
+    for regex, replacement in _FINGERPRINT_SUBSTITUTIONS:
+        query = regex.sub(replacement, query)
+    return query.strip()
+
+
+def is_explainable(query):
+    """
+    Check whether a query can safely be run again through
+    ``EXPLAIN ANALYZE``: only plain ``SELECT`` queries, not locking
+    rows nor calling functions with side effects, are.
+    """
+
+    return (query.lstrip()[:6].upper() == 'SELECT'
+            and _NOT_EXPLAINABLE_RE.search(query) is None)
+
+
+def get_query_log():
+    """
+    Return the list of :py:class:`QueryRecord` for queries executed
+    during the current request (or application context).
+    """
+
+    if not has_app_context():
+        return []
+    return getattr(g, '_query_log', [])
+
+
+def reset_query_log():
+    g._query_log = []
+
+
+class InstrumentedCursor(psycopg2.extras.DictCursor):
+    """
+    ``DictCursor`` recording information about executed queries.
+
+    Use :py:func:`make_cursor_factory` to get a subclass configured
+    with the desired slow query threshold.
+    """
+
+    slow_query_threshold = None
+    explain_slow_queries = False
+
+    def execute(self, query, vars=None):
+        start = time.time()
+        rv = super(InstrumentedCursor, self).execute(query, vars)
+        self._record_query(query, vars, time.time() - start)
+        return rv
+
+    def executemany(self, query, vars_list):
+        start = time.time()
+        rv = super(InstrumentedCursor, self).executemany(query, vars_list)
+        self._record_query(query, None, time.time() - start)
+        return rv
+
+    def _record_query(self, query, vars, duration):
+        endpoint = request.endpoint if has_request_context() else None
+        record = QueryRecord(
+            fingerprint=fingerprint_query(query),
+            duration=duration,
+            rowcount=self.rowcount,
+            endpoint=endpoint)
+
+        if has_app_context():
+            if not hasattr(g, '_query_log'):
+                reset_query_log()
+            g._query_log.append(record)
+
+        if (self.slow_query_threshold is not None
+                and duration >= self.slow_query_threshold):
+            self._log_slow_query(query, vars, record)
+
+    def _log_slow_query(self, query, vars, record):
+        plan = None
+        if self.explain_slow_queries and is_explainable(query):
+            plan = self._explain_query(query, vars)
+
+        logger.warning(
+            "Slow query (%.3fs, %s rows, endpoint: %s): %s%s",
+            record.duration, record.rowcount, record.endpoint,
+            record.fingerprint,
+            '' if plan is None else '\n' + plan)
+
+    def _explain_query(self, query, vars):
+        # Note: this will execute the query again; that's why we only
+        # do it for queries without side effects, and in a savepoint,
+        # so that a failure doesn't abort the caller's transaction.
+        use_savepoint = not self.connection.autocommit
+        with self.connection.cursor(
+                cursor_factory=psycopg2.extensions.cursor) as cur:
+            try:
+                if use_savepoint:
+                    cur.execute('SAVEPOINT datacat_explain')
+                try:
+                    cur.execute('EXPLAIN (ANALYZE, BUFFERS) ' + query, vars)
+                    return '\n'.join(row[0] for row in cur.fetchall())
+                finally:
+                    if use_savepoint:
+                        cur.execute('ROLLBACK TO SAVEPOINT datacat_explain')
+                        cur.execute('RELEASE SAVEPOINT datacat_explain')
+            except psycopg2.Error:
+                logger.exception("Unable to explain slow query")
+                return None
+
+
+def make_cursor_factory(slow_query_threshold=None,
+                        explain_slow_queries=False):
+    """
+    Build a subclass of :py:class:`InstrumentedCursor`, to be passed as
+    ``cursor_factory`` to :py:func:`datacat.db.connect`.
+
+    :param slow_query_threshold:
+        Queries taking longer than this amount of seconds will be
+        logged as slow. ``None`` (default) disables the slow query log.
+
+    :param explain_slow_queries:
+        If set to ``True``, the output of ``EXPLAIN (ANALYZE, BUFFERS)``
+        will be included in the slow query log (only for queries
+        accepted by :py:func:`is_explainable`).
+    """
+
+    return type('InstrumentedCursor', (InstrumentedCursor,), {
+        'slow_query_threshold': slow_query_threshold,
+        'explain_slow_queries': explain_slow_queries,
+    })
+
+
+def get_cursor_factory(config):
+    """
+    Get the cursor factory to be used for connections, according
+    to the ``DATABASE_*`` instrumentation settings in ``config``.
+
+    :return: a cursor class, or ``None`` if instrumentation is disabled.
+    """
+
+    if not config.get('DATABASE_INSTRUMENTATION'):
+        return None
+
+    return make_cursor_factory(
+        slow_query_threshold=config.get('DATABASE_SLOW_QUERY_THRESHOLD'),
+        explain_slow_queries=config.get('DATABASE_EXPLAIN_SLOW_QUERIES',
+                                        False))
+
+
+def init_app(app):
+    """
+    Register request handlers to reset the query log for each request,
+    and to report per-request query counts, via the ``X-Query-Count``
+    and ``X-Query-Time`` response headers.
+    """
+
+    if not app.config.get('DATABASE_INSTRUMENTATION'):
+        return
+
+    @app.before_request
+    def _reset_query_log():
+        reset_query_log()
+
+    @app.after_request
+    def _report_query_log(response):
+        query_log = get_query_log()
+        total_time = sum(x.duration for x in query_log)
+        response.headers['X-Query-Count'] = str(len(query_log))
+        response.headers['X-Query-Time'] = '{0:.6f}'.format(total_time)
+        logger.debug("%s: %d queries in %.3fs", request.endpoint,
+                     len(query_log), total_time)
+        return response
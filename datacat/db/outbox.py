@@ -0,0 +1,180 @@
+"""
+Transactional outbox for plugin hook events.
+
+Changes to datasets and resources are already recorded in the
+``change_log`` table by triggers, in the same transaction as the change
+itself (see :py:mod:`datacat.db.changes`): the change log is used as
+the outbox, so that no event can get lost if the process crashes right
+after committing, and no extra write is needed.
+
+Each consumer (plugin) has its own position in the log, stored in the
+``hook_outbox_cursor`` table; events are delivered in batches, and the
+position is only advanced after the whole batch has been delivered
+(at-least-once delivery). Moving the position back (eg. to the start)
+replays events, eg. to catch up a newly enabled plugin.
+
+Dispatchers hold a session-level advisory lock on each consumer while
+delivering events to it (see :py:func:`try_lock_consumer`), so that
+no transaction needs to be kept open in the meantime. The number of
+failed attempts to deliver the batch following the current position
+is recorded too; hook calls that keep failing can be moved to the
+``hook_outbox_dead_letter`` table (see :py:func:`add_dead_letter`).
+
+Events are returned with the *current* state of the objects: hooks
+receive the latest configuration, and create / update events for
+objects deleted in the meantime are skipped (the delete event follows).
+"""
+
+from datacat.db.changes import ChangeToken
+from datacat.utils import json_codec
+
+# Change log operations -> hook operations
+_OPERATIONS = {'insert': 'create'}
+
+# First key of the (two keys) advisory locks on consumers
+CONSUMER_LOCK_CLASS = 0x64746303
+
+
+def register_consumer(cur, consumer):
+    """
+    Register a consumer, if not already registered, setting its
+    position to the current end of the log.
+    """
+
+    cur.execute("""
+    INSERT INTO "hook_outbox_cursor" ("consumer", "txid", "seq")
+    VALUES (%(consumer)s, txid_snapshot_xmin(txid_current_snapshot()), 0)
+    ON CONFLICT ("consumer") DO NOTHING;
+    """, dict(consumer=consumer))
+
+
+def try_lock_consumer(cur, consumer):
+    """
+    Try to take the (session-level) advisory lock on a consumer,
+    meaning that the current session is delivering events to it.
+    The lock is held until :py:func:`unlock_consumer` is called, or
+    the connection is closed; transactions don't affect it.
+
+    :return: ``True`` if locked, ``False`` if another session holds it
+    """
+
+    cur.execute("""
+    SELECT pg_try_advisory_lock(%(class)s, hashtext(%(consumer)s)) AS locked;
+    """, {'class': CONSUMER_LOCK_CLASS, 'consumer': consumer})
+    return cur.fetchone()['locked']
+
+
+def unlock_consumer(cur, consumer):
+    """Release the lock taken by :py:func:`try_lock_consumer`"""
+
+    cur.execute("""
+    SELECT pg_advisory_unlock(%(class)s, hashtext(%(consumer)s));
+    """, {'class': CONSUMER_LOCK_CLASS, 'consumer': consumer})
+
+
+def get_cursor(cur, consumer):
+    """
+    Get the position of a consumer; new consumers start from
+    the current end of the log.
+
+    :return:
+        a ``(position, attempts)`` tuple: a :py:class:`ChangeToken`,
+        and the number of failed attempts to deliver the following
+        events.
+    """
+
+    register_consumer(cur, consumer)
+    cur.execute("""
+    SELECT "txid", "seq", "attempts" FROM "hook_outbox_cursor"
+    WHERE "consumer" = %(consumer)s;
+    """, dict(consumer=consumer))
+    row = cur.fetchone()
+    return ChangeToken(row['txid'], row['seq']), row['attempts']
+
+
+def set_cursor(cur, consumer, position):
+    """
+    Set the position of a consumer (eg. to ``ChangeToken(0, 0)``
+    to replay all the events), resetting the failed attempts count.
+    """
+
+    cur.execute("""
+    INSERT INTO "hook_outbox_cursor" ("consumer", "txid", "seq")
+    VALUES (%(consumer)s, %(txid)s, %(seq)s)
+    ON CONFLICT ("consumer")
+    DO UPDATE SET "txid" = EXCLUDED."txid", "seq" = EXCLUDED."seq",
+        "attempts" = 0, "last_error" = NULL;
+    """, dict(consumer=consumer, txid=position.txid, seq=position.seq))
+
+
+def record_failure(cur, consumer, error):
+    """Record a failed attempt to deliver events to a consumer"""
+
+    cur.execute("""
+    UPDATE "hook_outbox_cursor"
+    SET "attempts" = "attempts" + 1, "last_error" = %(error)s
+    WHERE "consumer" = %(consumer)s;
+    """, dict(consumer=consumer, error=error))
+
+
+def add_dead_letter(cur, consumer, hook_type, args, error):
+    """Record a hook call that failed too many times, and was skipped"""
+
+    cur.execute("""
+    INSERT INTO "hook_outbox_dead_letter"
+        ("consumer", "hook_type", "args", "error")
+    VALUES (%(consumer)s, %(hook_type)s, %(args)s::json, %(error)s);
+    """, dict(consumer=consumer, hook_type=hook_type,
+              args=json_codec.dumps(list(args)), error=error))
+
+
+def get_events(cur, position, limit=100):
+    """
+    Get events following a position in the log, only from transactions
+    known to be finished (see :py:mod:`datacat.db.changes`).
+
+    :return:
+        a ``(events, next_position, complete)`` tuple; events are
+        ``(object_type, object_id, operation, data)`` tuples, where
+        operation is one of ``create``, ``update`` or ``delete``, and
+        data is the current configuration (datasets) or metadata
+        (resources), or ``None`` for deletes.
+    """
+
+    cur.execute("""
+    SELECT txid_snapshot_xmin(txid_current_snapshot()) AS xmin;
+    """)
+    xmin = cur.fetchone()['xmin']
+
+    cur.execute("""
+    SELECT c."txid", c."seq", c."object_type", c."object_id", c."operation",
+        d."id" IS NOT NULL OR r."id" IS NOT NULL AS object_exists,
+        coalesce(d."configuration", r."metadata") AS data
+    FROM "change_log" c
+    LEFT JOIN "dataset" d
+        ON c."object_type" = 'dataset' AND d."id" = c."object_id"
+    LEFT JOIN "resource" r
+        ON c."object_type" = 'resource' AND r."id" = c."object_id"
+    WHERE (c."txid", c."seq") > (%(txid)s, %(seq)s) AND c."txid" < %(xmin)s
+    ORDER BY c."txid" ASC, c."seq" ASC
+    LIMIT %(limit)s;
+    """, dict(txid=position.txid, seq=position.seq, xmin=xmin, limit=limit))
+    rows = cur.fetchall()
+
+    if len(rows) < limit:
+        next_position = max(ChangeToken(xmin, 0), position)
+        complete = True
+    else:
+        next_position = ChangeToken(rows[-1]['txid'], rows[-1]['seq'])
+        complete = False
+
+    events = []
+    for row in rows:
+        if row['operation'] == 'delete':
+            events.append((row['object_type'], row['object_id'],
+                           'delete', None))
+        elif row['object_exists']:
+            operation = _OPERATIONS.get(row['operation'], row['operation'])
+            events.append((row['object_type'], row['object_id'],
+                           operation, row['data']))
+    return events, next_position, complete
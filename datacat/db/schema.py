@@ -21,6 +21,144 @@ define_table('info', [
     ('value', 'TEXT'),
 ])
 
+# ------------------------------------------------------------
+# Counters, maintained by triggers on the tables they refer to,
+# in order to avoid running count(*) queries (full table scans).
+#
+# Note that all the writes to a table will need to update the same
+# counter row; in case this becomes a bottleneck, triggers can be
+# dropped and counters periodically recomputed using
+# :py:func:`datacat.db.reconcile_counters`.
+#
+# The ``<table>.changes`` counters are bumped on every insert / update
+# / delete, and used to build validators for whole collections: as
+# writers are serialized by the counter row lock, the value seen
+# changes with every commit (unlike eg. the highest change sequence
+# number, as transactions can commit out of order).
+# ------------------------------------------------------------
+
+COUNTERS = ['dataset.count', 'dataset.changes',
+            'resource.count', 'resource.changes', 'resource.bytes']
+
+define_table('counter', [
+    ('name', 'CHARACTER VARYING (128) PRIMARY KEY'),
+    ('value', 'BIGINT NOT NULL DEFAULT 0'),
+], extra_create_sql=[
+    """
+    INSERT INTO "counter" ("name", "value") VALUES {0};
+    """.format(', '.join("('{0}', 0)".format(x) for x in COUNTERS)),
+    """
+    CREATE FUNCTION datacat_count_rows() RETURNS TRIGGER AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            UPDATE "counter" SET "value" = "value" + 1
+            WHERE "name" = TG_TABLE_NAME || '.count';
+        ELSIF TG_OP = 'DELETE' THEN
+            UPDATE "counter" SET "value" = "value" - 1
+            WHERE "name" = TG_TABLE_NAME || '.count';
+        END IF;
+        UPDATE "counter" SET "value" = "value" + 1
+        WHERE "name" = TG_TABLE_NAME || '.changes';
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+    """
+    CREATE FUNCTION datacat_count_resource_bytes() RETURNS TRIGGER AS $$
+    DECLARE
+        delta BIGINT;
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            delta := coalesce(NEW.size, 0);
+        ELSIF TG_OP = 'UPDATE' THEN
+            delta := coalesce(NEW.size, 0) - coalesce(OLD.size, 0);
+        ELSE
+            delta := - coalesce(OLD.size, 0);
+        END IF;
+        UPDATE "counter" SET "value" = "value" + delta
+        WHERE "name" = 'resource.bytes';
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+], extra_drop_sql=[
+    'DROP FUNCTION datacat_count_rows();',
+    'DROP FUNCTION datacat_count_resource_bytes();',
+])
+
+# ------------------------------------------------------------
+# Change log, used to provide a change feed over datasets and
+# resources. See :py:mod:`datacat.db.changes`.
+# ------------------------------------------------------------
+
+define_table('change_log', [
+    ('seq', 'BIGSERIAL PRIMARY KEY'),
+    ('txid', 'BIGINT NOT NULL DEFAULT txid_current()'),
+    ('ctime', 'TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT now()'),
+    ('object_type', 'CHARACTER VARYING (32) NOT NULL'),
+    ('object_id', 'INTEGER NOT NULL'),
+    ('operation', 'CHARACTER VARYING (16) NOT NULL'),
+], extra_create_sql=[
+    """
+    CREATE INDEX change_log_txid_seq_idx ON "change_log" ("txid", "seq");
+    """,
+    """
+    CREATE INDEX change_log_object_type_seq_idx
+    ON "change_log" ("object_type", "seq");
+    """,
+    """
+    CREATE FUNCTION datacat_log_change() RETURNS TRIGGER AS $$
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            INSERT INTO "change_log" ("object_type", "object_id", "operation")
+            VALUES (TG_TABLE_NAME, OLD.id, 'delete');
+        ELSE
+            INSERT INTO "change_log" ("object_type", "object_id", "operation")
+            VALUES (TG_TABLE_NAME, NEW.id, lower(TG_OP));
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+], extra_drop_sql=[
+    'DROP FUNCTION datacat_log_change();',
+])
+
+# ------------------------------------------------------------
+# Position of each plugin in the change log, used as the outbox
+# for hook events. See :py:mod:`datacat.db.outbox`.
+# ------------------------------------------------------------
+
+define_table('hook_outbox_cursor', [
+    ('consumer', 'CHARACTER VARYING (256) PRIMARY KEY'),
+    ('txid', 'BIGINT NOT NULL'),
+    ('seq', 'BIGINT NOT NULL'),
+    ('attempts', 'INTEGER NOT NULL DEFAULT 0'),
+    ('last_error', 'TEXT'),
+])
+
+# Hook calls that kept failing, and were skipped
+define_table('hook_outbox_dead_letter', [
+    ('id', 'SERIAL PRIMARY KEY'),
+    ('ctime', 'TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()'),
+    ('consumer', 'CHARACTER VARYING (256) NOT NULL'),
+    ('hook_type', 'CHARACTER VARYING (128) NOT NULL'),
+    ('args', 'JSON'),
+    ('error', 'TEXT'),
+])
+
+# ------------------------------------------------------------
+# Latest scheduled task for debounced async hooks (see
+# :py:class:`datacat.utils.plugin_manager.PluginManager`)
+# ------------------------------------------------------------
+
+define_table('hook_debounce', [
+    ('hook_type', 'CHARACTER VARYING (128) NOT NULL'),
+    ('object_id', 'CHARACTER VARYING (128) NOT NULL'),
+    ('token', 'CHARACTER VARYING (64) NOT NULL'),
+    ('first_scheduled', 'TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()'),
+], primary_key=['hook_type', 'object_id'])
+
 define_table('dataset', [
     ('id', 'SERIAL PRIMARY KEY'),
     ('ctime', 'TIMESTAMP WITHOUT TIME ZONE'),
@@ -28,6 +166,43 @@ define_table('dataset', [
     ('configuration', 'JSON'),
     ('source_ref', 'CHARACTER VARYING (128) UNIQUE'),
     ('resources', 'INTEGER[]'),
+    ('search_vector', 'TSVECTOR'),  # See datacat.db.search
+    ('version', 'INTEGER NOT NULL DEFAULT 1'),
+], extra_create_sql=[
+    # Version is incremented on each update, to be used for
+    # optimistic concurrency control (eg. via the If-Match header)
+    """
+    CREATE FUNCTION datacat_bump_version() RETURNS TRIGGER AS $$
+    BEGIN
+        NEW.version := OLD.version + 1;
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+    """
+    CREATE TRIGGER dataset_bump_version
+    BEFORE UPDATE OF "configuration" ON "dataset"
+    FOR EACH ROW EXECUTE PROCEDURE datacat_bump_version();
+    """,
+    """
+    CREATE INDEX dataset_search_vector_idx
+    ON "dataset" USING gin ("search_vector");
+    """,
+    """
+    CREATE INDEX dataset_mtime_idx ON "dataset" ("mtime");
+    """,
+    """
+    CREATE TRIGGER dataset_log_change
+    AFTER INSERT OR DELETE OR UPDATE OF "configuration" ON "dataset"
+    FOR EACH ROW EXECUTE PROCEDURE datacat_log_change();
+    """,
+    """
+    CREATE TRIGGER dataset_count_rows
+    AFTER INSERT OR DELETE OR UPDATE ON "dataset"
+    FOR EACH ROW EXECUTE PROCEDURE datacat_count_rows();
+    """,
+], extra_drop_sql=[
+    'DROP FUNCTION datacat_bump_version();',
 ])
 
 define_table('resource', [
@@ -36,6 +211,37 @@ define_table('resource', [
     ('mtime', 'TIMESTAMP WITHOUT TIME ZONE'),
     ('configuration', 'JSON'),
     ('source_ref', 'CHARACTER VARYING (128) UNIQUE'),
+    ('metadata', 'JSON'),
+    ('auto_metadata', 'JSON'),
+    ('mimetype', 'CHARACTER VARYING (128)'),
+    ('data_oid', 'INTEGER'),  # lobject oid
+    ('hash', 'VARCHAR(128)'),  # ALGO:HASH
+    ('size', 'BIGINT'),  # Size of data, in bytes
+    ('version', 'INTEGER NOT NULL DEFAULT 1'),
+], extra_create_sql=[
+    """
+    CREATE TRIGGER resource_bump_version
+    BEFORE UPDATE OF "metadata", "mimetype", "hash" ON "resource"
+    FOR EACH ROW EXECUTE PROCEDURE datacat_bump_version();
+    """,
+    """
+    CREATE INDEX resource_mtime_idx ON "resource" ("mtime");
+    """,
+    """
+    CREATE TRIGGER resource_log_change
+    AFTER INSERT OR UPDATE OR DELETE ON "resource"
+    FOR EACH ROW EXECUTE PROCEDURE datacat_log_change();
+    """,
+    """
+    CREATE TRIGGER resource_count_rows
+    AFTER INSERT OR DELETE OR UPDATE ON "resource"
+    FOR EACH ROW EXECUTE PROCEDURE datacat_count_rows();
+    """,
+    """
+    CREATE TRIGGER resource_count_bytes
+    AFTER INSERT OR DELETE OR UPDATE OF "size" ON "resource"
+    FOR EACH ROW EXECUTE PROCEDURE datacat_count_resource_bytes();
+    """,
 ])
 
 define_table('resource_data', [
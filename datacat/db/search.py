@@ -0,0 +1,119 @@
+"""
+Full-text search over dataset configurations.
+
+Datasets are indexed on the ``title`` and ``description`` keys of
+their ``metadata`` configuration section; the resulting ``tsvector``
+is stored in the ``dataset.search_vector`` column (which has a GIN
+index on it) and updated incrementally, each time a dataset
+is created or updated.
+"""
+
+_METADATA_FIELD_SQL = "coalesce({0}->'metadata'->>'{1}', '')"
+
+
+def search_vector_sql(configuration='configuration'):
+    """
+    Get the SQL expression building the text search vector for a
+    dataset: title has more weight than the description.
+
+    :param configuration:
+        SQL expression for the dataset configuration. Can be changed,
+        eg. to index the result of an update in the same statement.
+    """
+
+    return (
+        "setweight(to_tsvector(%(language)s::regconfig, {title}), 'A') || "
+        "setweight(to_tsvector(%(language)s::regconfig, {description}), 'B')"
+        .format(title=_METADATA_FIELD_SQL.format(configuration, 'title'),
+                description=_METADATA_FIELD_SQL.format(
+                    configuration, 'description')))
+
+
+SEARCH_VECTOR_SQL = search_vector_sql()
+
+
+def index_dataset(cur, dataset_id, language='english'):
+    """
+    Update the search vector for a dataset.
+
+    This is meant to be called in the same transaction used
+    to create / update the dataset.
+
+    :param cur: a cursor for the database connection
+    :param dataset_id: id of the dataset to be indexed
+    :param language: the text search configuration name
+    """
+
+    cur.execute("""
+    UPDATE "dataset" SET "search_vector" = {0}
+    WHERE "id" = %(id)s;
+    """.format(SEARCH_VECTOR_SQL), dict(id=dataset_id, language=language))
+
+
+def reindex_datasets(cur, language='english'):
+    """
+    Rebuild the search vector for all the datasets.
+
+    Needed, eg. after changing the text search language.
+    """
+
+    cur.execute("""
+    UPDATE "dataset" SET "search_vector" = {0};
+    """.format(SEARCH_VECTOR_SQL), dict(language=language))
+
+
+def search_datasets(cur, text, language='english', offset=0, limit=20):
+    """
+    Search datasets, ordered by relevance.
+
+    :param cur: a cursor for the database connection
+    :param text: the search text, in "plain" format
+    :param language: the text search configuration name
+    :param offset: position of the first returned result
+    :param limit: maximum number of returned results
+
+    :return:
+        a ``(results, total_count)`` tuple, where results is a list of
+        dicts with ``id``, ``rank``, ``title`` and ``highlight`` keys.
+    """
+
+    cur.execute("""
+    SELECT "id", ts_rank("search_vector", query) AS rank,
+        configuration->'metadata'->>'title' AS title,
+        ts_headline(%(language)s::regconfig, {title}, query)
+            AS title_highlight,
+        ts_headline(%(language)s::regconfig, {description}, query,
+                    'MaxFragments=2')
+            AS description_highlight,
+        count(*) OVER () AS total_count
+    FROM "dataset", plainto_tsquery(%(language)s::regconfig, %(text)s) query
+    WHERE "search_vector" @@ query
+    ORDER BY rank DESC, "id" ASC
+    OFFSET %(offset)s LIMIT %(limit)s;
+    """.format(title=_METADATA_FIELD_SQL.format('configuration', 'title'),
+               description=_METADATA_FIELD_SQL.format(
+                   'configuration', 'description')),
+        dict(text=text, language=language, offset=offset, limit=limit))
+
+    rows = cur.fetchall()
+    if not rows:
+        # Either no match, or we are past the last page
+        return [], _count_matches(cur, text, language) if offset else 0
+
+    results = [{'id': row['id'],
+                'rank': row['rank'],
+                'title': row['title'],
+                'highlight': {
+                    'title': row['title_highlight'],
+                    'description': row['description_highlight'],
+                }} for row in rows]
+    return results, rows[0]['total_count']
+
+
+def _count_matches(cur, text, language):
+    cur.execute("""
+    SELECT count(*) AS count
+    FROM "dataset", plainto_tsquery(%(language)s::regconfig, %(text)s) query
+    WHERE "search_vector" @@ query;
+    """, dict(text=text, language=language))
+    return cur.fetchone()['count']
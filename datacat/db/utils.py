@@ -1,11 +1,17 @@
 class TableSchema(object):
-    def __init__(self, name, fields=None, primary_key=None):
+    def __init__(self, name, fields=None, primary_key=None,
+                 extra_create_sql=None, extra_drop_sql=None):
         self.name = name
         if fields is None:
             fields = []
         self.fields = fields
         self.primary_key = primary_key
 
+        # Extra statements (eg. functions, triggers, indices) to be
+        # run right after creating / dropping the table.
+        self.extra_create_sql = list(extra_create_sql or [])
+        self.extra_drop_sql = list(extra_drop_sql or [])
+
     def get_create_sql(self):
         table_definition = [
             self._build_field_def(x) for x in self.fields]
@@ -16,11 +22,13 @@ class TableSchema(object):
                 .format(', '.join(
                     '"{0}"'.format(x) for x in self.primary_key)))
 
-        return 'CREATE TABLE "{name}" ({definition});'.format(
+        sql = 'CREATE TABLE "{name}" ({definition});'.format(
             name=self.name, definition=", ".join(table_definition))
+        return '\n'.join([sql] + self.extra_create_sql)
 
     def get_drop_sql(self):
-        return 'DROP TABLE "{name}";'.format(name=self.name)
+        sql = 'DROP TABLE "{name}";'.format(name=self.name)
+        return '\n'.join([sql] + self.extra_drop_sql)
 
     def _build_field_def(self, field_def):
         name, definition = field_def
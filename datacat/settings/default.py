@@ -21,11 +21,128 @@ DATABASE = {
     'port': 5432,
 }
 
+# Record per-query statistics (fingerprint, duration, row count and
+# endpoint) on database cursors, and report per-request query counts.
+# When disabled, plain cursors are used and no overhead is added.
+DATABASE_INSTRUMENTATION = False
+
+# Queries taking longer than this (in seconds) are logged as slow.
+# Only used if DATABASE_INSTRUMENTATION is enabled.
+DATABASE_SLOW_QUERY_THRESHOLD = 0.5
+
+# Include the output of ``EXPLAIN (ANALYZE, BUFFERS)`` in the slow
+# query log (SELECT queries only, as they need to be run again).
+DATABASE_EXPLAIN_SLOW_QUERIES = False
+
+# Library used to encode / decode JSON (see datacat.utils.json_codec).
+# None (default) means "fastest available".
+JSON_BACKEND = None
+
+# Let PostgreSQL render the JSON for the (potentially large) resource
+# and dataset index endpoints, streaming it to the client, instead of
+# building and encoding the whole list in Python.
+RENDER_INDEX_IN_DATABASE = False
+
+# Text search configuration used to index datasets for full-text search.
+# After changing this, use ``datacat.db.search.reindex_datasets()``.
+SEARCH_LANGUAGE = 'english'
+
+# Maximum number of operations accepted by the batch API endpoint.
+ADMIN_BATCH_MAX_OPERATIONS = 10000
+
+# For non-atomic batches, commit changes every this many operations,
+# to avoid keeping a transaction open for too long.
+ADMIN_BATCH_COMMIT_SIZE = 500
+
+# Hooks to be run in background by Celery workers (eg. 'dataset_create',
+# 'dataset_update', 'dataset_delete'), after changes are committed,
+# instead of making the HTTP response wait for them. Each plugin gets its
+# own task ('<plugin name>.call_hook'), which can be routed to a dedicated
+# queue. Ids of the enqueued tasks are returned in the X-Task-Id header.
+ASYNC_HOOKS = []
+
+# Run hook handlers from different plugins concurrently, in a pool of
+# HOOKS_MAX_WORKERS threads, waiting at most HOOKS_TIMEOUT seconds (None
+# means "forever") for each one. Plugins can opt out by setting their
+# ``parallel_hooks`` attribute to False. Workers stuck on handlers that
+# timed out are replaced (up to HOOKS_MAX_WORKERS of them at a time), and
+# each worker keeps its own database connection.
+HOOKS_PARALLEL = False
+HOOKS_MAX_WORKERS = 4
+HOOKS_TIMEOUT = None
+
+# Debounce hooks: calls for the same object within the window (in
+# seconds) are merged, and only the latest one is performed, once the
+# window has elapsed. Eg. {'dataset_update': 10}
+# Synchronous hooks are delayed in-process: pending calls are run when
+# the process exits, but are lost if it's killed (unless HOOKS_OUTBOX
+# is on).
+HOOKS_DEBOUNCE = {}
+
+# Maximum delay (in seconds) of debounced calls, since the first of the
+# merged ones: objects updated more often than the window are still
+# delivered at least this often. None means no limit.
+HOOKS_DEBOUNCE_MAX_WAIT = 60
+
+# Deliver hook events through a transactional outbox (the change log),
+# instead of calling hooks right after the change: events are delivered
+# by the ``datacat.drain_hook_outbox`` Celery task, enqueued once per
+# request, in batches of HOOKS_OUTBOX_BATCH_SIZE events. The task should
+# also run periodically, to retry failed deliveries, eg:
+#
+#     CELERYBEAT_SCHEDULE = {
+#         'drain-hook-outbox': {
+#             'task': 'datacat.drain_hook_outbox',
+#             'schedule': 60,
+#         },
+#     }
+HOOKS_OUTBOX = False
+HOOKS_OUTBOX_BATCH_SIZE = 100
+
+# Hook calls failing on this many runs of the outbox task are moved to
+# the hook_outbox_dead_letter table, and skipped. None means "retry
+# forever".
+HOOKS_OUTBOX_MAX_ATTEMPTS = 10
+
+# Hook handler / Celery task executions taking longer than this (in
+# seconds) are logged as warnings to the ``datacat.utils.metrics`` logger.
+METRICS_SLOW_THRESHOLD = 1.0
+
+# Import plugins on first use (first request or hook call) instead of
+# at startup, to make web worker processes boot faster. Plugins are
+# still imported at startup when they need to be installed / enabled,
+# and by Celery workers, to register their tasks.
+PLUGINS_LAZY_LOAD = True
+
 PLUGINS = [
     'datacat.ext.core:core_plugin',
     'datacat.ext.geo:geo_plugin',
 ]
 
+# Connection pooling for HTTP resources: number of hosts to keep
+# connections for, and maximum number of connections kept per host.
+HTTP_POOL_CONNECTIONS = 10
+HTTP_POOL_MAXSIZE = 10
+
+# Directory where remote HTTP resources are cached (None to disable
+# the cache); it can be shared by multiple processes. Least recently
+# used resources are removed when the total size (in bytes) exceeds
+# HTTP_CACHE_MAX_SIZE.
+HTTP_CACHE_DIR = None
+HTTP_CACHE_MAX_SIZE = 1024 ** 3
+
+# Download HTTP resources larger than HTTP_SEGMENTED_MIN_SIZE (in bytes)
+# in this many byte ranges concurrently, if the server supports them.
+HTTP_DOWNLOAD_SEGMENTS = 4
+HTTP_SEGMENTED_MIN_SIZE = 32 * 1024 ** 2
+
+# Concurrent download of many resources (see datacat.utils.resource_fetch):
+# maximum concurrent downloads, overall and per host, and overall
+# bandwidth limit (in bytes per second, None for no limit).
+RESOURCE_FETCH_MAX_WORKERS = 8
+RESOURCE_FETCH_MAX_PER_HOST = 4
+RESOURCE_FETCH_MAX_BANDWIDTH = None
+
 RESOURCE_ACCESSORS = {
     'http': 'datacat.utils.resource_access:HttpResourceAccessor',
     'https': 'datacat.utils.resource_access:HttpResourceAccessor',
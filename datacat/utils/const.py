@@ -1,5 +1,9 @@
 # ISO date format
 DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
 
+# ISO date format, for the PostgreSQL to_char() function
+# (must produce the same output as DATE_FORMAT)
+SQL_DATE_FORMAT = 'YYYY-MM-DD"T"HH24:MI:SS.US'
+
 # HTTP Date format
 HTTP_DATE_FORMAT = '%a, %d %b %Y %H:%M:%S GMT'
@@ -8,12 +8,16 @@ def file_copy(src, dest, blocksize=4096):
         An object with a ``.write(data)`` method
     :param blocksize:
         The size of blocks read from src and written to dest.
+    :return:
+        The number of bytes copied
     """
+    copied = 0
     while True:
         data = src.read(blocksize)
         if not data:
-            return
+            return copied
         dest.write(data)
+        copied += len(data)
 
 
 def file_read_chunks(src, blocksize=4096):
@@ -2,11 +2,54 @@ from datetime import datetime
 
 from flask import request, Response
 from werkzeug.exceptions import NotFound, BadRequest
+from werkzeug.http import unquote_etag
 
 from datacat.db import db, querybuilder
 from datacat.utils.const import HTTP_DATE_FORMAT
 
 
+def not_modified_response(etag=None, last_modified=None, headers=None):
+    """
+    Check the ``If-None-Match`` and ``If-Modified-Since`` request
+    headers against the current validators for a resource.
+
+    As per RFC 7232, ``If-Modified-Since`` is ignored if the request
+    also contains ``If-None-Match``.
+
+    :param etag:
+        Current ETag for the resource, as sent in the ``ETag`` header
+        (possibly quoted / weak).
+
+    :param last_modified:
+        Last modification date of the resource (naive, UTC).
+
+    :param headers:
+        Headers to be included in the ``304`` response.
+
+    :return:
+        A ``304 Not Modified`` response if the client copy is still
+        valid, ``None`` otherwise.
+    """
+
+    if request.if_none_match:
+        if etag is None:
+            return None
+        if not request.if_none_match.contains_weak(unquote_etag(etag)[0]):
+            return None
+
+    elif request.if_modified_since is not None:
+        if last_modified is None:
+            return None
+        # HTTP dates have a resolution of one second
+        if last_modified.replace(microsecond=0) > request.if_modified_since:
+            return None
+
+    else:
+        return None
+
+    return Response('', status=304, headers=headers)
+
+
 def serve_resource(resource_id, transfer_block_size=4096):
     """
     Serve resource data via HTTP, setting ETag and Last-Modified headers
@@ -18,11 +61,12 @@ def serve_resource(resource_id, transfer_block_size=4096):
     - Set ``Last-Modified`` header (to the last modification date)
     - Honor the ``If-modified-since`` header (if the resource was not
       modified, return 304)
+    - Honor the ``If-None-Match`` header
 
     Planned features:
 
     - Return response as a stream, to avoid loading everything in memory.
-    - Honor the ``If-Match`` / ``If-None-Match`` headers
+    - Honor the ``If-Match`` header
     - Support ``Range`` requests + 206 partial response
     - Set ``Cache-control`` and ``Expire`` headers (?)
     - Properly support HEAD requests.
@@ -53,10 +97,17 @@ def serve_resource(resource_id, transfer_block_size=4096):
         'ETag': resource['hash'],
     }
 
+    # ------------------------------------------------------------
+    # Check the if-none-match header
+
+    if request.if_none_match:
+        if request.if_none_match.contains_weak(resource['hash']):
+            return Response('', status=304, headers=headers)
+
     # ------------------------------------------------------------
     # Check the if-modified-since header
 
-    if 'if-modified-since' in request.headers:
+    elif 'if-modified-since' in request.headers:
         try:
             if_modified_since_date = datetime.strptime(
                 request.headers['if-modified-since'],
@@ -0,0 +1,199 @@
+"""
+Disk-backed cache for remote HTTP resources.
+
+Responses carrying an ``ETag`` or ``Last-Modified`` header are stored
+on disk, keyed by URL; later requests for the same URL are sent with
+``If-None-Match`` / ``If-Modified-Since`` headers, and a ``304 Not
+Modified`` reply is served from the local copy.
+
+Each entry is made of two files:
+
+- ``<key>.json``, the entry metadata (url, validators, headers and
+  name of the data file);
+- ``<key>.<token>.data``, the response body.
+
+Both are written to temporary files and then renamed, so concurrent
+processes sharing the cache directory only ever see complete files.
+Data files are never overwritten: a new one (with a new token) is
+written on each update, so readers holding the old one open are not
+affected by the replacement.
+
+The total size of the data files is kept under a limit by removing
+the least recently used entries (the metadata file modification time
+is updated on each hit).
+"""
+
+from __future__ import absolute_import
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+import uuid
+
+from datacat.utils.files import file_copy
+
+logger = logging.getLogger(__name__)
+
+# Response headers stored along with the data
+CACHED_HEADERS = ['content-type', 'content-length', 'etag', 'last-modified']
+
+# Data / temporary files not referenced by any entry are removed after
+# this many seconds (they're left behind by concurrent updates of the
+# same entry, or by crashed writers).
+ORPHANS_MAX_AGE = 3600
+
+
+class HttpCache(object):
+    """
+    :param directory: the cache directory (created if missing)
+    :param max_size: maximum total size of the cached data, in bytes
+    """
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # Might have been created by another process
+                if not os.path.isdir(directory):
+                    raise
+
+    def get(self, url):
+        """
+        Get the metadata of a cache entry.
+
+        :return: a dict with ``url``, ``etag``, ``last_modified``,
+            ``headers``, ``size`` and ``data_file`` keys, or ``None``
+        """
+
+        try:
+            with open(self._meta_path(url), 'rb') as fp:
+                entry = json.load(fp)
+        except (IOError, ValueError):
+            return None
+
+        if entry.get('url') != url:  # Hash collision
+            return None
+        return entry
+
+    def open(self, entry):
+        """
+        Open the data file of an entry, marking it as recently used.
+
+        :raise IOError: if the entry was removed in the meantime
+        """
+
+        fp = open(os.path.join(self.directory, entry['data_file']), 'rb')
+        try:
+            os.utime(self._meta_path(entry['url']), None)
+        except OSError:
+            pass
+        return fp
+
+    def store(self, url, headers, src):
+        """
+        Store a response in the cache.
+
+        :param headers: the response headers
+        :param src: a file-like object, to read the body from
+        :return: the new entry (see :py:meth:`get`)
+        """
+
+        key = self._key(url)
+        data_file = '{0}.{1}.data'.format(key, uuid.uuid4().hex)
+        data_path = os.path.join(self.directory, data_file)
+
+        self._write_atomic(data_path, lambda fp: file_copy(src, fp))
+
+        entry = {
+            'url': url,
+            'etag': headers.get('etag'),
+            'last_modified': headers.get('last-modified'),
+            'headers': dict((name, headers[name])
+                            for name in CACHED_HEADERS if name in headers),
+            'size': os.path.getsize(data_path),
+            'data_file': data_file,
+        }
+
+        old_entry = self.get(url)
+        self._write_atomic(self._meta_path(url),
+                           lambda fp: json.dump(entry, fp))
+        if old_entry is not None:
+            self._remove_file(old_entry['data_file'])
+
+        self.evict(keep=url)
+        return entry
+
+    def evict(self, keep=None):
+        """
+        Remove the least recently used entries, until the total size
+        is under the limit, and old orphaned files.
+
+        :param keep: URL of an entry not to be removed
+        """
+
+        names = os.listdir(self.directory)
+        entries = []
+        referenced = set()
+        total_size = 0
+        for name in names:
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                mtime = os.path.getmtime(path)
+                with open(path, 'rb') as fp:
+                    entry = json.load(fp)
+            except (IOError, OSError, ValueError):
+                continue
+            referenced.add(entry['data_file'])
+            total_size += entry['size']
+            if entry['url'] != keep:
+                entries.append((mtime, path, entry))
+
+        min_mtime = time.time() - ORPHANS_MAX_AGE
+        for name in names:
+            if name.endswith('.json') or name in referenced:
+                continue
+            try:
+                if os.path.getmtime(os.path.join(self.directory, name)) \
+                        < min_mtime:
+                    self._remove_file(name)
+            except OSError:
+                pass
+
+        entries.sort()
+        while total_size > self.max_size and entries:
+            mtime, path, entry = entries.pop(0)
+            logger.debug("Evicting %s from the HTTP cache", entry['url'])
+            self._remove_file(path)
+            self._remove_file(entry['data_file'])
+            total_size -= entry['size']
+
+    def _key(self, url):
+        return hashlib.sha1(url).hexdigest()
+
+    def _meta_path(self, url):
+        return os.path.join(self.directory, self._key(url) + '.json')
+
+    def _write_atomic(self, path, write):
+        fd, temp_path = tempfile.mkstemp(
+            prefix='.tmp-', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                write(fp)
+            os.rename(temp_path, path)
+        except:
+            self._remove_file(temp_path)
+            raise
+
+    def _remove_file(self, name):
+        try:
+            os.unlink(os.path.join(self.directory, name))
+        except OSError:
+            pass
@@ -0,0 +1,167 @@
+"""
+JSON encoding / decoding, using the fastest available backend.
+
+Supported backends are, in order of preference:
+
++----------------+----------------------------------------------------+
+| Name           | Notes                                              |
++================+====================================================+
+| ``ujson``      | Only used for decoding, as it doesn't allow        |
+|                | customizing the encoding of unsupported objects    |
+|                | (eg. datetimes)                                    |
++----------------+----------------------------------------------------+
+| ``simplejson`` | Needs the C speedups to actually be faster         |
++----------------+----------------------------------------------------+
+| ``json``       | Standard library, always available                 |
++----------------+----------------------------------------------------+
+
+Datetime objects are encoded as strings, using
+:py:data:`datacat.utils.const.DATE_FORMAT`.
+
+``ujson`` is only used with precise float parsing (older versions
+default to a faster, but lossy, algorithm), as decoded values are
+written back to the database.
+
+The backend can be forced using the ``JSON_BACKEND`` setting: each
+application gets its own codec (see :py:func:`init_app`), used while
+its context is active; the process-wide default is used otherwise.
+"""
+
+from __future__ import absolute_import
+
+import datetime
+import functools
+import importlib
+
+from flask import current_app, has_app_context
+
+from datacat.utils.const import DATE_FORMAT
+
+BACKENDS = ['ujson', 'simplejson', 'json']
+
+# Backends that can be used for encoding
+ENCODING_BACKENDS = ['simplejson', 'json']
+
+
+def _default(obj):
+    if isinstance(obj, datetime.datetime):
+        return obj.strftime(DATE_FORMAT)
+    if isinstance(obj, datetime.date):
+        return obj.isoformat()
+    raise TypeError("{0!r} is not JSON serializable".format(obj))
+
+
+def _import_backend(name):
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        return None
+
+
+def _get_loads(name, module):
+    if name == 'ujson':
+        try:
+            module.loads('0.1', precise_float=True)
+        except TypeError:
+            pass  # ujson >= 2.0, always precise
+        else:
+            return functools.partial(module.loads, precise_float=True)
+    return module.loads
+
+
+class JSONCodec(object):
+    """
+    Encoder / decoder pair, using the selected backend modules.
+
+    :param backend:
+        Name of the backend to be used. ``None`` (default) means
+        "fastest available".
+
+    :raise ValueError: if the backend is not supported / not installed
+    """
+
+    def __init__(self, backend=None):
+        if backend is None:
+            backends = BACKENDS
+        elif backend in BACKENDS:
+            backends = [backend]
+        else:
+            raise ValueError("Unsupported JSON backend: {0}".format(backend))
+
+        decoder = encoder = None
+        for name in backends:
+            module = _import_backend(name)
+            if module is None:
+                continue
+            if decoder is None:
+                decoder = (name, module)
+            if encoder is None and name in ENCODING_BACKENDS:
+                encoder = (name, module)
+
+        if decoder is None:
+            raise ValueError("JSON backend not available: {0}"
+                             .format(backend))
+
+        if encoder is None:
+            # Decoding-only backend was requested: fall back
+            # to the standard library for encoding.
+            encoder = ('json', _import_backend('json'))
+
+        self.decoder_name = decoder[0]
+        self._loads = _get_loads(*decoder)
+        self.encoder_name, encoder_module = encoder
+        self._encoder = encoder_module.JSONEncoder(default=_default)
+
+    def __repr__(self):
+        return 'JSONCodec(encoder={0!r}, decoder={1!r})'.format(
+            self.encoder_name, self.decoder_name)
+
+    def dumps(self, obj):
+        return self._encoder.encode(obj)
+
+    def loads(self, data):
+        return self._loads(data)
+
+
+_codec = JSONCodec()
+
+
+def configure(backend=None):
+    """
+    Select the backend to be used by default, process-wide (outside
+    of application contexts).
+
+    :param backend: name of the backend, or ``None`` for "fastest".
+    """
+
+    global _codec
+    _codec = JSONCodec(backend)
+
+
+def init_app(app):
+    """Set up the codec for an application, as per ``JSON_BACKEND``"""
+
+    app.extensions['datacat.json_codec'] = JSONCodec(
+        app.config.get('JSON_BACKEND'))
+
+
+def get_codec():
+    """Get the codec of the current application, or the default one"""
+
+    if has_app_context():
+        codec = current_app.extensions.get('datacat.json_codec')
+        if codec is not None:
+            return codec
+    return _codec
+
+
+def dumps(obj):
+    """Encode an object to JSON, using the current codec"""
+
+    return get_codec().dumps(obj)
+
+
+def loads(data):
+    """Decode JSON data, using the current codec"""
+
+    return get_codec().loads(data)
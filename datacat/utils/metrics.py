@@ -0,0 +1,222 @@
+"""
+In-process metrics for plugin hooks and Celery tasks.
+
+The following metrics are recorded in the process-wide
+:py:data:`registry`:
+
++-------------------------------+-----------+----------------------------+
+| Name                          | Type      | Labels                     |
++===============================+===========+============================+
+| ``hook_calls``                | counter   | ``plugin``, ``hook``       |
++-------------------------------+-----------+----------------------------+
+| ``hook_exceptions``           | counter   | ``plugin``, ``hook``       |
++-------------------------------+-----------+----------------------------+
+| ``hook_duration_seconds``     | histogram | ``plugin``, ``hook``       |
++-------------------------------+-----------+----------------------------+
+| ``task_calls``                | counter   | ``task``                   |
++-------------------------------+-----------+----------------------------+
+| ``task_exceptions``           | counter   | ``task``                   |
++-------------------------------+-----------+----------------------------+
+| ``task_duration_seconds``     | histogram | ``task``                   |
++-------------------------------+-----------+----------------------------+
+| ``task_queue_wait_seconds``   | histogram | ``task``                   |
++-------------------------------+-----------+----------------------------+
+
+Each hook / task call is also logged to the ``datacat.utils.metrics`` logger,
+with the values in the ``extra`` record attributes (for structured
+logging); calls slower than ``METRICS_SLOW_THRESHOLD`` are logged
+as warnings.
+
+Note that metrics are per-process: task metrics are recorded by Celery
+workers, while the metrics endpoint reports those of the web process.
+Queue wait is measured using the clock of the publishing host.
+"""
+
+from collections import namedtuple
+import logging
+import threading
+import time
+
+from celery import signals, states
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the histogram buckets, in seconds
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+
+# Task message header holding the publishing time
+PUBLISHED_AT_HEADER = 'datacat_published_at'
+
+
+class Histogram(object):
+    """Cumulative histogram, with fixed buckets"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.bucket_counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, upper_bound in enumerate(self.buckets):
+            if value <= upper_bound:
+                self.bucket_counts[i] += 1
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'buckets': [{'le': upper_bound, 'count': count}
+                        for upper_bound, count
+                        in zip(self.buckets, self.bucket_counts)],
+        }
+
+
+class MetricKey(namedtuple('MetricKey', 'name,labels')):
+    """Named tuple identifying a metric (labels is a sorted tuple)"""
+
+    __slots__ = []
+
+
+class MetricsRegistry(object):
+    """
+    Thread-safe registry of counters and histograms, identified
+    by name and labels.
+    """
+
+    def __init__(self, slow_threshold=None):
+        self.slow_threshold = slow_threshold
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def increment(self, name, value=1, **labels):
+        key = MetricKey(name, tuple(sorted(labels.iteritems())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = MetricKey(name, tuple(sorted(labels.iteritems())))
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = Histogram()
+            self._histograms[key].observe(value)
+
+    def get_counter(self, name, **labels):
+        key = MetricKey(name, tuple(sorted(labels.iteritems())))
+        return self._counters.get(key, 0)
+
+    def get_histogram(self, name, **labels):
+        key = MetricKey(name, tuple(sorted(labels.iteritems())))
+        return self._histograms.get(key)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def snapshot(self):
+        """
+        Get the current values of all the metrics, as
+        JSON-serializable dicts.
+        """
+
+        with self._lock:
+            counters = [
+                {'name': key.name, 'labels': dict(key.labels), 'value': value}
+                for key, value in sorted(self._counters.iteritems())]
+            histograms = [
+                dict(histogram.to_dict(),
+                     name=key.name, labels=dict(key.labels))
+                for key, histogram in sorted(self._histograms.iteritems())]
+        return {'counters': counters, 'histograms': histograms}
+
+    def record_hook_call(self, plugin, hook_type, duration, exception=None):
+        """Record the execution of a hook handler"""
+
+        labels = {'plugin': get_plugin_name(plugin), 'hook': hook_type}
+        self.increment('hook_calls', **labels)
+        self.observe('hook_duration_seconds', duration, **labels)
+        if exception is not None:
+            self.increment('hook_exceptions', **labels)
+        self._log_call('hook_call', labels, duration, exception)
+
+    def record_task_call(self, task_name, duration, exception=None):
+        """Record the execution of a Celery task"""
+
+        labels = {'task': task_name}
+        self.increment('task_calls', **labels)
+        self.observe('task_duration_seconds', duration, **labels)
+        if exception is not None:
+            self.increment('task_exceptions', **labels)
+        self._log_call('task_call', labels, duration, exception)
+
+    def record_task_queue_wait(self, task_name, wait):
+        self.observe('task_queue_wait_seconds', wait, task=task_name)
+
+    def _log_call(self, event, labels, duration, exception):
+        slow = (self.slow_threshold is not None
+                and duration >= self.slow_threshold)
+        level = logging.WARNING if slow else logging.DEBUG
+        if not logger.isEnabledFor(level):
+            return
+
+        error = None if exception is None else repr(exception)
+        extra = dict(labels, event=event, duration=duration, slow=slow,
+                     error=error)
+        logger.log(level, "%s %s duration=%.3f error=%s", event,
+                   ' '.join('{0}={1}'.format(*x)
+                            for x in sorted(labels.iteritems())),
+                   duration, error, extra=extra)
+
+
+registry = MetricsRegistry()
+
+
+def get_plugin_name(plugin):
+    return getattr(plugin, '_import_name', None) or type(plugin).__name__
+
+
+def init_app(app):
+    """Configure the registry from the ``METRICS_*`` settings"""
+
+    registry.slow_threshold = app.config.get('METRICS_SLOW_THRESHOLD')
+
+
+# ----------------------------------------------------------------------
+# Celery tasks instrumentation (via signals, to cover all the tasks,
+# including the ones declared by plugins).
+
+_task_start_times = {}
+
+
+@signals.before_task_publish.connect
+def _on_before_task_publish(headers=None, **kwargs):
+    if headers is not None:
+        headers[PUBLISHED_AT_HEADER] = time.time()
+
+
+@signals.task_prerun.connect
+def _on_task_prerun(task_id=None, task=None, **kwargs):
+    now = time.time()
+    _task_start_times[task_id] = now
+
+    published_at = getattr(task.request, PUBLISHED_AT_HEADER, None)
+    if published_at is None:
+        headers = getattr(task.request, 'headers', None) or {}
+        published_at = headers.get(PUBLISHED_AT_HEADER)
+    if published_at is not None:
+        registry.record_task_queue_wait(task.name, max(0, now - published_at))
+
+
+@signals.task_postrun.connect
+def _on_task_postrun(task_id=None, task=None, state=None, retval=None,
+                     **kwargs):
+    start = _task_start_times.pop(task_id, None)
+    if start is None:
+        return
+    # On failure, the return value is the exception (info)
+    exception = retval if state == states.FAILURE else None
+    registry.record_task_call(task.name, time.time() - start, exception)
@@ -1,4 +1,26 @@
-from collections import Sequence, namedtuple
+from collections import OrderedDict, Sequence, namedtuple
+import atexit
+import heapq
+import itertools
+import logging
+import os
+import Queue
+import threading
+import time
+
+from celery import shared_task
+from celery.utils import uuid
+from flask import (
+    after_this_request, current_app, has_request_context, request)
+
+from datacat.db import (
+    attach_context_connections, close_context_connections, connect, db,
+    detach_context_connections, outbox)
+from datacat.db.changes import ChangeToken
+from datacat.utils import metrics
+from datacat.utils.resource_access import clear_resource_records
+
+logger = logging.getLogger(__name__)
 
 
 class HookExecutionResult(namedtuple('HookExecutionResult',
@@ -15,19 +37,399 @@ class HookExecutionResult(namedtuple('HookExecutionResult',
                     exception=self.exception)
 
 
+class HookTimeout(Exception):
+    """
+    Reported as the exception of a :py:class:`HookExecutionResult`,
+    when a hook handler didn't complete in time.
+    """
+
+    pass
+
+
+class _HandlerCall(object):
+    """
+    A hook handler call, to be run by a :py:class:`_HookWorkers`
+    thread, inside a new application context.
+    """
+
+    def __init__(self, app, handler, args, kwargs):
+        self.app = app
+        self.handler = handler
+        self.args = args
+        self.kwargs = kwargs
+        self.queued = time.time()
+        self.started = self.finished = None
+        self.result = self.exception = None
+        self.abandoned = self.replaced = False
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    def __call__(self, connections):
+        """
+        Run the handler, unless the call was abandoned in the meantime.
+
+        :param connections: database connections of the worker, to be
+            reused (see :py:func:`datacat.db.detach_context_connections`)
+        """
+
+        with self._lock:
+            if self.abandoned:
+                return
+            self.started = time.time()
+
+        try:
+            with self.app.app_context():
+                attach_context_connections(connections)
+                try:
+                    self.result = self.handler(*self.args, **self.kwargs)
+                finally:
+                    connections.clear()
+                    connections.update(detach_context_connections())
+        except Exception as e:
+            logger.exception("Hook handler %r failed", self.handler)
+            self.exception = e
+        finally:
+            with self._lock:
+                self.finished = time.time()
+                self._done.set()
+
+    def wait(self, timeout=None):
+        """
+        Wait for the call to complete, for at most ``timeout`` seconds
+        since it started. Time spent waiting for a free worker counts
+        too, up to ``timeout`` seconds.
+
+        :return: ``True`` if the call completed, ``False`` otherwise
+        """
+
+        if timeout is None:
+            self._done.wait()
+            return True
+
+        while not self._done.is_set():
+            remaining = (self.started or self.queued) + timeout - time.time()
+            if remaining <= 0:
+                break
+            self._done.wait(remaining)
+        return self._done.is_set()
+
+    def abandon(self, replace_worker):
+        """
+        Give up on a call that didn't complete in time: it won't be
+        started if it's still queued.
+
+        :param replace_worker: whether the worker running the call, if
+            any, is going to be replaced (it will exit once done).
+        :return: ``True`` if the worker is to be replaced
+        """
+
+        with self._lock:
+            if self._done.is_set():
+                return False
+            self.abandoned = True
+            self.replaced = replace_worker and self.started is not None
+            return self.replaced
+
+
+class _HookWorkers(object):
+    """
+    Pool of threads running :py:class:`_HandlerCall` objects.
+
+    Threads cannot be interrupted, so workers stuck running a call
+    that timed out are replaced by new ones (they exit once the call
+    completes), in order to keep the pool from filling up with hung
+    handlers; at most ``max_stuck`` of them are replaced, after which
+    calls just wait in the queue (and time out).
+
+    Each worker keeps its database connections across calls.
+
+    :param size: the number of workers
+    :param max_stuck: maximum number of stuck workers to be replaced
+    """
+
+    def __init__(self, size, max_stuck=None):
+        self.size = size
+        self.max_stuck = size if max_stuck is None else max_stuck
+        self.stuck = 0
+        self._queue = Queue.Queue()
+        self._lock = threading.Lock()
+        for _ in xrange(size):
+            self._start_worker()
+
+    def submit(self, call):
+        self._queue.put(call)
+
+    def abandon(self, call):
+        """Abandon a call that timed out, replacing its worker"""
+
+        with self._lock:
+            can_replace = self.stuck < self.max_stuck
+            if not call.abandon(can_replace):
+                if not can_replace and call.started is not None:
+                    logger.error("Too many stuck hook workers (%d): not"
+                                 " replacing the one running %r",
+                                 self.stuck, call.handler)
+                return
+            self.stuck += 1
+        self._start_worker()
+
+    def close(self):
+        """Stop the workers, once the queued calls have been run"""
+
+        for _ in xrange(self.size):
+            self._queue.put(None)
+
+    def _start_worker(self):
+        thread = threading.Thread(target=self._work)
+        thread.daemon = True
+        thread.start()
+
+    def _work(self):
+        connections = {}
+        try:
+            while True:
+                call = self._queue.get()
+                if call is None:
+                    return
+                call(connections)
+                if call.replaced:
+                    # Replaced by another worker while stuck
+                    with self._lock:
+                        self.stuck -= 1
+                    return
+        finally:
+            for conn in connections.itervalues():
+                conn.close()
+
+
 class PluginManager(Sequence):
-    def __init__(self, iterable):
+    """
+    Container for the enabled plugins, dispatching hook calls.
+
+    :param iterable: the plugin objects
+    :param async_hooks:
+        names of the hooks to be run in background, by Celery workers,
+        when called via :py:meth:`dispatch_hook` (one task per plugin,
+        see :py:func:`get_plugin_hook_task`).
+    :param parallel:
+        if ``True``, hook handlers are run concurrently, in a pool of
+        ``max_workers`` threads. Plugins can opt out, eg. if their
+        handlers need to run in order, by setting their
+        ``parallel_hooks`` attribute to ``False``.
+    :param hook_timeout:
+        maximum time (in seconds) to wait for each handler, when running
+        in parallel. Handlers not completing in time are reported with
+        a :py:class:`HookTimeout` exception (note that they will keep
+        running in background, as threads cannot be interrupted: their
+        workers are replaced, up to ``max_workers`` at a time, see
+        :py:class:`_HookWorkers`).
+    :param debounce:
+        dict mapping hook names to a time window, in seconds: calls
+        to these hooks for the same object (identified by the first
+        argument) are delayed, and if more calls come in within the
+        window, only the latest one is performed. Works for both
+        synchronous (see :py:class:`HookDebouncer`) and async hooks.
+    :param outbox:
+        if ``True``, hooks are not called by :py:meth:`dispatch_hook`;
+        instead, events are read from the transactional outbox and
+        delivered by :py:func:`drain_outbox`, run by a Celery task
+        (debouncing doesn't apply: events are coalesced per batch).
+
+    An index of the plugins handling each hook type is built when
+    plugins are loaded, so that dispatching a hook only involves the
+    relevant plugins. Use :py:meth:`enable_plugin` and
+    :py:meth:`disable_plugin` to change plugins at runtime, or call
+    :py:meth:`rebuild_hook_index` after registering handlers for new
+    hook types on already loaded plugins.
+    """
+
+    def __init__(self, iterable, async_hooks=(), parallel=False,
+                 max_workers=4, hook_timeout=None, debounce=None,
+                 debounce_max_wait=None, outbox=False):
         self._plugins = []
         self._plugins.extend(iterable)
+        self.async_hooks = frozenset(async_hooks)
+        self.debounce = dict(debounce or {})
+        self.debounce_max_wait = debounce_max_wait
+        self.debouncer = HookDebouncer(self)
+        self.outbox = outbox
+        self.parallel = parallel
+        self.max_workers = max_workers
+        self.hook_timeout = hook_timeout
+        self._workers = None
+        self._workers_pid = None
+        self.rebuild_hook_index()
+
+    def rebuild_hook_index(self):
+        """
+        Rebuild the ``hook_type -> (plugins, ...)`` dispatch index.
+
+        Handlers are still looked up on plugins at call time, so
+        handlers added for a hook type that was already indexed
+        are picked up without rebuilding.
+        """
+
+        index = {}
+        for plugin in self._plugins:
+            for hook_type, handlers in plugin._hooks.iteritems():
+                if handlers:
+                    index.setdefault(hook_type, []).append(plugin)
+
+        # Replaced as a whole, so concurrent readers always
+        # see a consistent index.
+        self._hook_index = dict(
+            (hook_type, tuple(plugins))
+            for hook_type, plugins in index.iteritems())
+
+    def enable_plugin(self, plugin):
+        """Add a plugin (at the end of the list) and update the index"""
+
+        if plugin not in self._plugins:
+            self._plugins.append(plugin)
+            self.rebuild_hook_index()
+
+    def disable_plugin(self, plugin):
+        """Remove a plugin and update the index"""
+
+        if plugin in self._plugins:
+            self._plugins.remove(plugin)
+            self.rebuild_hook_index()
+
+    def get_hook_plugins(self, hook_type):
+        """Get the plugins having handlers for a hook type, in order"""
+
+        return self._hook_index.get(hook_type, ())
 
     def call_hook(self, hook_type, *args, **kwargs):
         return list(self.call_hook_async(hook_type, *args, **kwargs))
 
+    def dispatch_hook(self, hook_type, *args, **kwargs):
+        """
+        Call a hook, either synchronously or, if the hook is listed
+        in ``async_hooks``, by enqueuing a Celery task running it.
+
+        This is meant to be called after changes have been committed,
+        as the tasks may run right away. Arguments must be serializable
+        as JSON.
+
+        Async hooks are run by a task for each plugin handling them,
+        so that plugins can be routed to their own queues / workers.
+
+        Hooks listed in ``debounce`` are delayed; pending calls are
+        discarded when an object is deleted (ie. when dispatching a
+        ``<type>_delete`` hook).
+
+        :return:
+            the ids of the enqueued Celery tasks (an empty list if the
+            hook was run synchronously).
+        """
+
+        if self.outbox:
+            # Events were already recorded in the outbox, in the same
+            # transaction as the change: just make sure it gets drained.
+            return [_enqueue_outbox_drain()]
+
+        if hook_type.endswith('_delete') and args:
+            self._cancel_debounced(hook_type, args[0])
+
+        window = self.debounce.get(hook_type)
+
+        if hook_type not in self.async_hooks:
+            if window:
+                self.debouncer.schedule(hook_type, args, kwargs, window,
+                                        self.debounce_max_wait)
+            else:
+                self.call_hook(hook_type, *args, **kwargs)
+            return []
+
+        if window:
+            return [_enqueue_debounced_hook(hook_type, args, kwargs, window,
+                                            self.debounce_max_wait)]
+
+        return [_enqueue_plugin_hook(plugin, hook_type, args, kwargs)
+                for plugin in self.get_hook_plugins(hook_type)]
+
+    def _cancel_debounced(self, hook_type, object_id):
+        object_type = hook_type.rsplit('_', 1)[0]
+        for other_type in self.debounce:
+            if other_type.rsplit('_', 1)[0] != object_type:
+                continue
+            if other_type in self.async_hooks:
+                _cancel_debounced_hook(other_type, object_id)
+            else:
+                self.debouncer.cancel(other_type, object_id)
+
     def call_hook_async(self, hook_type, *args, **kwargs):
-        for plugin in self._plugins:
-            for res in plugin.call_hook_async(hook_type, *args, **kwargs):
+        """
+        Call a hook on all the plugins.
+
+        :return:
+            an iterator of :py:class:`HookExecutionResult`, in plugin
+            (and handler registration) order.
+        """
+
+        if self.parallel:
+            return self._call_hook_parallel(hook_type, args, kwargs)
+        return self._call_hook_serial(hook_type, args, kwargs)
+
+    def _call_hook_serial(self, hook_type, args, kwargs):
+        for plugin in self.get_hook_plugins(hook_type):
+            for res in _timed_results(plugin, hook_type, args, kwargs):
                 yield res
 
+    def _call_hook_parallel(self, hook_type, args, kwargs):
+        app = current_app._get_current_object()
+
+        # Submit all the handlers first, so that they can run while
+        # we are waiting for / running the other ones.
+        calls = []
+        for plugin in self.get_hook_plugins(hook_type):
+            if not getattr(plugin, 'parallel_hooks', True):
+                calls.append((plugin, None))
+                continue
+            for handler in plugin._hooks.get(hook_type, ()):
+                call = _HandlerCall(app, handler, args, kwargs)
+                self._get_workers().submit(call)
+                calls.append((plugin, call))
+
+        for plugin, call in calls:
+            if call is None:
+                # Opted out: run handlers in order, in this thread
+                for res in _timed_results(plugin, hook_type, args, kwargs):
+                    yield res
+
+            elif call.wait(self.hook_timeout):
+                metrics.registry.record_hook_call(
+                    plugin, hook_type, call.finished - call.started,
+                    call.exception)
+                yield HookExecutionResult(plugin, call.result, call.exception)
+
+            else:
+                logger.warning("Hook handler %r timed out", call.handler)
+                self._get_workers().abandon(call)
+                exception = HookTimeout(
+                    "Hook handler {0!r} didn't complete in {1}s"
+                    .format(call.handler, self.hook_timeout))
+                metrics.registry.record_hook_call(
+                    plugin, hook_type, self.hook_timeout, exception)
+                yield HookExecutionResult(plugin, None, exception)
+
+    def _get_workers(self):
+        # Threads are not inherited by forked processes (eg. by Celery
+        # or a pre-forking WSGI server), so start them in each process.
+        if self._workers is None or self._workers_pid != os.getpid():
+            self._workers = _HookWorkers(self.max_workers)
+            self._workers_pid = os.getpid()
+            atexit.register(self._workers.close)
+        return self._workers
+
+    def close(self):
+        """Stop the threads running parallel hooks, if any"""
+
+        if self._workers is not None and self._workers_pid == os.getpid():
+            self._workers.close()
+        self._workers = None
+
     def __getitem__(self, item):
         return self._plugins[item]
 
@@ -39,3 +441,591 @@ class PluginManager(Sequence):
 
     def __contains__(self, item):
         return item in self._plugins
+
+
+def _timed_results(plugin, hook_type, args, kwargs):
+    """
+    Call a hook on a plugin, recording metrics for each
+    handler execution (see :py:mod:`datacat.utils.metrics`).
+    """
+
+    results = plugin.call_hook_async(hook_type, *args, **kwargs)
+    while True:
+        start = time.time()
+        try:
+            res = next(results)
+        except StopIteration:
+            return
+        metrics.registry.record_hook_call(
+            plugin, hook_type, time.time() - start, res.exception)
+        yield res
+
+
+class _DebouncedCall(object):
+    __slots__ = ['app', 'args', 'kwargs', 'first_scheduled', 'deadline']
+
+    def __init__(self, app, args, kwargs, first_scheduled, deadline):
+        self.app = app
+        self.args = args
+        self.kwargs = kwargs
+        self.first_scheduled = first_scheduled
+        self.deadline = deadline
+
+
+class HookDebouncer(object):
+    """
+    In-process debouncing of hook calls: calls are delayed by a time
+    window, and if more calls for the same hook and object (the first
+    argument) come in within the window, only the latest one is
+    performed, with the latest arguments (ie. the latest state).
+    Calls are never delayed by more than ``max_wait`` seconds since
+    the first of the merged ones.
+
+    Deadlines are kept in a heap, watched by a single scheduler thread
+    (started on first use, in each process), which runs the due calls
+    one at a time, each in a new application context. Pending calls are
+    run when the process exits (eg. when a WSGI server recycles it),
+    but are still lost if it's killed: use ``HOOKS_OUTBOX`` for
+    at-least-once delivery.
+
+    :param plugins: the :py:class:`PluginManager` running the hooks
+    :param clock: function returning the current time, in seconds
+    """
+
+    def __init__(self, plugins, clock=time.time):
+        self._plugins = plugins
+        self._clock = clock
+        self._cond = threading.Condition()
+        self._pending = {}
+        self._heap = []
+        self._counter = itertools.count()
+        self._thread_pid = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def schedule(self, hook_type, args, kwargs, window, max_wait=None):
+        """
+        Schedule a hook call, replacing any pending call
+        for the same object.
+        """
+
+        app = current_app._get_current_object()
+        key = hook_type, args[0]
+        now = self._clock()
+
+        with self._cond:
+            previous = self._pending.get(key)
+            first = now if previous is None else previous.first_scheduled
+            deadline = now + window
+            if max_wait is not None:
+                deadline = min(deadline, first + max_wait)
+
+            call = _DebouncedCall(app, args, kwargs, first, deadline)
+            self._pending[key] = call
+            heapq.heappush(self._heap, (deadline, next(self._counter),
+                                        key, call))
+            self._start_scheduler()
+            self._cond.notify()
+
+    def get_deadline(self, hook_type, object_id):
+        """
+        Get the time the pending call for an object is due at.
+
+        :return: a timestamp (see ``clock``), or ``None``
+        """
+
+        call = self._pending.get((hook_type, object_id))
+        return None if call is None else call.deadline
+
+    def cancel(self, hook_type, object_id):
+        """
+        Discard the pending call for an object, if any.
+
+        :return: ``True`` if a call was pending
+        """
+
+        with self._cond:
+            return self._pending.pop((hook_type, object_id), None) is not None
+
+    def flush(self):
+        """
+        Run all the pending calls right away, in the current thread
+        (called when the process exits).
+
+        Handlers are run one at a time, even if the plugin manager is
+        ``parallel``, as its threads might have been stopped already.
+        """
+
+        with self._cond:
+            pending, self._pending = self._pending, {}
+            self._heap = []
+
+        for key, call in pending.iteritems():
+            self._fire(key, call, serial=True)
+
+    def _start_scheduler(self):
+        # Threads are not inherited by forked processes
+        if self._thread_pid != os.getpid():
+            thread = threading.Thread(target=self._run_scheduler)
+            thread.daemon = True
+            thread.start()
+            self._thread_pid = os.getpid()
+            atexit.register(self.flush)
+
+    def _run_scheduler(self):
+        while True:
+            with self._cond:
+                key, call = self._pop_due()
+                while call is None:
+                    timeout = None
+                    if self._heap:
+                        timeout = max(0, self._heap[0][0] - self._clock())
+                    self._cond.wait(timeout)
+                    key, call = self._pop_due()
+            self._fire(key, call)
+
+    def _pop_due(self):
+        now = self._clock()
+        while self._heap and self._heap[0][0] <= now:
+            _, _, key, call = heapq.heappop(self._heap)
+            if self._pending.get(key) is call:
+                del self._pending[key]
+                return key, call
+            # Otherwise, superseded by a later call, or cancelled
+        return None, None
+
+    def _fire(self, key, call, serial=False):
+        with call.app.app_context():
+            try:
+                if serial:
+                    list(self._plugins._call_hook_serial(
+                        key[0], call.args, call.kwargs))
+                else:
+                    self._plugins.call_hook(
+                        key[0], *call.args, **call.kwargs)
+            except Exception:
+                logger.exception("Debounced hook %s failed", key[0])
+            finally:
+                close_context_connections()
+
+
+def _enqueue_debounced_hook(hook_type, args, kwargs, window, max_wait=None):
+    """
+    Enqueue a delayed Celery task running a hook; the id of the latest
+    task for each hook / object is stored in the ``hook_debounce``
+    table, so that superseded tasks can skip execution, along with the
+    time the first of the merged calls was scheduled, in order to
+    honor ``max_wait``.
+    """
+
+    task_id = uuid()
+    with db, db.cursor() as cur:
+        cur.execute("""
+        INSERT INTO "hook_debounce" ("hook_type", "object_id", "token")
+        VALUES (%(hook_type)s, %(object_id)s, %(token)s)
+        ON CONFLICT ("hook_type", "object_id")
+        DO UPDATE SET "token" = EXCLUDED."token"
+        RETURNING extract(epoch FROM now() - "first_scheduled") AS "age";
+        """, dict(hook_type=hook_type, object_id=str(args[0]),
+                  token=task_id))
+        age = cur.fetchone()['age']
+
+    countdown = window
+    if max_wait is not None:
+        countdown = max(0, min(window, max_wait - float(age)))
+
+    call_debounced_hook_task.apply_async(
+        args=(hook_type,) + args, kwargs=kwargs, task_id=task_id,
+        countdown=countdown, serializer='json')
+    return task_id
+
+
+def _cancel_debounced_hook(hook_type, object_id):
+    with db, db.cursor() as cur:
+        cur.execute("""
+        DELETE FROM "hook_debounce"
+        WHERE "hook_type" = %(hook_type)s AND "object_id" = %(object_id)s;
+        """, dict(hook_type=hook_type, object_id=str(object_id)))
+
+
+class HookCoalescer(object):
+    """
+    Collect changes to objects (eg. made during a batch of operations),
+    in order to call the plugin hooks only once per object, with its
+    final state, after the changes have been committed.
+
+    Hooks are named after the object type and operation, eg.
+    ``dataset_create``, ``dataset_update`` and ``dataset_delete``:
+
+    - create + update(s) result in a single ``create`` (with the
+      final data)
+    - multiple updates result in a single ``update``
+    - update(s) + delete result in a single ``delete``
+    - create + delete result in no hook call at all
+    """
+
+    def __init__(self):
+        self._changes = OrderedDict()
+
+    def __len__(self):
+        return len(self._changes)
+
+    def add(self, object_type, object_id, operation, data=None):
+        """
+        Record a change.
+
+        :param operation: one of ``create``, ``update`` or ``delete``
+        :param data: the new data for the object, if any
+        """
+
+        if operation not in ('create', 'update', 'delete'):
+            raise ValueError("Invalid operation: {0}".format(operation))
+
+        key = object_type, object_id
+        previous = self._changes.pop(key, (None, None))[0]
+
+        if previous == 'create':
+            if operation == 'delete':
+                return  # Plugins never saw this object
+            operation = 'create'
+
+        self._changes[key] = (operation, data)
+
+    def update(self, other):
+        """Add all the changes recorded by another coalescer"""
+
+        for (object_type, object_id), (operation, data) \
+                in other._changes.iteritems():
+            self.add(object_type, object_id, operation, data)
+
+    def iter_calls(self):
+        """
+        Iterate ``(hook_type, args)`` tuples for the recorded changes,
+        in order.
+        """
+
+        for (object_type, object_id), (operation, data) \
+                in self._changes.iteritems():
+            hook_type = '{0}_{1}'.format(object_type, operation)
+            if operation == 'delete':
+                yield hook_type, (object_id,)
+            else:
+                yield hook_type, (object_id, data)
+
+    def call_hooks(self, plugins):
+        """
+        Call the hooks for all the recorded changes, in order.
+
+        :param plugins: a :py:class:`PluginManager`
+        :return: ids of the Celery tasks enqueued for async hooks
+        """
+
+        task_ids = []
+        for hook_type, args in self.iter_calls():
+            for task_id in plugins.dispatch_hook(hook_type, *args):
+                if task_id not in task_ids:
+                    task_ids.append(task_id)
+        self._changes.clear()
+        return task_ids
+
+
+# ----------------------------------------------------------------------
+# Outbox dispatcher
+
+
+def register_outbox_consumers(conn, plugin_names):
+    """
+    Make sure all the plugins have a position in the outbox: plugins
+    start receiving events from the moment they are first registered.
+    Use :py:func:`replay_outbox` to deliver older events.
+
+    :param plugin_names: plugin import names (no need to load them)
+    """
+
+    with conn, conn.cursor() as cur:
+        for name in plugin_names:
+            outbox.register_consumer(cur, name)
+
+
+def replay_outbox(conn, plugin_name, since=None):
+    """
+    Move the outbox position of a plugin back, so that events will be
+    delivered again by the next :py:func:`drain_outbox` run.
+
+    :param plugin_name: the plugin import name
+    :param since: a ``ChangeToken``; ``None`` means "from the start"
+    """
+
+    with conn, conn.cursor() as cur:
+        outbox.set_cursor(cur, plugin_name, since or ChangeToken(0, 0))
+
+
+def drain_outbox(plugins, conn, batch_size=100, max_attempts=None):
+    """
+    Deliver pending events from the outbox (see
+    :py:mod:`datacat.db.outbox`) to the plugins, in batches.
+
+    Events in a batch are coalesced per object; the position of each
+    plugin is advanced only after all the events in the batch have
+    been delivered without exceptions, otherwise they will be delivered
+    again on the next run (at-least-once delivery).
+
+    Events are read, and positions updated, in short transactions:
+    hooks are called outside of them, so that no snapshot is held while
+    they run, and a session-level advisory lock makes sure that events
+    are delivered to each plugin by one dispatcher at a time.
+
+    :param plugins: a :py:class:`PluginManager`
+    :param conn:
+        a connection to be used (only) for reading events and
+        updating positions, as it holds the locks during delivery.
+    :param batch_size: maximum number of events in each batch
+    :param max_attempts:
+        after this many failed runs, hook calls still failing are
+        recorded in the ``hook_outbox_dead_letter`` table and skipped,
+        so that a single event can't block a plugin forever. ``None``
+        (default) means "retry forever".
+    :return: the number of hook calls performed
+    """
+
+    calls_count = 0
+    for plugin in plugins:
+        consumer = metrics.get_plugin_name(plugin)
+        with conn, conn.cursor() as cur:
+            if not outbox.try_lock_consumer(cur, consumer):
+                continue  # Being drained by another dispatcher
+        try:
+            calls_count += _drain_plugin_outbox(
+                plugins, plugin, consumer, conn, batch_size, max_attempts)
+        finally:
+            with conn, conn.cursor() as cur:
+                outbox.unlock_consumer(cur, consumer)
+
+    return calls_count
+
+
+def _drain_plugin_outbox(plugins, plugin, consumer, conn, batch_size,
+                         max_attempts):
+    calls_count = 0
+    complete = False
+    while not complete:
+        with conn, conn.cursor() as cur:
+            position, attempts = outbox.get_cursor(cur, consumer)
+            events, next_position, complete = outbox.get_events(
+                cur, position, limit=batch_size)
+
+        hooks = HookCoalescer()
+        for object_type, object_id, operation, data in events:
+            hooks.add(object_type, object_id, operation, data)
+
+        # On the last attempt, deliver all the events anyway,
+        # collecting the failed ones.
+        last_attempt = (max_attempts is not None
+                        and attempts + 1 >= max_attempts)
+        failures = []
+        for hook_type, args in hooks.iter_calls():
+            if plugin not in plugins.get_hook_plugins(hook_type):
+                continue
+            # Don't serve records loaded for earlier events
+            clear_resource_records()
+            for res in _timed_results(plugin, hook_type, args, {}):
+                calls_count += 1
+                if res.exception is not None:
+                    failures.append((hook_type, args, repr(res.exception)))
+            if failures and not last_attempt:
+                break
+
+        with conn, conn.cursor() as cur:
+            if failures and not last_attempt:
+                outbox.record_failure(cur, consumer, failures[0][2])
+            else:
+                for hook_type, args, error in failures:
+                    outbox.add_dead_letter(
+                        cur, consumer, hook_type, args, error)
+                outbox.set_cursor(cur, consumer, next_position)
+
+        if failures and not last_attempt:
+            logger.warning("Delivery of outbox events to %s failed (attempt"
+                           " %d); will retry from %s", consumer,
+                           attempts + 1, position)
+            break
+
+        if failures:
+            logger.error("Delivery of %d outbox events to %s failed %d"
+                         " times: moved to the dead letter table",
+                         len(failures), consumer, attempts + 1)
+
+    return calls_count
+
+
+# Per-plugin hook tasks, by plugin name
+_plugin_hook_tasks = {}
+
+
+def get_plugin_hook_task(plugin):
+    """
+    Get the Celery task running hooks for a plugin, declared (on first
+    use) with the plugin's ``task`` decorator, and named
+    ``<plugin name>.call_hook``: as with the other tasks of the plugin,
+    it can be routed to a dedicated queue, and configured (eg. rate
+    limits, retries) via the Celery task annotations.
+
+    Plugins are expected to be loaded by Celery workers too, in order
+    for their tasks to be registered.
+
+    :return: the task, or ``None`` if the plugin doesn't support tasks
+    """
+
+    if getattr(plugin, 'task', None) is None:
+        return None
+
+    name = metrics.get_plugin_name(plugin)
+    task = _plugin_hook_tasks.get(name)
+    if task is None:
+        def call_hook(hook_type, *args, **kwargs):
+            return _call_plugin_hook_summary(name, hook_type, args, kwargs)
+
+        task = _plugin_hook_tasks[name] = plugin.task(
+            name=name + '.call_hook')(call_hook)
+    return task
+
+
+def _enqueue_plugin_hook(plugin, hook_type, args, kwargs):
+    task = get_plugin_hook_task(plugin)
+    if task is None:
+        result = call_plugin_hook_task.apply_async(
+            args=(metrics.get_plugin_name(plugin), hook_type) + args,
+            kwargs=kwargs, serializer='json')
+    else:
+        result = task.apply_async(
+            args=(hook_type,) + args, kwargs=kwargs, serializer='json')
+    return result.id
+
+
+@shared_task(name='datacat.call_hook', serializer='json')
+def call_hook_task(hook_type, *args, **kwargs):
+    """
+    Celery task running a hook on all the enabled plugins.
+
+    :return:
+        a summary of the execution, as a list of dicts with
+        ``plugin`` and ``exception`` keys.
+    """
+
+    return _call_hook_summary(hook_type, args, kwargs)
+
+
+@shared_task(name='datacat.call_plugin_hook', serializer='json')
+def call_plugin_hook_task(plugin_name, hook_type, *args, **kwargs):
+    """
+    Celery task running a hook on a single plugin, used for plugins
+    not declaring their own tasks (see :py:func:`get_plugin_hook_task`).
+
+    :return: the same as :py:func:`call_hook_task`
+    """
+
+    return _call_plugin_hook_summary(plugin_name, hook_type, args, kwargs)
+
+
+@shared_task(name='datacat.call_debounced_hook', bind=True,
+             serializer='json')
+def call_debounced_hook_task(self, hook_type, *args, **kwargs):
+    """
+    Celery task running a debounced hook, unless a later
+    call for the same object superseded it.
+
+    As with other async hooks, the hook is run by a task for
+    each plugin (see :py:func:`get_plugin_hook_task`).
+
+    :return:
+        the ids of the enqueued tasks, or ``None``
+        if the call was superseded.
+    """
+
+    with db, db.cursor() as cur:
+        cur.execute("""
+        DELETE FROM "hook_debounce"
+        WHERE "hook_type" = %(hook_type)s AND "object_id" = %(object_id)s
+        AND "token" = %(token)s
+        RETURNING "token";
+        """, dict(hook_type=hook_type, object_id=str(args[0]),
+                  token=self.request.id))
+        if cur.fetchone() is None:
+            return None
+
+    return [_enqueue_plugin_hook(plugin, hook_type, args, kwargs)
+            for plugin in current_app.plugins.get_hook_plugins(hook_type)]
+
+
+def _enqueue_outbox_drain():
+    """
+    Enqueue a task draining the outbox. During requests, a single
+    task is enqueued, once the view has returned (ie. all its changes
+    have been committed), however many hooks were dispatched.
+
+    :return: the task id
+    """
+
+    if not has_request_context():
+        return drain_outbox_task.apply_async(serializer='json').id
+
+    task_id = request.environ.get('datacat.outbox_drain_task')
+    if task_id is None:
+        task_id = request.environ['datacat.outbox_drain_task'] = uuid()
+
+        @after_this_request
+        def _drain_outbox(response):
+            drain_outbox_task.apply_async(task_id=task_id, serializer='json')
+            return response
+
+    return task_id
+
+
+@shared_task(name='datacat.drain_hook_outbox', serializer='json')
+def drain_outbox_task():
+    """
+    Celery task delivering pending events from the outbox.
+
+    Besides being enqueued after changes (once per request, see
+    :py:func:`_enqueue_outbox_drain`), it should be scheduled
+    to run periodically (eg. with Celery Beat), to deliver events left
+    behind by crashes / failures.
+
+    :return: the number of hook calls performed
+    """
+
+    config = current_app.config
+    conn = connect(**config['DATABASE'])
+    try:
+        return drain_outbox(current_app.plugins, conn,
+                            batch_size=config['HOOKS_OUTBOX_BATCH_SIZE'],
+                            max_attempts=config['HOOKS_OUTBOX_MAX_ATTEMPTS'])
+    finally:
+        conn.close()
+
+
+def _call_hook_summary(hook_type, args, kwargs):
+    clear_resource_records()
+    results = current_app.plugins.call_hook(hook_type, *args, **kwargs)
+    return _summarize_results(results)
+
+
+def _call_plugin_hook_summary(plugin_name, hook_type, args, kwargs):
+    clear_resource_records()
+    for plugin in current_app.plugins.get_hook_plugins(hook_type):
+        if metrics.get_plugin_name(plugin) == plugin_name:
+            return _summarize_results(
+                _timed_results(plugin, hook_type, args, kwargs))
+
+    # Disabled after the task was enqueued
+    logger.warning("Plugin %s doesn't handle %s hooks (anymore)",
+                   plugin_name, hook_type)
+    return []
+
+
+def _summarize_results(results):
+    return [{'plugin': getattr(res.plugin, '_import_name', repr(res.plugin)),
+             'exception': None if res.exception is None
+             else repr(res.exception)}
+            for res in results]
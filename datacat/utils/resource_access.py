@@ -22,19 +22,29 @@ The accessors distributed with the core provide support for the following urls:
 """
 
 from urlparse import urlparse
+from multiprocessing.pool import ThreadPool
 import abc
 import cgi
 import datetime
+import hashlib
+import logging
+import os
+import threading
 
-from flask import current_app
+from flask import current_app, g, has_app_context
 from werkzeug.utils import cached_property
 import requests
+import requests.adapters
+from requests.structures import CaseInsensitiveDict
 
 from datacat.db import db
 from datacat.utils.const import HTTP_DATE_FORMAT
-from datacat.utils.files import file_copy
+from datacat.utils.files import file_copy, file_read_chunks
+from datacat.utils.http_cache import HttpCache
 from datacat.utils.plugin_loading import import_object
 
+logger = logging.getLogger(__name__)
+
 
 def open_resource(url):
     """
@@ -43,7 +53,7 @@ def open_resource(url):
     """
 
     accessors = get_resource_accessors()
-    scheme = urlparse(url).scheme
+    scheme = _get_scheme(url)
     try:
         accessor = accessors[scheme]
     except KeyError:
@@ -54,6 +64,12 @@ def open_resource(url):
         return accessor(url)
 
 
+def _get_scheme(url):
+    # Much cheaper than urlparse(), and enough to find the accessor
+    scheme, sep, rest = url.partition(':')
+    return scheme.lower() if sep else ''
+
+
 def get_resource_accessors():
     """
     Get a dictionary mapping URL scheme names to accessor
@@ -62,17 +78,77 @@ def get_resource_accessors():
     The map will be taken from the ``RESOURCE_ACCESSORS``
     setting; accessors referenced by name will be replaced
     with the actual class.
+
+    The result is cached on the application, until the setting
+    changes: it must not be modified.
     """
 
-    accessors = current_app.config['RESOURCE_ACCESSORS']
+    app = current_app._get_current_object()
+    accessors = app.config['RESOURCE_ACCESSORS']
+    cached = app.extensions.get('datacat.resource_accessors')
+    if cached is not None and cached[0] == accessors:
+        return cached[1]
+
     _accessors = {}
     for key, val in accessors.iteritems():
         if isinstance(val, basestring):
             val = import_object(val)
         _accessors[key] = val
+    app.extensions['datacat.resource_accessors'] = (
+        dict(accessors), _accessors)
     return _accessors
 
 
+_http_session = None
+_http_session_pid = None
+_http_session_lock = threading.Lock()
+
+
+def get_http_session():
+    """
+    Get the process-wide ``requests`` session, used to access HTTP
+    resources: connections are kept alive and reused, according to
+    the ``HTTP_POOL_CONNECTIONS`` (number of hosts to keep connections
+    for) and ``HTTP_POOL_MAXSIZE`` (connections per host) settings.
+    """
+
+    global _http_session, _http_session_pid
+
+    # Connections cannot be shared with forked processes (eg. by
+    # Celery or a pre-forking WSGI server), so create one per process.
+    if _http_session is None or _http_session_pid != os.getpid():
+        with _http_session_lock:
+            if _http_session is None or _http_session_pid != os.getpid():
+                config = current_app.config if has_app_context() else {}
+                adapter = requests.adapters.HTTPAdapter(
+                    pool_connections=config.get('HTTP_POOL_CONNECTIONS', 10),
+                    pool_maxsize=config.get('HTTP_POOL_MAXSIZE', 10))
+                session = requests.Session()
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _http_session = session
+                _http_session_pid = os.getpid()
+    return _http_session
+
+
+def get_http_cache():
+    """
+    Get the cache for HTTP resources, if enabled (by setting
+    ``HTTP_CACHE_DIR``), or ``None``.
+    """
+
+    if not has_app_context():
+        return None
+    config = current_app.config
+    if not config.get('HTTP_CACHE_DIR'):
+        return None
+    return HttpCache(config['HTTP_CACHE_DIR'], config['HTTP_CACHE_MAX_SIZE'])
+
+
+class _RangesNotSupported(Exception):
+    pass
+
+
 class ResourceAccessError(Exception):
     pass
 
@@ -133,6 +209,10 @@ class BaseResourceAccessor(object):
         src = self.open_resource()
         file_copy(src, dest, blocksize=blocksize)
 
+    def close(self):
+        """Release any resource held by the accessor"""
+        pass
+
     @property
     def last_modified(self):
         """Get the last modified date for this object"""
@@ -150,6 +230,50 @@ class BaseResourceAccessor(object):
 
 
 class InternalResourceAccessor(BaseResourceAccessor):
+    """
+    Allow accessing resources from the internal storage.
+
+    The resource record is loaded once per accessor, and kept in an
+    identity map for the current application context (ie. request or
+    task), so that opening the same resource again doesn't query the
+    database; records for many accessors can be loaded with a single
+    query using :py:meth:`preload`.
+
+    The identity map is cleared at the start of each request and before
+    each hook call run by tasks; views changing a resource must remove
+    it with :py:func:`forget_resource_record`.
+    """
+
+    _RECORD_COLUMNS = 'id, mimetype, mtime, data_oid'
+
+    @classmethod
+    def preload(cls, accessors):
+        """
+        Load the records for many accessors with a single query
+        (skipping the ones already loaded).
+
+        Accessors for resources that don't exist are left alone: the
+        error will be raised when they're used.
+        """
+
+        records = _get_resource_records_map()
+        ids = set(accessor._resource_id for accessor in accessors
+                  if '_resource_record' not in accessor.__dict__)
+        missing_ids = [x for x in ids if x not in records]
+
+        if missing_ids:
+            with db, db.cursor() as cur:
+                cur.execute("""
+                SELECT {0} FROM "resource" WHERE id = ANY(%(ids)s);
+                """.format(cls._RECORD_COLUMNS), dict(ids=missing_ids))
+                for row in cur:
+                    records[row['id']] = row
+
+        for accessor in accessors:
+            if accessor._resource_id in records:
+                accessor.__dict__['_resource_record'] = \
+                    records[accessor._resource_id]
+
     def open_resource(self):
         oid = self._resource_record['data_oid']
         return db.lobject(oid=oid, mode='rb')
@@ -184,39 +308,334 @@ class InternalResourceAccessor(BaseResourceAccessor):
             raise ValueError("Invalid resource id: {0}"
                              .format(parsed_url.path.strip('/')))
 
-    @property
+    @cached_property
     def _resource_record(self):
+        records = _get_resource_records_map()
+        if self._resource_id in records:
+            return records[self._resource_id]
+
         with db, db.cursor() as cur:
             cur.execute("""
-            SELECT id, mimetype, mtime, data_oid
-            FROM "resource" WHERE id = %(id)s;
-            """, dict(id=self._resource_id))
+            SELECT {0} FROM "resource" WHERE id = %(id)s;
+            """.format(self._RECORD_COLUMNS), dict(id=self._resource_id))
             resource = cur.fetchone()
 
         if resource is None:
             raise ResourceNotFound(
                 "The resource was not found in the database")
 
+        records[self._resource_id] = resource
         return resource
 
 
+def _get_resource_records_map():
+    """
+    Get the identity map (resource id -> record) for the current
+    application context, or a throwaway one outside of it.
+    """
+
+    if not has_app_context():
+        return {}
+    if not hasattr(g, '_resource_records'):
+        g._resource_records = {}
+    return g._resource_records
+
+
+def clear_resource_records():
+    """
+    Clear the resource records identity map for the current application
+    context, so that accessors created afterwards load the records
+    again (eg. between the events handled by a long-running task).
+    """
+
+    if has_app_context():
+        g._resource_records = {}
+
+
+def forget_resource_record(resource_id):
+    """
+    Remove a resource record from the identity map for the current
+    application context, after changing or deleting the resource.
+    """
+
+    _get_resource_records_map().pop(resource_id, None)
+
+
+def init_app(app):
+    """
+    Make the resource records identity map request-scoped (application
+    contexts can be shared by many requests, eg. in tests).
+    """
+
+    app.before_request(clear_resource_records)
+
+
 class HttpResourceAccessor(BaseResourceAccessor):
     """
-    Allow accessing an HTTP resource
+    Allow accessing an HTTP resource, using the pooled session from
+    :py:func:`get_http_session`.
+
+    Metadata is read from the headers of the response to the ``GET``
+    request made by :py:meth:`open_resource` or, if not opened yet,
+    of a ``HEAD`` request (falling back to a ``GET``, whose body is
+    kept for :py:meth:`open_resource`, if the server doesn't support
+    ``HEAD``).
+
+    If the HTTP cache is enabled (see :py:func:`get_http_cache`),
+    resources are downloaded to the cache, and revalidated with a
+    conditional request when opened again.
+
+    Large resources are saved by :py:meth:`save_to_file` downloading
+    multiple byte ranges concurrently, if the server supports that.
     """
 
+    # Unconsumed response to a GET request, to be used
+    # by the next call to open_resource().
+    _response = None
+
     def open_resource(self):
+        cache = get_http_cache()
+        if cache is not None:
+            fp = self._open_cached(cache)
+            if fp is not None:
+                return fp
+
         # Note: we cannot cache response as the body will
-        #       be consumed the first time it is iterater
-        resp = requests.get(self.url, stream=True)
-        self.__dict__['_headers'] = resp.headers  # Cache them!
+        #       be consumed the first time it is iterated
+        resp, self._response = self._response, None
+        if resp is None:
+            resp = self._request('GET')
+            self.__dict__['_headers'] = resp.headers  # Cache them!
         return resp.raw
 
     @cached_property
     def _headers(self):
-        resp = requests.get(self.url, stream=True)
+        resp = self._request('HEAD')
+        if resp.status_code in (405, 501):
+            # HEAD not supported
+            resp.close()
+            self._discard_response()
+            resp = self._response = self._request('GET')
         return resp.headers
 
+    def _discard_response(self):
+        """Close the pending response (if any), releasing its connection"""
+
+        resp, self._response = self._response, None
+        if resp is not None:
+            resp.close()
+
+    def close(self):
+        """
+        Release the connection held by a response fetched to read
+        metadata, if it was never consumed.
+        """
+
+        self._discard_response()
+
+    def save_to_file(self, dest, blocksize=65536, segments=None,
+                     checksum=None):
+        """
+        Save the resource to file.
+
+        If the resource is larger than ``HTTP_SEGMENTED_MIN_SIZE`` and
+        the server accepts byte ranges, it's downloaded in ``segments``
+        (default: ``HTTP_DOWNLOAD_SEGMENTS``) parts concurrently, each
+        written at its offset in the (preallocated) destination file;
+        otherwise (or if the HTTP cache is enabled), as a single stream.
+
+        :param dest: a file object; segmented downloads require a
+            regular file, opened for writing.
+        :param checksum: optional ``<algorithm>:<hexdigest>`` (eg.
+            ``sha1:...``, as the resources ``hash``), to be verified
+            after downloading.
+        :raise ResourceAccessFailure: if the size of the downloaded
+            data doesn't match the ``Content-length``, or the checksum
+            doesn't match.
+        """
+
+        config = current_app.config if has_app_context() else {}
+        if segments is None:
+            segments = config.get('HTTP_DOWNLOAD_SEGMENTS', 1)
+        min_size = config.get('HTTP_SEGMENTED_MIN_SIZE', 0)
+
+        size = self._headers.get('content-length')
+        size = int(size) if size is not None else None
+        accept_ranges = self._headers.get('accept-ranges', 'none')
+
+        segmented = (segments > 1 and size is not None and size >= min_size
+                     and accept_ranges.lower() == 'bytes'
+                     and get_http_cache() is None
+                     and os.path.isfile(getattr(dest, 'name', '')))
+        if segmented:
+            try:
+                written = self._download_segmented(
+                    dest, size, segments, blocksize)
+            except _RangesNotSupported:
+                logger.warning("Byte ranges not supported for %s: falling"
+                               " back to a single stream", self.url)
+                dest.seek(0)
+                dest.truncate()
+                segmented = False
+
+        if not segmented:
+            written = file_copy(self.open_resource(), dest,
+                                blocksize=blocksize)
+        dest.flush()
+
+        if size is not None and written != size:
+            raise ResourceAccessFailure(
+                "Downloaded size of {0} ({1}) doesn't match the expected "
+                "one ({2})".format(self.url, written, size))
+        if checksum is not None:
+            if not os.path.isfile(getattr(dest, 'name', '')):
+                raise ValueError("Verifying checksums requires saving"
+                                 " to a regular file")
+            self._verify_checksum(dest.name, checksum, blocksize)
+
+    def _download_segmented(self, dest, size, segments, blocksize):
+        # Ranges are requested separately
+        self._discard_response()
+
+        # Preallocate the whole file
+        dest.truncate(size)
+        dest.flush()
+
+        segment_size = -(-size // segments)  # Round up
+        ranges = [(start, min(start + segment_size, size) - 1)
+                  for start in xrange(0, size, segment_size)]
+
+        # Make sure all the ranges come from the same version
+        validator = self._headers.get('etag') or \
+            self._headers.get('last-modified')
+
+        def download_range(byte_range):
+            start, end = byte_range
+            headers = {'Range': 'bytes={0}-{1}'.format(start, end)}
+            if validator is not None:
+                headers['If-Range'] = validator
+            resp = self._request('GET', headers=headers)
+            if resp.status_code != 206:
+                resp.close()
+                raise _RangesNotSupported()
+            with open(dest.name, 'r+b') as fp:
+                fp.seek(start)
+                written = file_copy(resp.raw, fp, blocksize=blocksize)
+            if written != end - start + 1:
+                raise ResourceAccessFailure(
+                    "Incomplete download of range {0}-{1} of {2}"
+                    .format(start, end, self.url))
+            return written
+
+        # Wait for all the ranges to complete, even if some failed,
+        # so that no thread is still writing to the file afterwards
+        # (eg. while falling back to a single stream).
+        pool = ThreadPool(len(ranges))
+        try:
+            results = [pool.apply_async(download_range, (byte_range,))
+                       for byte_range in ranges]
+            written, errors = 0, []
+            for result in results:
+                try:
+                    written += result.get()
+                except Exception as e:
+                    errors.append(e)
+        finally:
+            pool.close()
+            pool.join()
+
+        for error in errors:
+            if isinstance(error, _RangesNotSupported):
+                raise error
+        if errors:
+            raise errors[0]
+
+        dest.seek(size)
+        return written
+
+    def _verify_checksum(self, filename, checksum, blocksize):
+        algorithm, expected = checksum.split(':', 1)
+        try:
+            hasher = hashlib.new(algorithm)
+        except ValueError:
+            raise ValueError("Unsupported checksum algorithm: {0}"
+                             .format(algorithm))
+        with open(filename, 'rb') as fp:
+            for chunk in file_read_chunks(fp, blocksize=blocksize):
+                hasher.update(chunk)
+        if hasher.hexdigest() != expected.lower():
+            raise ResourceAccessFailure(
+                "Checksum mismatch for {0}: expected {1}, got {2}"
+                .format(self.url, checksum,
+                        '{0}:{1}'.format(algorithm, hasher.hexdigest())))
+
+    def _open_cached(self, cache):
+        """
+        Open the resource from the cache, revalidating or
+        updating it as needed.
+
+        :return: a file object, or ``None`` if the resource cannot be
+            served from the cache (the response is then left in
+            ``_response``, if any).
+        """
+
+        entry = cache.get(self.url)
+        headers = {}
+        if entry is not None:
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        self._discard_response()
+        resp = self._request('GET', headers=headers)
+
+        if resp.status_code == 304 and entry is not None:
+            resp.close()
+            try:
+                fp = cache.open(entry)
+            except IOError:
+                return None  # Removed by someone else in the meantime
+            self.__dict__['_headers'] = CaseInsensitiveDict(entry['headers'])
+            self._headers.update(
+                (name, value) for name, value in resp.headers.items()
+                if name.lower() != 'content-length')
+            return fp
+
+        self.__dict__['_headers'] = resp.headers
+        cache_control = resp.headers.get('cache-control', '')
+        if ('no-store' in cache_control or not (
+                'etag' in resp.headers or 'last-modified' in resp.headers)):
+            self._response = resp
+            return None
+
+        entry = cache.store(self.url, resp.headers, resp.raw)
+        return cache.open(entry)
+
+    def _request(self, method, headers=None):
+        try:
+            resp = get_http_session().request(
+                method, self.url, headers=headers, stream=True,
+                allow_redirects=True)
+        except requests.RequestException as e:
+            raise ResourceAccessFailure(
+                "Error accessing {0}: {1}".format(self.url, e))
+        if method == 'HEAD' and resp.status_code in (405, 501):
+            return resp
+        if resp.status_code < 400:
+            return resp
+
+        # Release the connection, without reading the body
+        resp.close()
+        if resp.status_code == 404:
+            raise ResourceNotFound("Resource not found: {0}".format(self.url))
+        if resp.status_code in (401, 403):
+            raise ResourceAccessDenied(
+                "Access denied to resource: {0}".format(self.url))
+        raise ResourceAccessFailure(
+            "Error accessing {0}: HTTP {1}"
+            .format(self.url, resp.status_code))
+
     @property
     def last_modified(self):
         val = self._headers.get('last-modified')
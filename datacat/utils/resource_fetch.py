@@ -0,0 +1,225 @@
+"""
+Concurrent download of many resources, eg. all the ones referenced
+by a dataset configuration.
+
+Resources are opened with
+:py:func:`datacat.utils.resource_access.open_resource` and saved to
+files in a pool of threads, limiting the number of concurrent downloads
+from the same host and (optionally) the overall bandwidth; results are
+returned as soon as each download completes, so the total time tracks
+the slowest resource rather than the sum of all of them.
+
+Downloads are submitted to the pool only when their host has a free
+slot, so that workers are never blocked waiting for a busy host while
+downloads from other hosts are pending.
+"""
+
+from collections import deque, namedtuple
+from multiprocessing.pool import ThreadPool
+from urlparse import urlparse
+import os
+import Queue
+import threading
+import time
+
+from flask import current_app
+
+from datacat.db import close_context_connections
+from datacat.utils.resource_access import open_resource
+
+
+class FetchResult(namedtuple('FetchResult',
+                             'url,filename,content_type,exception')):
+    """
+    Outcome of a resource download: ``filename`` and ``content_type``
+    are ``None`` if it failed (``exception`` is set instead).
+    """
+
+    __slots__ = []
+
+
+class TokenBucket(object):
+    """
+    Thread-safe token bucket, used to limit the rate (eg. bytes
+    per second) of some operation.
+
+    :param rate: tokens added per second
+    :param capacity: maximum number of tokens (burst size),
+        defaults to ``rate``.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self._tokens = self.capacity
+        self._last = time.time()
+        self._lock = threading.Lock()
+
+    def consume(self, amount):
+        """Take ``amount`` tokens, waiting for them to be available"""
+
+        while amount > 0:
+            with self._lock:
+                now = time.time()
+                self._tokens = min(
+                    self.capacity,
+                    self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                taken = min(amount, self._tokens)
+                self._tokens -= taken
+                amount -= taken
+                wait = amount / self.rate if amount > 0 else 0
+            if wait:
+                time.sleep(min(wait, self.capacity / self.rate))
+
+
+class _ThrottledFile(object):
+    """
+    Wrapper around a file, limiting the write rate with a token bucket.
+
+    Note: this doesn't expose the file name, so that resources are
+    saved as a single stream (segmented downloads write to the file
+    directly).
+    """
+
+    def __init__(self, fp, bucket):
+        self._fp = fp
+        self._bucket = bucket
+
+    def write(self, data):
+        self._bucket.consume(len(data))
+        self._fp.write(data)
+
+    def flush(self):
+        self._fp.flush()
+
+    def tell(self):
+        return self._fp.tell()
+
+    def seek(self, *args):
+        self._fp.seek(*args)
+
+    def truncate(self, *args):
+        self._fp.truncate(*args)
+
+
+def get_dataset_resource_urls(configuration):
+    """Get the URLs of the resources listed in a dataset configuration"""
+
+    return [resource['url']
+            for resource in configuration.get('resources') or []
+            if resource.get('url')]
+
+
+def fetch_resources(urls, directory, max_workers=None, max_per_host=None,
+                    max_bandwidth=None):
+    """
+    Download resources concurrently.
+
+    Must be called within an application context; downloads run in
+    their own application contexts (and database connections).
+
+    :param urls: the resource URLs
+    :param directory: directory to save files to (named after the
+        position of the URL in the list)
+    :param max_workers: maximum number of concurrent downloads
+        (default: ``RESOURCE_FETCH_MAX_WORKERS``)
+    :param max_per_host: maximum number of concurrent downloads
+        from the same host (default: ``RESOURCE_FETCH_MAX_PER_HOST``)
+    :param max_bandwidth: overall bandwidth limit, in bytes per
+        second (default: ``RESOURCE_FETCH_MAX_BANDWIDTH``)
+    :return: an iterator of :py:class:`FetchResult`, in order of
+        completion.
+    """
+
+    app = current_app._get_current_object()
+    if max_workers is None:
+        max_workers = app.config['RESOURCE_FETCH_MAX_WORKERS']
+    if max_per_host is None:
+        max_per_host = app.config['RESOURCE_FETCH_MAX_PER_HOST']
+    if max_bandwidth is None:
+        max_bandwidth = app.config['RESOURCE_FETCH_MAX_BANDWIDTH']
+
+    urls = list(urls)
+    bucket = TokenBucket(max_bandwidth) if max_bandwidth else None
+    hosts = [urlparse(url).netloc for url in urls]
+    results = Queue.Queue()
+
+    # Downloads waiting for a free slot on their host
+    waiting = dict((host, deque()) for host in hosts)
+    running = dict((host, 0) for host in hosts)
+    remaining = [len(urls)]
+    lock = threading.Lock()
+
+    def fetch(index):
+        url = urls[index]
+        filename = os.path.join(directory, '{0:06d}'.format(index))
+        try:
+            with app.app_context():
+                try:
+                    accessor = open_resource(url)
+                    try:
+                        with open(filename, 'wb') as fp:
+                            if bucket is not None:
+                                fp = _ThrottledFile(fp, bucket)
+                            accessor.save_to_file(fp)
+                        result = FetchResult(
+                            url, filename, accessor.content_type, None)
+                    finally:
+                        accessor.close()
+                finally:
+                    close_context_connections()
+        except Exception as e:
+            result = FetchResult(url, None, None, e)
+
+        with lock:
+            running[hosts[index]] -= 1
+            submit(hosts[index])
+            remaining[0] -= 1
+            if not remaining[0]:
+                pool.close()
+        results.put(result)
+
+    def submit(host):
+        # Must be called holding the lock
+        while waiting[host] and running[host] < max_per_host:
+            running[host] += 1
+            pool.apply_async(fetch, (waiting[host].popleft(),))
+
+    # Downloads start right away, even if results are not consumed
+    pool = ThreadPool(max(1, min(max_workers, len(urls))))
+    with lock:
+        for index in _interleave_hosts(hosts):
+            waiting[hosts[index]].append(index)
+            submit(hosts[index])
+        if not urls:
+            pool.close()
+
+    return (results.get() for _ in urls)
+
+
+def fetch_dataset_resources(configuration, directory, **kwargs):
+    """
+    Download all the resources referenced by a dataset configuration
+    (see :py:func:`fetch_resources`).
+    """
+
+    return fetch_resources(
+        get_dataset_resource_urls(configuration), directory, **kwargs)
+
+
+def _interleave_hosts(hosts):
+    """
+    Get the indices of the URLs, alternating between hosts, so that
+    workers don't all end up waiting on the same host.
+    """
+
+    by_host = {}
+    for index, host in enumerate(hosts):
+        by_host.setdefault(host, []).append(index)
+    queues = [by_host[host] for host in sorted(by_host)]
+    indices = []
+    while queues:
+        indices.extend(queue.pop(0) for queue in queues)
+        queues = [queue for queue in queues if queue]
+    return indices
@@ -4,35 +4,133 @@ Administrative API for Datacat
 
 from cgi import parse_header
 import datetime
-import json
 import hashlib
+import logging
 
 from flask import Blueprint, request, url_for, current_app
-from werkzeug.exceptions import NotFound
+import psycopg2
+from werkzeug.exceptions import (
+    HTTPException, NotFound, BadRequest, PreconditionFailed)
 
 from datacat.db import db
-from datacat.db import querybuilder
-from datacat.utils.const import DATE_FORMAT, HTTP_DATE_FORMAT
-from datacat.web.utils import json_view, _get_json_from_request
+from datacat.db import fieldsets, querybuilder, search
+from datacat.db.changes import (
+    ChangeToken, get_changes, get_collection_version)
+from datacat.utils import json_codec, metrics
+from datacat.utils.const import DATE_FORMAT, HTTP_DATE_FORMAT, SQL_DATE_FORMAT
+from datacat.utils.http import not_modified_response
+from datacat.utils.plugin_manager import HookCoalescer, call_hook_task
+from datacat.utils.resource_access import forget_resource_record
+from datacat.web.utils import (
+    json_view, RawJSON, _get_json_from_request, _get_paging_args,
+    _get_fields_arg, _get_if_match_versions, _make_version_etag,
+    _wants_ndjson)
+
+logger = logging.getLogger(__name__)
 
 admin_bp = Blueprint('admin', __name__)
 
+# Fields that can be selected in the indices, using ``?fields=``
+RESOURCE_INDEX_FIELDS = ['id', 'metadata', 'mimetype', 'ctime', 'mtime']
+DATASET_INDEX_FIELDS = ['id', 'configuration', 'ctime', 'mtime']
+
+
+def _iter_index(table, fields, render_in_database=False, query_args=None):
+    """
+    Iterate the rows of an index endpoint, using a server-side cursor,
+    so that they can be streamed without loading everything in memory.
+
+    :param table: name of the table to list
+    :param fields: SQL expressions for the fields of each object
+    :param render_in_database:
+        if ``True``, JSON for each row will be rendered by PostgreSQL,
+        and :py:class:`RawJSON` objects will be returned; else, rows
+        are returned as ``DictRow`` objects.
+    :param query_args: arguments for the field expressions
+    """
+
+    query = 'SELECT {fields} FROM "{table}" ORDER BY id ASC'.format(
+        fields=', '.join(fields), table=table)
+    if render_in_database:
+        query = 'SELECT row_to_json(t)::text FROM ({0}) t'.format(query)
+
+    with db, db.cursor(name='{0}_index'.format(table)) as cur:
+        cur.itersize = 1000
+        cur.execute(query, query_args or {})
+        for row in cur:
+            yield RawJSON(row[0]) if render_in_database else row
+
+
+def _iter_sparse_index(table, paths):
+    """
+    Iterate the objects of an index endpoint, only fetching the
+    selected field paths (see :py:mod:`datacat.db.fieldsets`).
+    """
+
+    expressions, query_args = fieldsets.select_fields_sql(paths)
+    for row in _iter_index(table, expressions, query_args=query_args):
+        yield fieldsets.build_object(paths, row)
+
+
+def _get_collection_headers(table):
+    """
+    Get the headers for a collection (index) response: ``X-Total-Count``
+    and an ``ETag``, built from the number of objects and the changes
+    counter of the table, which is bumped by every committed write.
+
+    The values are read using a single, cheap, query.
+
+    As the same URL can be rendered as JSON or NDJSON, depending on
+    the ``Accept`` header, the format is part of the ETag too, and
+    ``Vary: Accept`` is sent.
+    """
+
+    with db, db.cursor() as cur:
+        version = get_collection_version(cur, table)
+
+    etag = '"{count}-{changes}{format}"'.format(
+        count=version['count'],
+        changes=version['changes'],
+        format='-ndjson' if _wants_ndjson() else '')
+
+    return {'X-Total-Count': str(version['count']), 'ETag': etag,
+            'Vary': 'Accept'}
+
+
+def _sql_date(field):
+    return "to_char({0}, '{1}') AS {0}".format(field, SQL_DATE_FORMAT)
+
 
 @admin_bp.route('/resource/', methods=['GET'])
 @json_view
 def get_resource_index():
     # todo: add paging support
-    with db, db.cursor() as cur:
-        cur.execute("""
-        SELECT id, metadata, mimetype, mtime, ctime FROM resource
-        ORDER BY id ASC
-        """)
-        return list({'id': x['id'],
-                     'metadata': x['metadata'],
-                     'mimetype': x['mimetype'],
-                     'ctime': x['ctime'].strftime(DATE_FORMAT),
-                     'mtime': x['mtime'].strftime(DATE_FORMAT)}
-                    for x in cur.fetchall())
+    paths = _get_fields_arg(RESOURCE_INDEX_FIELDS, json_columns=['metadata'])
+
+    headers = _get_collection_headers('resource')
+    not_modified = not_modified_response(etag=headers['ETag'], headers=headers)
+    if not_modified is not None:
+        return not_modified
+
+    if paths is not None:
+        return _iter_sparse_index('resource', paths), 200, headers
+
+    if current_app.config['RENDER_INDEX_IN_DATABASE']:
+        return _iter_index(
+            'resource',
+            ['id', 'metadata', 'mimetype',
+             _sql_date('ctime'), _sql_date('mtime')],
+            render_in_database=True), 200, headers
+
+    rows = _iter_index(
+        'resource', ['id', 'metadata', 'mimetype', 'ctime', 'mtime'])
+    resources = ({'id': x['id'],
+                  'metadata': x['metadata'],
+                  'mimetype': x['mimetype'],
+                  'ctime': x['ctime'].strftime(DATE_FORMAT),
+                  'mtime': x['mtime'].strftime(DATE_FORMAT)}
+                 for x in rows)
+    return resources, 200, headers
 
 
 @admin_bp.route('/resource/', methods=['POST'])
@@ -64,7 +162,8 @@ def post_resource_index():
             data_oid=oid,
             ctime=datetime.datetime.utcnow(),
             mtime=datetime.datetime.utcnow(),
-            hash=resource_hash)
+            hash=resource_hash,
+            size=len(request.data))
 
         # Then, create a record for the metadata
         query = querybuilder.insert('resource', data)
@@ -118,11 +217,13 @@ def put_resource_data(resource_id):
             id=resource_id,
             mimetype=content_type,
             mtime=datetime.datetime.utcnow(),
-            hash=resource_hash)
+            hash=resource_hash,
+            size=len(request.data))
 
         query = querybuilder.update('resource', data)
         cur.execute(query, data)
 
+    forget_resource_record(resource_id)
     return '', 200
 
 
@@ -145,68 +246,132 @@ def delete_resource_data(resource_id):
         cur.execute(query, dict(id=resource_id))
 
     db.commit()
+    forget_resource_record(resource_id)
     return '', 200
 
 
 @admin_bp.route('/resource/<int:resource_id>/meta', methods=['GET'])
 @json_view
 def get_resource_metadata(resource_id):
+    prefix = ('metadata',)
+    paths = _get_fields_arg(['metadata'], json_columns=['metadata'],
+                            prefix=prefix) or [prefix]
+    expressions, query_args = fieldsets.select_fields_sql(paths)
+
     with db.cursor() as cur:
-        query = querybuilder.select_pk('resource', fields='id, metadata')
-        cur.execute(query, dict(id=resource_id))
+        query = querybuilder.select_pk(
+            'resource', fields=['"version"'] + expressions)
+        cur.execute(query, dict(query_args, id=resource_id))
         resource = cur.fetchone()
 
     if resource is None:
         raise NotFound()
 
-    return resource['metadata']
+    headers = {'ETag': _make_version_etag(resource['version'])}
+    not_modified = not_modified_response(etag=headers['ETag'], headers=headers)
+    if not_modified is not None:
+        return not_modified
+
+    return fieldsets.build_object(paths, resource, prefix), 200, headers
 
 
 @admin_bp.route('/resource/<int:resource_id>/meta', methods=['PUT'])
 def put_resource_metadata(resource_id):
     new_metadata = _get_json_from_request()
 
-    with db.cursor() as cur:
-        query = querybuilder.select_pk('resource', fields='id, metadata')
-        cur.execute(query, dict(id=resource_id))
-        resource = cur.fetchone()
-
-    if resource is None:
-        raise NotFound('This resource does not exist')
-
     with db, db.cursor() as cur:
-        data = dict(
-            id=resource_id,
-            metadata=json.dumps(new_metadata))
-        query = querybuilder.update('resource', data)
-        cur.execute(query, data)
+        version = _replace_resource_metadata(
+            cur, resource_id, new_metadata, _get_if_match_versions())
 
-    return '', 200
+    return '', 200, {'ETag': _make_version_etag(version)}
 
 
 @admin_bp.route('/resource/<int:resource_id>/meta', methods=['PATCH'])
 def patch_resource_metadata(resource_id):
     new_metadata = _get_json_from_request()
+    if not isinstance(new_metadata, dict):
+        raise BadRequest('Expected a JSON object')
 
-    with db.cursor() as cur:
-        query = querybuilder.select_pk('resource', fields='id, metadata')
-        cur.execute(query, dict(id=resource_id))
-        resource = cur.fetchone()
+    with db, db.cursor() as cur:
+        version = _patch_resource_metadata(
+            cur, resource_id, new_metadata, _get_if_match_versions())
+
+    return '', 200, {'ETag': _make_version_etag(version)}
+
+
+def _replace_resource_metadata(cur, resource_id, metadata, versions=None):
+    """
+    Replace the metadata of a resource.
+
+    :param versions:
+        if not ``None``, only update if the resource version
+        is one of these (see :py:func:`_get_if_match_versions`).
+    :return: the new resource version
+    """
 
+    cur.execute("""
+    UPDATE "resource" SET "metadata" = %(metadata)s
+    WHERE "id" = %(id)s {version_check}
+    RETURNING "version";
+    """.format(version_check=_version_check_sql(versions)), dict(
+        id=resource_id,
+        metadata=json_codec.dumps(metadata),
+        versions=versions))
+    resource = cur.fetchone()
     if resource is None:
-        raise NotFound('This resource does not exist')
+        _raise_update_failed(cur, 'resource', resource_id)
+    return resource['version']
 
-    _meta = resource['metadata']
-    _meta.update(new_metadata)
 
-    with db, db.cursor() as cur:
-        data = dict(
-            id=resource_id,
-            metadata=json.dumps(_meta))
-        query = querybuilder.update('resource', data)
-        cur.execute(query, data)
+def _patch_resource_metadata(cur, resource_id, metadata, versions=None):
+    """
+    Merge new keys into the metadata of a resource.
 
-    return '', 200
+    :return: the new resource version
+    """
+
+    # Merge is performed by PostgreSQL, in a single statement: this
+    # way, concurrent updates to different keys cannot get lost.
+    cur.execute("""
+    UPDATE "resource"
+    SET "metadata" = (coalesce("metadata"::jsonb, '{{}}'::jsonb)
+                      || %(metadata)s::jsonb)::json
+    WHERE "id" = %(id)s {version_check}
+    RETURNING "version";
+    """.format(version_check=_version_check_sql(versions)), dict(
+        id=resource_id,
+        metadata=json_codec.dumps(metadata),
+        versions=versions))
+    resource = cur.fetchone()
+    if resource is None:
+        _raise_update_failed(cur, 'resource', resource_id)
+    return resource['version']
+
+
+def _version_check_sql(versions):
+    """
+    Get an extra SQL ``WHERE`` condition for the object version, if
+    a list of accepted versions was specified (usually, from the
+    ``If-Match`` header). Versions need to be passed in the
+    ``versions`` query argument.
+    """
+
+    if versions is None:
+        return ''
+    return 'AND "version" = ANY(%(versions)s)'
+
+
+def _raise_update_failed(cur, table, obj_id):
+    """
+    Raise the appropriate exception after an update with a version
+    check didn't affect any row: either the object didn't exist,
+    or its version didn't match.
+    """
+
+    cur.execute(querybuilder.select_pk(table, fields='id'), dict(id=obj_id))
+    if cur.fetchone() is None:
+        raise NotFound()
+    raise PreconditionFailed('Object version does not match If-Match')
 
 
 # ======================================================================
@@ -218,101 +383,546 @@ def patch_resource_metadata(resource_id):
 @json_view
 def get_dataset_index():
     # todo: add paging support
+    paths = _get_fields_arg(
+        DATASET_INDEX_FIELDS, json_columns=['configuration'])
 
-    with db.cursor() as cur:
-        cur.execute("""
-        SELECT id, configuration, ctime, mtime FROM dataset
-        ORDER BY id ASC
-        """)
-        return list({'id': x['id'],
-                     'configuration': x['configuration'],
-                     'ctime': x['ctime'].strftime(DATE_FORMAT),
-                     'mtime': x['mtime'].strftime(DATE_FORMAT)}
-                    for x in cur.fetchall())
+    headers = _get_collection_headers('dataset')
+    not_modified = not_modified_response(etag=headers['ETag'], headers=headers)
+    if not_modified is not None:
+        return not_modified
+
+    if paths is not None:
+        return _iter_sparse_index('dataset', paths), 200, headers
+
+    if current_app.config['RENDER_INDEX_IN_DATABASE']:
+        return _iter_index(
+            'dataset',
+            ['id', 'configuration', _sql_date('ctime'), _sql_date('mtime')],
+            render_in_database=True), 200, headers
+
+    rows = _iter_index('dataset', ['id', 'configuration', 'ctime', 'mtime'])
+    datasets = ({'id': x['id'],
+                 'configuration': x['configuration'],
+                 'ctime': x['ctime'].strftime(DATE_FORMAT),
+                 'mtime': x['mtime'].strftime(DATE_FORMAT)}
+                for x in rows)
+    return datasets, 200, headers
 
 
 @admin_bp.route('/dataset/', methods=['POST'])
 def post_dataset_index():
-    content_type = 'application/octet-stream'
-    if request.headers.get('Content-type'):
-        content_type, _ = parse_header(request.headers['Content-type'])
-
     data = _get_json_from_request()
 
     with db, db.cursor() as cur:
-        cur.execute("""
-        INSERT INTO "dataset" (configuration, ctime, mtime)
-        VALUES (%(conf)s::json, %(mtime)s, %(mtime)s)
-        RETURNING id;
-        """, dict(conf=json.dumps(data), mtime=datetime.datetime.utcnow()))
-        dataset_id = cur.fetchone()[0]
+        dataset_id = _insert_dataset(cur, data)['id']
 
-    current_app.plugins.call_hook('dataset_create', dataset_id, data)
+    headers = _dispatch_hook('dataset_create', dataset_id, data)
 
     # Last, retun 201 + Location: header
-    location = url_for('.get_dataset_configuration', dataset_id=dataset_id)
-    return '', 201, {'Location': location}
+    headers['Location'] = url_for(
+        '.get_dataset_configuration', dataset_id=dataset_id)
+    return '', 201, headers
 
 
-def _get_dataset_record(dataset_id):
+@admin_bp.route('/dataset/search', methods=['GET'])
+@json_view
+def search_dataset_index():
+    """
+    Full-text search over dataset titles and descriptions.
+
+    The search text is taken from the ``q`` query string argument;
+    results are paged using the ``offset`` and ``limit`` arguments,
+    and the total number of matches is returned in the
+    ``X-Total-Count`` header.
+    """
+
+    text = request.args.get('q', '').strip()
+    if not text:
+        raise BadRequest('Missing search text (the q argument)')
+    offset, limit = _get_paging_args()
+
+    with db, db.cursor() as cur:
+        results, total_count = search.search_datasets(
+            cur, text, language=current_app.config['SEARCH_LANGUAGE'],
+            offset=offset, limit=limit)
+
+    return results, 200, {'X-Total-Count': str(total_count)}
+
+
+def _get_dataset_record(dataset_id, fields=None, query_args=None):
     with db.cursor() as cur:
-        query = querybuilder.select_pk('dataset')
-        cur.execute(query, dict(id=dataset_id))
+        query = querybuilder.select_pk('dataset', fields=fields)
+        cur.execute(query, dict(query_args or {}, id=dataset_id))
         dataset = cur.fetchone()
     if dataset is None:
         raise NotFound()
     return dataset
 
 
-def _update_dataset_record(dataset_id, fields):
-    fields['id'] = dataset_id
-    _configuration = None
-    if 'configuration' in fields:
-        _configuration = fields['configuration']
-        fields['configuration'] = json.dumps(fields['configuration'])
-    fields['mtime'] = datetime.datetime.utcnow()
-    query = querybuilder.update('dataset', fields)
+def _insert_dataset(cur, configuration):
+    """
+    Create a new dataset (search vector included).
 
-    with db, db.cursor() as cur:
-        cur.execute(query, fields)
+    :return: a row with the ``id`` and ``version`` of the new dataset
+    """
+
+    cur.execute("""
+    INSERT INTO "dataset" (configuration, search_vector, ctime, mtime)
+    VALUES (%(conf)s::json, {search_vector}, %(mtime)s, %(mtime)s)
+    RETURNING "id", "version";
+    """.format(search_vector=search.search_vector_sql('%(conf)s::json')),
+        dict(conf=json_codec.dumps(configuration),
+             mtime=datetime.datetime.utcnow(),
+             language=current_app.config['SEARCH_LANGUAGE']))
+    return cur.fetchone()
+
+
+def _replace_dataset(cur, dataset_id, configuration, versions=None):
+    """
+    Replace the configuration of a dataset (search vector included).
+
+    :param versions:
+        if not ``None``, only update if the dataset version
+        is one of these (see :py:func:`_get_if_match_versions`).
+    :return: the new dataset version
+    """
+
+    cur.execute("""
+    UPDATE "dataset"
+    SET "configuration" = %(conf)s::json,
+        "search_vector" = {search_vector},
+        "mtime" = %(mtime)s
+    WHERE "id" = %(id)s {version_check}
+    RETURNING "version";
+    """.format(
+        search_vector=search.search_vector_sql('%(conf)s::json'),
+        version_check=_version_check_sql(versions)), dict(
+            id=dataset_id,
+            conf=json_codec.dumps(configuration),
+            mtime=datetime.datetime.utcnow(),
+            language=current_app.config['SEARCH_LANGUAGE'],
+            versions=versions))
+    dataset = cur.fetchone()
+    if dataset is None:
+        _raise_update_failed(cur, 'dataset', dataset_id)
+    return dataset['version']
+
+
+def _patch_dataset(cur, dataset_id, patch, versions=None):
+    """
+    Merge new keys into the configuration of a dataset.
+
+    :return:
+        a row with the new ``configuration`` and ``version``
+        of the dataset
+    """
+
+    # Merge is performed by PostgreSQL, in a single statement (search
+    # vector included): this way, concurrent updates to different keys
+    # cannot get lost, and no lock is held across round trips.
+    new_configuration = '("configuration"::jsonb || %(patch)s::jsonb)'
+    cur.execute("""
+    UPDATE "dataset"
+    SET "configuration" = {configuration}::json,
+        "search_vector" = {search_vector},
+        "mtime" = %(mtime)s
+    WHERE "id" = %(id)s {version_check}
+    RETURNING "configuration", "version";
+    """.format(
+        configuration=new_configuration,
+        search_vector=search.search_vector_sql(new_configuration),
+        version_check=_version_check_sql(versions)), dict(
+            id=dataset_id,
+            patch=json_codec.dumps(patch),
+            mtime=datetime.datetime.utcnow(),
+            language=current_app.config['SEARCH_LANGUAGE'],
+            versions=versions))
+    dataset = cur.fetchone()
+    if dataset is None:
+        _raise_update_failed(cur, 'dataset', dataset_id)
+    return dataset
+
+
+def _delete_dataset(cur, dataset_id):
+    """
+    Delete a dataset.
+
+    :return: ``True`` if the dataset existed, ``False`` otherwise
+    """
 
-    current_app.plugins.call_hook('dataset_update', dataset_id, _configuration)
+    cur.execute(querybuilder.delete('dataset') + ' RETURNING "id"',
+                dict(id=dataset_id))
+    return cur.fetchone() is not None
 
 
 @admin_bp.route('/dataset/<int:dataset_id>', methods=['GET'])
 @json_view
 def get_dataset_configuration(dataset_id):
-    dataset = _get_dataset_record(dataset_id)
+    prefix = ('configuration',)
+    paths = _get_fields_arg(['configuration'], json_columns=['configuration'],
+                            prefix=prefix) or [prefix]
+    expressions, query_args = fieldsets.select_fields_sql(paths)
+
+    dataset = _get_dataset_record(
+        dataset_id, fields=['"version"', '"mtime"'] + expressions,
+        query_args=query_args)
     headers = {
         'Last-modified': dataset['mtime'].strftime(HTTP_DATE_FORMAT),
+        'ETag': _make_version_etag(dataset['version']),
     }
-    return dataset['configuration'], 200, headers
+    not_modified = not_modified_response(
+        etag=headers['ETag'], last_modified=dataset['mtime'],
+        headers=headers)
+    if not_modified is not None:
+        return not_modified
+
+    return fieldsets.build_object(paths, dataset, prefix), 200, headers
 
 
 @admin_bp.route('/dataset/<int:dataset_id>', methods=['PUT'])
 def put_dataset_configuration(dataset_id):
-    _get_dataset_record(dataset_id)  # Make sure it exists
     user_conf = _get_json_from_request()
-    _update_dataset_record(dataset_id, {'configuration': user_conf})
-    return '', 200
+
+    with db, db.cursor() as cur:
+        version = _replace_dataset(
+            cur, dataset_id, user_conf, _get_if_match_versions())
+
+    headers = _dispatch_hook('dataset_update', dataset_id, user_conf)
+    headers['ETag'] = _make_version_etag(version)
+    return '', 200, headers
 
 
 @admin_bp.route('/dataset/<int:dataset_id>', methods=['PATCH'])
 def patch_dataset_configuration(dataset_id):
     user_conf = _get_json_from_request()
-    dataset = _get_dataset_record(dataset_id)
-    new_meta = dataset['configuration']
-    new_meta.update(user_conf)
-    _update_dataset_record(dataset_id, {'configuration': new_meta})
-    return '', 200
+    if not isinstance(user_conf, dict):
+        raise BadRequest('Expected a JSON object')
+
+    with db, db.cursor() as cur:
+        dataset = _patch_dataset(
+            cur, dataset_id, user_conf, _get_if_match_versions())
+
+    headers = _dispatch_hook(
+        'dataset_update', dataset_id, dataset['configuration'])
+    headers['ETag'] = _make_version_etag(dataset['version'])
+    return '', 200, headers
 
 
 @admin_bp.route('/dataset/<int:dataset_id>', methods=['DELETE'])
 def delete_dataset_configuration(dataset_id):
     with db, db.cursor() as cur:
-        query = querybuilder.delete('dataset')
-        cur.execute(query, dict(id=dataset_id))
+        _delete_dataset(cur, dataset_id)
 
-    current_app.plugins.call_hook('dataset_delete', dataset_id)
+    headers = _dispatch_hook('dataset_delete', dataset_id)
 
-    return '', 200
+    return '', 200, headers
+
+
+def _dispatch_hook(hook_type, *args):
+    """
+    Dispatch a plugin hook (see ``PluginManager.dispatch_hook()``).
+
+    :return:
+        a dict of headers to be added to the response (``X-Task-Id``,
+        if the hook was enqueued as a Celery task)
+    """
+
+    return _make_task_headers(
+        current_app.plugins.dispatch_hook(hook_type, *args))
+
+
+def _make_task_headers(task_ids):
+    if not task_ids:
+        return {}
+    return {'X-Task-Id': ', '.join(task_ids)}
+
+
+# ======================================================================
+# Batch operations
+# ======================================================================
+
+
+class _BatchAborted(Exception):
+    pass
+
+
+@admin_bp.route('/batch', methods=['POST'])
+@json_view
+def post_batch():
+    """
+    Run multiple operations with a single request.
+
+    The request body is an object with an ``operations`` list; each
+    operation is an object with the following keys:
+
+    - ``type``: ``dataset`` or ``resource_metadata``
+    - ``op``: ``create`` (datasets only), ``update``, ``patch``
+      or ``delete`` (datasets only)
+    - ``id``: the object id (except for ``create``)
+    - ``data``: the new configuration / metadata, or the keys to be
+      merged into it (for ``patch``)
+    - ``if_match``: optional, the same as the ``If-Match`` header
+
+    If ``atomic`` is true (the default), all the operations are run in
+    a single transaction, which is rolled back as soon as an operation
+    fails (the following ones are not run, and get a 424 status).
+    Otherwise, failing operations are rolled back individually, and
+    changes are committed every ``ADMIN_BATCH_COMMIT_SIZE`` operations.
+    Database errors are reported as the status of the failing operation
+    (eg. 409 for constraint violations).
+
+    Plugin hooks are called once for each affected object, after
+    changes have been committed.
+
+    :return:
+        an object with ``results`` (a list containing a ``status`` and
+        either the ``id`` / ``etag`` or an ``error`` for each operation),
+        ``committed`` and ``tasks`` (ids of the Celery tasks enqueued
+        for async hooks) keys.
+    """
+
+    payload = _get_json_from_request()
+    if not (isinstance(payload, dict)
+            and isinstance(payload.get('operations'), list)):
+        raise BadRequest('Expected an object with an "operations" list')
+
+    operations = payload['operations']
+    if len(operations) > current_app.config['ADMIN_BATCH_MAX_OPERATIONS']:
+        raise BadRequest('Too many operations')
+
+    if payload.get('atomic', True):
+        results, hooks, committed = _run_batch_atomic(operations)
+    else:
+        results, hooks, committed = _run_batch_chunked(
+            operations, current_app.config['ADMIN_BATCH_COMMIT_SIZE'])
+
+    task_ids = hooks.call_hooks(current_app.plugins)
+
+    return ({'results': results, 'committed': committed, 'tasks': task_ids},
+            200, _make_task_headers(task_ids))
+
+
+def _run_batch_atomic(operations):
+    hooks = HookCoalescer()
+    results = []
+    try:
+        with db, db.cursor() as cur:
+            for operation in operations:
+                result = _run_batch_operation(cur, operation, hooks)
+                results.append(result)
+                if result['status'] >= 400:
+                    raise _BatchAborted()
+
+    except _BatchAborted:
+        # Everything was rolled back
+        results.extend({'status': 424, 'error': 'Not executed'}
+                       for _ in operations[len(results):])
+        return results, HookCoalescer(), False
+
+    return results, hooks, True
+
+
+def _run_batch_chunked(operations, chunk_size):
+    hooks = HookCoalescer()
+    results = []
+    try:
+        for start in xrange(0, len(operations), chunk_size):
+            chunk_hooks = HookCoalescer()
+            with db, db.cursor() as cur:
+                for operation in operations[start:start + chunk_size]:
+                    cur.execute('SAVEPOINT batch_operation')
+                    result = _run_batch_operation(cur, operation, chunk_hooks)
+                    if result['status'] >= 400:
+                        cur.execute('ROLLBACK TO SAVEPOINT batch_operation')
+                    else:
+                        cur.execute('RELEASE SAVEPOINT batch_operation')
+                    results.append(result)
+            hooks.update(chunk_hooks)  # Committed
+
+    except Exception:
+        # Don't lose hooks for changes that were already committed
+        hooks.call_hooks(current_app.plugins)
+        raise
+
+    return results, hooks, True
+
+
+def _run_batch_operation(cur, operation, hooks):
+    try:
+        if not isinstance(operation, dict):
+            raise BadRequest('Operations must be objects')
+        handler = _BATCH_HANDLERS.get(
+            (operation.get('type'), operation.get('op')))
+        if handler is None:
+            raise BadRequest('Unsupported operation')
+        return handler(cur, operation, hooks)
+
+    except HTTPException as e:
+        return {'status': e.code, 'error': e.description}
+
+    # Database errors only affect the current operation (it's rolled
+    # back to its savepoint, or the whole batch is, if atomic)
+    except psycopg2.DataError as e:
+        return {'status': 400, 'error': str(e).strip()}
+
+    except psycopg2.IntegrityError as e:
+        return {'status': 409, 'error': str(e).strip()}
+
+    except psycopg2.Error:
+        logger.exception("Database error in batch operation")
+        return {'status': 500, 'error': 'Database error'}
+
+
+def _get_batch_object_id(operation):
+    obj_id = operation.get('id')
+    if isinstance(obj_id, bool) or not isinstance(obj_id, (int, long)):
+        raise BadRequest('A valid object id is required')
+    return obj_id
+
+
+def _get_batch_versions(operation):
+    if operation.get('if_match') is None:
+        return None
+    return _get_if_match_versions(operation['if_match'])
+
+
+def _get_batch_data(operation):
+    data = operation.get('data')
+    if not isinstance(data, dict):
+        raise BadRequest('Expected a JSON object')
+    return data
+
+
+def _batch_dataset_create(cur, operation, hooks):
+    configuration = _get_batch_data(operation)
+    dataset = _insert_dataset(cur, configuration)
+    hooks.add('dataset', dataset['id'], 'create', configuration)
+    return {'status': 201, 'id': dataset['id'],
+            'etag': _make_version_etag(dataset['version'])}
+
+
+def _batch_dataset_update(cur, operation, hooks):
+    dataset_id = _get_batch_object_id(operation)
+    configuration = _get_batch_data(operation)
+    version = _replace_dataset(cur, dataset_id, configuration,
+                               _get_batch_versions(operation))
+    hooks.add('dataset', dataset_id, 'update', configuration)
+    return {'status': 200, 'id': dataset_id,
+            'etag': _make_version_etag(version)}
+
+
+def _batch_dataset_patch(cur, operation, hooks):
+    dataset_id = _get_batch_object_id(operation)
+    dataset = _patch_dataset(cur, dataset_id, _get_batch_data(operation),
+                             _get_batch_versions(operation))
+    hooks.add('dataset', dataset_id, 'update', dataset['configuration'])
+    return {'status': 200, 'id': dataset_id,
+            'etag': _make_version_etag(dataset['version'])}
+
+
+def _batch_dataset_delete(cur, operation, hooks):
+    dataset_id = _get_batch_object_id(operation)
+    if _delete_dataset(cur, dataset_id):
+        hooks.add('dataset', dataset_id, 'delete')
+    return {'status': 200, 'id': dataset_id}
+
+
+def _batch_resource_metadata_update(cur, operation, hooks):
+    resource_id = _get_batch_object_id(operation)
+    version = _replace_resource_metadata(
+        cur, resource_id, _get_batch_data(operation),
+        _get_batch_versions(operation))
+    return {'status': 200, 'id': resource_id,
+            'etag': _make_version_etag(version)}
+
+
+def _batch_resource_metadata_patch(cur, operation, hooks):
+    resource_id = _get_batch_object_id(operation)
+    version = _patch_resource_metadata(
+        cur, resource_id, _get_batch_data(operation),
+        _get_batch_versions(operation))
+    return {'status': 200, 'id': resource_id,
+            'etag': _make_version_etag(version)}
+
+
+_BATCH_HANDLERS = {
+    ('dataset', 'create'): _batch_dataset_create,
+    ('dataset', 'update'): _batch_dataset_update,
+    ('dataset', 'patch'): _batch_dataset_patch,
+    ('dataset', 'delete'): _batch_dataset_delete,
+    ('resource_metadata', 'update'): _batch_resource_metadata_update,
+    ('resource_metadata', 'patch'): _batch_resource_metadata_patch,
+}
+
+
+# ======================================================================
+# Background tasks
+# ======================================================================
+
+
+@admin_bp.route('/task/<task_id>', methods=['GET'])
+@json_view
+def get_task_status(task_id):
+    """
+    Get the status of a background task running plugin hooks
+    (ids are returned in the ``X-Task-Id`` response header).
+
+    Note that unknown tasks are reported as ``PENDING``.
+    """
+
+    result = call_hook_task.AsyncResult(task_id)
+    status = {'id': task_id, 'state': result.state}
+    if result.ready():
+        status['result'] = (result.result if result.successful()
+                            else repr(result.result))
+    return status
+
+
+# ======================================================================
+# Metrics
+# ======================================================================
+
+
+@admin_bp.route('/metrics', methods=['GET'])
+@json_view
+def get_metrics():
+    """
+    Get plugin hook / Celery task metrics for the current process
+    (see :py:mod:`datacat.utils.metrics`).
+    """
+
+    return metrics.registry.snapshot()
+
+
+# ======================================================================
+# Change feed
+# ======================================================================
+
+
+@admin_bp.route('/changes', methods=['GET'])
+@json_view
+def get_change_feed():
+    """
+    Get changes to datasets and resources.
+
+    Clients should pass the ``next`` token from the previous response
+    in the ``since`` argument, in order to only get new changes;
+    if ``complete`` is false, more changes are available right away.
+    """
+
+    try:
+        since = ChangeToken.parse(request.args.get('since'))
+    except ValueError:
+        raise BadRequest('Invalid change token')
+    _, limit = _get_paging_args(default_limit=100, max_limit=1000)
+
+    with db, db.cursor() as cur:
+        changes, next_token, complete = get_changes(
+            cur, since=since, limit=limit)
+
+    for change in changes:
+        change['time'] = change['time'].strftime(DATE_FORMAT)
+
+    return {'changes': changes,
+            'next': str(next_token),
+            'complete': complete}
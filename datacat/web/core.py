@@ -2,14 +2,42 @@
 Core for the datacat webapp.
 """
 
-from celery import Celery
+import logging
+import threading
+import time
+import weakref
+
+from celery import Celery, signals
 from flask import Flask, current_app
 from flask.config import Config
+import psycopg2
+from werkzeug.local import LocalProxy
 
+from datacat.db import instrumentation
+from datacat.utils import json_codec, metrics, resource_access
 from datacat.utils.plugin_loading import import_object
 from datacat.web.blueprints.admin import admin_bp
 from datacat.web.blueprints.public import public_bp
 
+logger = logging.getLogger(__name__)
+
+# Key, in the info table, of the plugins lifecycle state
+PLUGINS_STATE_KEY = 'core.plugins_state'
+
+# Keys to be read to get the plugins state (including the ones
+# used by older versions).
+PLUGINS_INFO_KEYS = [
+    PLUGINS_STATE_KEY, 'core.plugins_installed', 'core.plugins_enabled']
+
+# PostgreSQL advisory lock keys, used to coordinate processes
+# starting at the same time.
+SCHEMA_LOCK_KEY = 0x64746301
+PLUGINS_LOCK_KEY = 0x64746302
+
+# Plugins loaders of the applications finalized in this process
+# (see _load_worker_plugins).
+_plugins_loaders = weakref.WeakSet()
+
 
 def make_flask_app(config=None):
     app = Flask('datacat')
@@ -18,6 +46,10 @@ def make_flask_app(config=None):
     app.config.update(make_config())
     if config is not None:
         app.config.update(config)
+    instrumentation.init_app(app)
+    metrics.init_app(app)
+    resource_access.init_app(app)
+    json_codec.init_app(app)
     return app
 
 
@@ -52,7 +84,8 @@ def make_config():
 
 
 def load_plugins(app):
-    from datacat.utils.plugin_manager import PluginManager
+    from datacat.utils.plugin_manager import (
+        PluginManager, get_plugin_hook_task)
 
     plugins = []
     for name in app.config['PLUGINS']:
@@ -64,72 +97,285 @@ def load_plugins(app):
         # Setup the plugin
         plugin.setup(app)
 
-    return PluginManager(plugins)
+        # Register the task running async hooks, so that it's
+        # known to workers too.
+        get_plugin_hook_task(plugin)
+
+    return PluginManager(
+        plugins,
+        async_hooks=app.config['ASYNC_HOOKS'],
+        parallel=app.config['HOOKS_PARALLEL'],
+        max_workers=app.config['HOOKS_MAX_WORKERS'],
+        hook_timeout=app.config['HOOKS_TIMEOUT'],
+        debounce=app.config['HOOKS_DEBOUNCE'],
+        debounce_max_wait=app.config['HOOKS_DEBOUNCE_MAX_WAIT'],
+        outbox=app.config['HOOKS_OUTBOX'])
+
+
+def get_plugins_state(info):
+    """
+    Get the plugins lifecycle state from the info table values
+    (falling back to the keys used by older versions).
+
+    :return: a dict with ``installed`` and ``enabled`` (sets of names)
+        and ``versions`` (name -> version the plugin was last upgraded
+        to) keys.
+    """
+
+    if PLUGINS_STATE_KEY in info:
+        state = info[PLUGINS_STATE_KEY]
+    else:
+        state = {'installed': info.get('core.plugins_installed', []),
+                 'enabled': info.get('core.plugins_enabled', [])}
+    return {'installed': set(state['installed']),
+            'enabled': set(state['enabled']),
+            'versions': dict(state.get('versions', {}))}
+
+
+def _read_plugins_state(conn):
+    from datacat.db import get_info
+
+    return get_plugins_state(get_info(conn, PLUGINS_INFO_KEYS))
+
+
+class PluginsLoader(object):
+    """
+    Import and set up the plugins on first use (thread-safe), then
+    run their pending lifecycle methods.
+
+    Lifecycle methods are run holding a PostgreSQL advisory lock, after
+    reading the state again, so that when many processes start at once
+    only the first one performs them, while the others just wait and
+    find nothing left to do. Plugins are upgraded only when their
+    ``version`` attribute differs from the one recorded at the last
+    upgrade (plugins without a version are upgraded once, when
+    first installed).
+
+    :param app: the Flask application
+    :param state: the plugins state, as returned by
+        :py:func:`get_plugins_state`
+    """
+
+    def __init__(self, app, state):
+        self.app = app
+        self.state = state
+        self._plugins = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._plugins is not None
+
+    @property
+    def needs_lifecycle(self):
+        """
+        Whether plugins need to be installed / enabled / disabled
+        (this can be told without importing them).
+        """
+
+        enabled_plugins = set(self.app.config['PLUGINS'])
+        return (enabled_plugins != self.state['enabled']
+                or not enabled_plugins <= self.state['installed'])
+
+    def get_plugins(self):
+        if self._plugins is None:
+            with self._lock:
+                if self._plugins is None:
+                    start = time.time()
+                    with self.app.app_context():
+                        plugins = load_plugins(self.app)
+                        if (self.needs_lifecycle or
+                                self.get_transitions(plugins, self.state)):
+                            self._run_lifecycle(plugins)
+                    self._plugins = plugins
+                    logger.info("Loaded %d plugins in %.3fs",
+                                len(plugins), time.time() - start)
+        return self._plugins
+
+    def get_transitions(self, plugins, state):
+        """
+        Get the lifecycle methods to be run.
+
+        :return: a list of ``(plugin, [method_name, ...])`` tuples
+        """
+
+        transitions = []
+        for plugin in plugins:
+            name = plugin._import_name
+            methods = []
+            if name not in state['installed']:
+                methods.append('install')
+            if name not in state['enabled']:
+                methods.append('enable')
+            if (name not in state['versions'] or state['versions'][name]
+                    != getattr(plugin, 'version', None)):
+                methods.append('upgrade')
+            if methods:
+                transitions.append((plugin, methods))
+        return transitions
+
+    def _run_lifecycle(self, plugins):
+        from datacat.db import advisory_lock, connect, set_info
+
+        conn = connect(**self.app.config['DATABASE'])
+        conn.autocommit = True
+        try:
+            with advisory_lock(conn, PLUGINS_LOCK_KEY):
+                # Another process might have done everything
+                # while we were waiting for the lock.
+                state = _read_plugins_state(conn)
+                self.state = state
+                transitions = self.get_transitions(plugins, state)
+                if not (transitions or self.needs_lifecycle):
+                    return
+
+                for plugin, methods in transitions:
+                    for method in methods:
+                        logger.info("Running %s() for plugin %s",
+                                    method, plugin._import_name)
+                        getattr(plugin, method)()
+
+                # Register new information about plugins
+                enabled_plugins = set(self.app.config['PLUGINS'])
+                versions = dict(state['versions'])
+                for plugin in plugins:
+                    versions[plugin._import_name] = getattr(
+                        plugin, 'version', None)
+                self.state = {
+                    'installed': state['installed'] | enabled_plugins,
+                    'enabled': enabled_plugins,
+                    'versions': versions,
+                }
+                set_info(conn, {PLUGINS_STATE_KEY: {
+                    'installed': sorted(self.state['installed']),
+                    'enabled': sorted(self.state['enabled']),
+                    'versions': versions,
+                }})
+        finally:
+            conn.close()
+
+
+@signals.worker_init.connect
+@signals.worker_process_init.connect
+def _load_worker_plugins(**kwargs):
+    """
+    Load the plugins when a Celery worker starts, even if
+    ``PLUGINS_LAZY_LOAD`` is on: the tasks they declare (including
+    the per-plugin hook tasks) must be registered before messages
+    for them are received.
+    """
+
+    for loader in list(_plugins_loaders):
+        loader.get_plugins()
+
+
+class LazyPluginsMiddleware(object):
+    """
+    WSGI middleware loading the plugins before handling the first
+    request, so that the routes they register are available.
+    """
+
+    def __init__(self, wsgi_app, loader):
+        self.wsgi_app = wsgi_app
+        self.loader = loader
+
+    def __call__(self, environ, start_response):
+        self.loader.get_plugins()
+        return self.wsgi_app(environ, start_response)
+
+
+def _ensure_tables(conn):
+    """
+    Create the database schema, unless it already exists.
+
+    The schema version is written in the same transaction creating the
+    tables (see :py:func:`datacat.db.create_tables`): if it's missing,
+    the schema might be being created by an older version, so we wait
+    for the lock and read it again.
+
+    :param conn: a connection with autocommit on
+    :return: the values read from the info table
+    """
+
+    from datacat.db import SCHEMA_VERSION_KEY, advisory_lock, create_tables
+
+    keys = [SCHEMA_VERSION_KEY] + PLUGINS_INFO_KEYS
+    info = _read_info(conn, keys)
+    if info is not None and SCHEMA_VERSION_KEY in info:
+        return info
+
+    # The info table doesn't exist: create the schema, making
+    # sure other processes aren't doing the same.
+    with advisory_lock(conn, SCHEMA_LOCK_KEY):
+        info = _read_info(conn, keys)
+        if info is None:
+            create_tables(conn)
+            info = _read_info(conn, keys)
+        return info
+
+
+def _read_info(conn, keys):
+    """
+    Read keys from the info table.
+
+    :return: a dict, or ``None`` if the table doesn't exist
+    """
+
+    from datacat.db import get_info
+
+    try:
+        return get_info(conn, keys)
+    except psycopg2.ProgrammingError:
+        return None
 
 
 def finalize_app(app):
-    """Prepare application for running"""
-
-    from datacat.db import db_info
+    """
+    Prepare application for running.
 
-    with app.app_context():
-        app.plugins = load_plugins(app)
+    The database schema is only created if missing, and the state
+    needed at startup is read with a single query. Plugins are
+    imported right away only if they need to be installed / enabled /
+    disabled, or if ``PLUGINS_LAZY_LOAD`` is off; otherwise, on first
+    use (first request or hook call), or when a Celery worker starts.
+    """
 
-        previously_enabled_plugins = set(db_info.get('core.plugins_enabled', []))  # noqa
-        previously_installed_plugins = set(db_info.get('core.plugins_installed', []))  # noqa
-        enabled_plugins = set(app.config['PLUGINS'])
+    from datacat.db import SCHEMA_VERSION_KEY, connect, get_schema_version
+    from datacat.utils.plugin_manager import register_outbox_consumers
 
-        # ------------------------------------------------------------
-        # Run the ``install()`` method for all the plugins that
-        # were not previously installed
-        plugins_to_install = enabled_plugins - previously_installed_plugins
+    start = time.time()
+    conn = connect(**app.config['DATABASE'])
+    conn.autocommit = True
+    try:
+        info = _ensure_tables(conn)
 
-        # ------------------------------------------------------------
-        # Run the ``enable()`` method for all the plugins that
-        # were not previously enabled
-        plugins_to_enable = enabled_plugins - previously_enabled_plugins
+        if info.get(SCHEMA_VERSION_KEY) != get_schema_version():
+            logger.warning("Database schema version %s doesn't match the"
+                           " current one (%s)", info.get(SCHEMA_VERSION_KEY),
+                           get_schema_version())
 
-        # ------------------------------------------------------------
-        # Run the ``disable()`` method for all the plugins that
-        # were previously enabled (and aren't anymore)
-        plugins_to_disable = previously_enabled_plugins - enabled_plugins
+        if app.config['HOOKS_OUTBOX']:
+            register_outbox_consumers(conn, app.config['PLUGINS'])
+    finally:
+        conn.close()
 
-        # Nothing will be uninstalled implicitly!
+    loader = PluginsLoader(app, get_plugins_state(info))
+    app.plugins = LocalProxy(loader.get_plugins)
+    app.wsgi_app = LazyPluginsMiddleware(app.wsgi_app, loader)
+    _plugins_loaders.add(loader)
 
-        # ------------------------------------------------------------
-        # Perform the operations from above
-        # ------------------------------------------------------------
+    if loader.needs_lifecycle or not app.config['PLUGINS_LAZY_LOAD']:
+        loader.get_plugins()
 
-        for plugin in app.plugins:
-            if plugin._import_name in plugins_to_install:
-                plugin.install()
-
-            if plugin._import_name in plugins_to_enable:
-                plugin.enable()
-
-            if plugin._import_name in plugins_to_disable:
-                plugin.disable()
-
-            if plugin._import_name in enabled_plugins:
-                plugin.upgrade()
-
-        # ------------------------------------------------------------
-        # Register new information about plugins
-
-        db_info['core.plugins_enabled'] = list(enabled_plugins)
-        db_info['core.plugins_installed'] = list(
-            previously_installed_plugins | enabled_plugins)
+    logger.info("Application started in %.3fs (plugins %s)",
+                time.time() - start,
+                'loaded' if loader.loaded else 'not loaded yet')
 
 
 def make_app(config=None):
-    from datacat.db import create_tables, connect
-
     app = make_flask_app(config)
     celery_app = make_celery(app.config)
     celery_app.set_current()
-    _adm_conn = connect(**app.config['DATABASE'])
-    _adm_conn.autocommit = True
-    create_tables(_adm_conn)
     finalize_app(app)
     return app
 
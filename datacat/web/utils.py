@@ -2,32 +2,213 @@
 Utilities for the RESTful API
 """
 
+from collections import Iterator
 from functools import wraps
-import json
+from itertools import chain
+import logging
 
-from flask import request, make_response
+from flask import request, make_response, Response, stream_with_context
 from werkzeug.exceptions import BadRequest
+from werkzeug.http import parse_etags
+
+from datacat.db import fieldsets
+from datacat.utils import json_codec
+
+logger = logging.getLogger(__name__)
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+
+class RawJSON(str):
+    """
+    Marks an already encoded JSON value (eg. rendered by the database
+    using ``row_to_json()``), to be passed as-is by :py:func:`json_view`.
+    """
+
+    __slots__ = []
 
 
 def json_view(func):
+    """
+    Decorator for views returning JSON-serializable objects,
+    optionally along with status code and headers (as a tuple).
+
+    Views can also return iterators (eg. generators): in that case,
+    a JSON array is streamed to the client, one item at a time,
+    without building the whole list / response in memory.
+
+    If the client asks for it (via ``?format=ndjson`` or the ``Accept``
+    header), lists and iterators are sent as newline-delimited JSON
+    (one item per line) instead.
+
+    The first item of an iterator is retrieved before the response is
+    started, so that early errors still result in a proper error
+    response. As the status has already been sent, errors happening
+    later are logged and the stream is ended: a JSON array is left
+    unterminated (so clients can't mistake it for the whole list),
+    while an ``{"error": ...}`` record is appended to NDJSON streams.
+    """
+
     @wraps(func)
     def wrapper(*a, **kw):
         # todo: catch exceptions and rewrap + make sure they're all JSON
         rv = func(*a, **kw)
+        if isinstance(rv, Response):
+            return rv
+
+        args = ()
         if isinstance(rv, tuple):
-            resp = make_response(json.dumps(rv[0]), *rv[1:])
+            rv, args = rv[0], rv[1:]
+
+        if isinstance(rv, Iterator):
+            rv = _prefetch(rv)
+
+        ndjson = _wants_ndjson() and isinstance(rv, (list, Iterator))
+        if ndjson:
+            resp = make_response(
+                Response(stream_with_context(_encode_ndjson(rv))), *args)
+        elif isinstance(rv, Iterator):
+            resp = make_response(
+                Response(stream_with_context(_encode_json_array(rv))), *args)
         else:
-            resp = make_response(json.dumps(rv))
-        resp.headers['Content-type'] = 'application/json'
+            resp = make_response(_encode_json(rv), *args)
+
+        resp.headers['Content-type'] = (
+            NDJSON_MIMETYPE if ndjson else 'application/json')
         return resp
     return wrapper
 
 
+def _wants_ndjson():
+    """
+    Check whether the client asked for newline-delimited JSON;
+    responses depending on this should send ``Vary: Accept``.
+    """
+
+    if request.args.get('format') == 'ndjson':
+        return True
+    best_match = request.accept_mimetypes.best_match(
+        ['application/json', NDJSON_MIMETYPE])
+    return best_match == NDJSON_MIMETYPE
+
+
+def _encode_json(obj):
+    if isinstance(obj, RawJSON):
+        return obj
+    return json_codec.dumps(obj)
+
+
+def _prefetch(items):
+    """Get the first item from an iterator, returning an equivalent one"""
+
+    for item in items:
+        return chain([item], items)
+    return iter([])
+
+
+def _encode_json_array(items):
+    yield '['
+    separator = ''
+    try:
+        for item in items:
+            yield separator
+            yield _encode_json(item)
+            separator = ','
+    except Exception:
+        logger.exception("Error while streaming response")
+        return
+    yield ']'
+
+
+def _encode_ndjson(items):
+    try:
+        for item in items:
+            yield _encode_json(item)
+            yield '\n'
+    except Exception:
+        logger.exception("Error while streaming response")
+        yield _encode_json({'error': 'Internal server error'})
+        yield '\n'
+
+
 def _get_json_from_request():
     if request.headers.get('Content-type') != 'application/json':
         raise BadRequest(
             "Unsupported Content-type (expected application/json)")
     try:
-        return json.loads(request.data)
+        return json_codec.loads(request.data)
     except:
         raise BadRequest('Error decoding json')
+
+
+def _get_paging_args(default_limit=20, max_limit=100):
+    """
+    Get paging arguments (``offset`` and ``limit``) from the request
+    query string.
+
+    :return: a ``(offset, limit)`` tuple
+    """
+
+    try:
+        offset = int(request.args.get('offset', 0))
+        limit = int(request.args.get('limit', default_limit))
+    except ValueError:
+        raise BadRequest('Offset and limit must be integers')
+
+    if offset < 0 or limit < 0:
+        raise BadRequest('Offset and limit must be positive')
+
+    return offset, min(limit, max_limit)
+
+
+def _get_fields_arg(columns, json_columns=(), prefix=()):
+    """
+    Get the sparse fieldset selection from the ``fields`` query
+    string argument.
+
+    See :py:func:`datacat.db.fieldsets.parse_fields` for the arguments.
+
+    :return: a list of field paths, or ``None`` if not specified
+    """
+
+    spec = request.args.get('fields')
+    if spec is None:
+        return None
+
+    try:
+        return fieldsets.parse_fields(
+            spec, columns, json_columns=json_columns, prefix=prefix)
+    except ValueError as e:
+        raise BadRequest(str(e))
+
+
+def _make_version_etag(version):
+    """Build the (quoted) ETag header value for an object version"""
+
+    return '"{0}"'.format(version)
+
+
+def _get_if_match_versions(header=None):
+    """
+    Get the object versions listed in the ``If-Match`` request header
+    (or in the passed header value).
+
+    :return:
+        ``None`` if the header is missing (or ``*``), else a list
+        of versions (which may be empty, if no ETag was valid).
+    """
+
+    if header is None:
+        if_match = request.if_match
+    else:
+        if_match = parse_etags(header)
+    if not if_match or if_match.star_tag:
+        return None
+
+    versions = []
+    for etag in if_match.as_set():
+        try:
+            versions.append(int(etag))
+        except ValueError:
+            pass  # Cannot match anything
+    return versions
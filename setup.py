@@ -29,6 +29,12 @@ setup(
         'celery[redis]',  # For async tasks
         'requests',  # To download data from HTTP(S)
     ],
+    extras_require={
+        'speedups': [
+            'ujson',  # Faster JSON decoding
+            'simplejson',  # Alternative JSON encoder / decoder
+        ],
+    },
     # tests_require=tests_require,
     # test_suite='tests',
     classifiers=[
@@ -0,0 +1,58 @@
+import pytest
+
+from datacat.db.fieldsets import parse_fields, select_fields_sql, build_object
+
+
+def test_parse_fields():
+    columns = ['id', 'configuration', 'mtime']
+    json_columns = ['configuration']
+
+    assert parse_fields('id', columns) == [('id',)]
+    assert parse_fields(
+        'mtime, id,configuration.metadata.title,',
+        columns, json_columns) == [
+            ('configuration', 'metadata', 'title'), ('id',), ('mtime',)]
+
+    # Paths contained in other selected paths are dropped
+    assert parse_fields(
+        'configuration.metadata.title,configuration.metadata,id',
+        columns, json_columns) == [('configuration', 'metadata'), ('id',)]
+
+    assert parse_fields(
+        'metadata.title,license', ['configuration'], json_columns,
+        prefix=('configuration',)) == [
+            ('configuration', 'license'),
+            ('configuration', 'metadata', 'title')]
+
+    for spec in ('', ',', 'foo', 'id.foo', 'configuration..title',
+                 'search_vector'):
+        with pytest.raises(ValueError):
+            parse_fields(spec, columns, json_columns)
+
+
+def test_select_fields_sql():
+    paths = [('configuration', 'metadata', 'title'), ('id',)]
+    expressions, query_args = select_fields_sql(paths)
+    assert expressions == ['"configuration" #> %(_f0)s AS _f0',
+                           '"id" AS _f1']
+    assert query_args == {'_f0': ['metadata', 'title']}
+
+
+def test_build_object():
+    paths = [('configuration', 'metadata', 'description'),
+             ('configuration', 'metadata', 'title'), ('id',)]
+    row = {'_f0': None, '_f1': 'Hello', '_f2': 1}
+
+    assert build_object(paths, row) == {
+        'id': 1,
+        'configuration': {
+            'metadata': {'title': 'Hello', 'description': None}}}
+
+    paths = [('configuration', 'license'), ('configuration', 'name')]
+    row = {'_f0': 'CC0', '_f1': 'hello'}
+    assert build_object(paths, row, prefix=('configuration',)) == {
+        'license': 'CC0', 'name': 'hello'}
+
+    # Selecting the whole object
+    assert build_object([('metadata',)], {'_f0': {'a': 1}},
+                        prefix=('metadata',)) == {'a': 1}
@@ -0,0 +1,75 @@
+from datacat.db.instrumentation import (
+    fingerprint_query, is_explainable, make_cursor_factory,
+    get_cursor_factory)
+
+
+def test_fingerprint_query():
+    assert fingerprint_query(
+        'SELECT * FROM "dataset" WHERE "id"=%(id)s') == \
+        'SELECT * FROM "dataset" WHERE "id"=?'
+
+    assert fingerprint_query(
+        "SELECT * FROM info WHERE key = 'foo' AND value = 'it''s'") == \
+        "SELECT * FROM info WHERE key = ? AND value = ?"
+
+    assert fingerprint_query(
+        "SELECT * FROM geodata_12 WHERE id IN (1, 2, 3) LIMIT 10") == \
+        "SELECT * FROM geodata_12 WHERE id IN (?) LIMIT ?"
+
+    assert fingerprint_query("""
+    INSERT INTO "dataset" (configuration, ctime, mtime)
+    VALUES (%(conf)s::json, %(mtime)s, %(mtime)s)
+    RETURNING id;
+    """) == ('INSERT INTO "dataset" (configuration, ctime, mtime) '
+             'VALUES (?::json, ?, ?) RETURNING id;')
+
+
+def test_is_explainable():
+    assert is_explainable('SELECT * FROM dataset WHERE id = %(id)s')
+    assert is_explainable('  select count(*) from resource')
+
+    assert not is_explainable('UPDATE dataset SET mtime = now()')
+    assert not is_explainable('SELECT * FROM dataset FOR UPDATE')
+    assert not is_explainable(
+        'SELECT * FROM hook_outbox_cursor FOR NO KEY UPDATE SKIP LOCKED')
+    assert not is_explainable('SELECT * FROM dataset FOR KEY SHARE')
+    assert not is_explainable("SELECT nextval('dataset_id_seq')")
+    assert not is_explainable('SELECT lo_create(0)')
+    assert not is_explainable('SELECT pg_advisory_lock(1)')
+
+
+def test_cursor_factory_configuration():
+    assert get_cursor_factory({}) is None
+    assert get_cursor_factory({'DATABASE_INSTRUMENTATION': False}) is None
+
+    factory = get_cursor_factory({
+        'DATABASE_INSTRUMENTATION': True,
+        'DATABASE_SLOW_QUERY_THRESHOLD': 0.1,
+    })
+    assert factory.slow_query_threshold == 0.1
+    assert factory.explain_slow_queries is False
+
+    factory = make_cursor_factory(explain_slow_queries=True)
+    assert factory.slow_query_threshold is None
+    assert factory.explain_slow_queries is True
+
+
+def test_instrumented_cursor(configured_app, postgres_user_conf):
+    from datacat.db import connect
+    from datacat.db.instrumentation import get_query_log
+
+    conn = connect(cursor_factory=make_cursor_factory(),
+                   **postgres_user_conf)
+
+    with configured_app.app_context():
+        with conn, conn.cursor() as cur:
+            cur.execute("SELECT %(x)s AS x UNION ALL SELECT 2", {'x': 1})
+            assert [row['x'] for row in cur.fetchall()] == [1, 2]
+
+        query_log = get_query_log()
+        assert len(query_log) == 1
+        assert query_log[0].fingerprint == 'SELECT ? AS x UNION ALL SELECT ?'
+        assert query_log[0].rowcount == 2
+        assert query_log[0].endpoint is None
+
+    conn.close()
@@ -0,0 +1,128 @@
+import json
+
+import mock
+import psycopg2
+
+
+def _mock_plugins(app):
+    return mock.patch.object(
+        app, 'plugins', **{'dispatch_hook.return_value': []})
+
+
+def _post_batch(apptc, operations, **kwargs):
+    payload = dict(kwargs, operations=operations)
+    resp = apptc.post('/api/1/admin/batch',
+                      headers={'Content-type': 'application/json'},
+                      data=json.dumps(payload))
+    assert resp.status_code == 200
+    return json.loads(resp.data)
+
+
+def test_admin_batch(configured_app):
+    apptc = configured_app.test_client()
+
+    with _mock_plugins(configured_app) as plugins:
+        result = _post_batch(apptc, [
+            {'type': 'dataset', 'op': 'create', 'data': {'a': 1}},
+            {'type': 'dataset', 'op': 'create', 'data': {'b': 1}},
+        ])
+    assert result['committed'] is True
+    assert [x['status'] for x in result['results']] == [201, 201]
+    id1, id2 = [x['id'] for x in result['results']]
+    etag2 = result['results'][1]['etag']
+    assert plugins.dispatch_hook.call_count == 2
+
+    with _mock_plugins(configured_app) as plugins:
+        result = _post_batch(apptc, [
+            {'type': 'dataset', 'op': 'patch', 'id': id1, 'data': {'b': 2}},
+            {'type': 'dataset', 'op': 'patch', 'id': id1, 'data': {'c': 3}},
+            {'type': 'dataset', 'op': 'update', 'id': id2, 'data': {'x': 1},
+             'if_match': etag2},
+        ])
+    assert result['committed'] is True
+    assert [x['status'] for x in result['results']] == [200, 200, 200]
+
+    # Hooks are called once per object
+    assert plugins.dispatch_hook.call_args_list == [
+        mock.call('dataset_update', id1, {'a': 1, 'b': 2, 'c': 3}),
+        mock.call('dataset_update', id2, {'x': 1}),
+    ]
+
+    resp = apptc.get('/api/1/admin/dataset/{0}'.format(id1))
+    assert json.loads(resp.data) == {'a': 1, 'b': 2, 'c': 3}
+
+
+def test_admin_batch_atomic_failure(configured_app):
+    apptc = configured_app.test_client()
+
+    with _mock_plugins(configured_app) as plugins:
+        result = _post_batch(apptc, [
+            {'type': 'dataset', 'op': 'create', 'data': {'a': 1}},
+            {'type': 'dataset', 'op': 'patch', 'id': 123456, 'data': {}},
+            {'type': 'dataset', 'op': 'create', 'data': {'a': 2}},
+        ])
+    assert result['committed'] is False
+    assert [x['status'] for x in result['results']] == [201, 404, 424]
+    assert not plugins.dispatch_hook.called
+
+    # The first dataset was rolled back
+    resp = apptc.get('/api/1/admin/dataset/{0}'
+                     .format(result['results'][0]['id']))
+    assert resp.status_code == 404
+
+
+def test_admin_batch_non_atomic(configured_app):
+    apptc = configured_app.test_client()
+    configured_app.config['ADMIN_BATCH_COMMIT_SIZE'] = 2
+
+    try:
+        result = _post_batch(apptc, [
+            {'type': 'dataset', 'op': 'create', 'data': {'a': 1}},
+            {'type': 'dataset', 'op': 'patch', 'id': 123456, 'data': {}},
+            {'type': 'dataset', 'op': 'frobnicate'},
+            {'type': 'dataset', 'op': 'create', 'data': {'a': 2}},
+            {'type': 'dataset', 'op': 'update', 'id': 'foo', 'data': {}},
+        ], atomic=False)
+    finally:
+        configured_app.config['ADMIN_BATCH_COMMIT_SIZE'] = 500
+
+    assert result['committed'] is True
+    assert [x['status'] for x in result['results']] == [
+        201, 404, 400, 201, 400]
+
+    for item in (result['results'][0], result['results'][3]):
+        resp = apptc.get('/api/1/admin/dataset/{0}'.format(item['id']))
+        assert resp.status_code == 200
+
+
+def test_admin_batch_database_errors(configured_app):
+    apptc = configured_app.test_client()
+
+    with mock.patch('datacat.web.blueprints.admin._insert_dataset',
+                    side_effect=psycopg2.IntegrityError('duplicate key')):
+        result = _post_batch(apptc, [
+            {'type': 'dataset', 'op': 'create', 'data': {'a': 1}},
+        ], atomic=False)
+    assert result['results'] == [{'status': 409, 'error': 'duplicate key'}]
+
+    with mock.patch('datacat.web.blueprints.admin._insert_dataset',
+                    side_effect=psycopg2.InternalError('oops')):
+        result = _post_batch(apptc, [
+            {'type': 'dataset', 'op': 'create', 'data': {'a': 1}},
+        ], atomic=False)
+    assert result['results'] == [{'status': 500, 'error': 'Database error'}]
+
+    result = _post_batch(apptc, [
+        {'type': 'dataset', 'op': 'create', 'data': [1, 2]},
+        {'type': 'dataset', 'op': 'create'},
+    ], atomic=False)
+    assert [x['status'] for x in result['results']] == [400, 400]
+
+
+def test_admin_batch_errors(configured_app):
+    apptc = configured_app.test_client()
+
+    resp = apptc.post('/api/1/admin/batch',
+                      headers={'Content-type': 'application/json'},
+                      data=json.dumps([{'type': 'dataset'}]))
+    assert resp.status_code == 400
@@ -0,0 +1,175 @@
+from celery import Celery, signals
+from flask import Flask
+import mock
+import psycopg2
+
+from datacat.db import SCHEMA_VERSION_KEY, get_schema_version
+from datacat.web.core import (
+    PLUGINS_STATE_KEY, LazyPluginsMiddleware, PluginsLoader,
+    _ensure_tables, finalize_app, get_plugins_state, make_flask_app)
+
+
+def _make_plugin(name, version='1.0'):
+    return mock.Mock(_import_name=name, version=version)
+
+
+def test_get_plugins_state():
+    assert get_plugins_state({}) == {
+        'installed': set(), 'enabled': set(), 'versions': {}}
+
+    # Keys used by older versions
+    assert get_plugins_state({
+        'core.plugins_installed': ['a', 'b'],
+        'core.plugins_enabled': ['a'],
+    }) == {'installed': set(['a', 'b']), 'enabled': set(['a']),
+           'versions': {}}
+
+    assert get_plugins_state({
+        'core.plugins_state': {'installed': ['a', 'b'], 'enabled': ['b'],
+                               'versions': {'b': '1.0'}},
+        'core.plugins_enabled': ['a'],
+    }) == {'installed': set(['a', 'b']), 'enabled': set(['b']),
+           'versions': {'b': '1.0'}}
+
+
+def test_ensure_tables():
+    conn = mock.Mock()
+    ready = {SCHEMA_VERSION_KEY: 'v1'}
+
+    def _ensure(*info):
+        with mock.patch('datacat.db.get_info', side_effect=info), \
+                mock.patch('datacat.db.advisory_lock') as advisory_lock, \
+                mock.patch('datacat.db.create_tables') as create_tables:
+            assert _ensure_tables(conn) == info[-1]
+        return advisory_lock.called, create_tables.called
+
+    # Schema ready: no locking
+    assert _ensure(ready) == (False, False)
+
+    # Missing schema: created while holding the lock
+    missing = psycopg2.ProgrammingError('relation "info" does not exist')
+    assert _ensure(missing, missing, ready) == (True, True)
+
+    # Created by another process in the meantime
+    assert _ensure(missing, ready) == (True, False)
+
+    # No schema version (yet): wait for the lock, and read it again
+    assert _ensure({}, ready) == (True, False)
+
+
+def test_plugins_loader_transitions():
+    app = Flask(__name__)
+    app.config['PLUGINS'] = ['tests:a', 'tests:b']
+    plugins = [_make_plugin('tests:a'), _make_plugin('tests:b', None)]
+
+    loader = PluginsLoader(app, {'installed': set(['tests:a']),
+                                 'enabled': set(['tests:a']),
+                                 'versions': {'tests:a': '0.9'}})
+    assert loader.needs_lifecycle
+    assert loader.get_transitions(plugins, loader.state) == [
+        (plugins[0], ['upgrade']),
+        (plugins[1], ['install', 'enable', 'upgrade']),
+    ]
+
+    state = {'installed': set(['tests:a', 'tests:b']),
+             'enabled': set(['tests:a', 'tests:b']),
+             'versions': {'tests:a': '1.0', 'tests:b': None}}
+    loader = PluginsLoader(app, state)
+    assert not loader.needs_lifecycle
+    assert loader.get_transitions(plugins, state) == []
+
+
+def test_plugins_loader():
+    app = Flask(__name__)
+    app.config['PLUGINS'] = ['tests:plugin']
+    plugin = _make_plugin('tests:plugin')
+
+    loader = PluginsLoader(app, {'installed': set(['tests:plugin']),
+                                 'enabled': set(['tests:plugin']),
+                                 'versions': {'tests:plugin': '1.0'}})
+    assert not loader.loaded
+
+    def wsgi_app(environ, start_response):
+        assert loader.loaded
+        return ['Hello']
+
+    middleware = LazyPluginsMiddleware(wsgi_app, loader)
+    with mock.patch('datacat.web.core.load_plugins',
+                    return_value=[plugin]) as load_plugins:
+        assert middleware({}, None) == ['Hello']
+        assert middleware({}, None) == ['Hello']
+        assert loader.get_plugins() == [plugin]
+    assert load_plugins.call_count == 1
+
+    # Nothing to install / enable / upgrade
+    assert plugin.install.call_count == 0
+    assert plugin.enable.call_count == 0
+    assert plugin.upgrade.call_count == 0
+
+
+def test_worker_loads_plugins():
+    celery_app = Celery('tests', set_as_current=False)
+    plugin = _make_plugin('tests:worker_plugin')
+    plugin.task = celery_app.task
+
+    app = make_flask_app({'PLUGINS': ['tests:worker_plugin'],
+                          'PLUGINS_LAZY_LOAD': True,
+                          'HOOKS_OUTBOX': False})
+    info = {SCHEMA_VERSION_KEY: get_schema_version(), PLUGINS_STATE_KEY: {
+        'installed': ['tests:worker_plugin'],
+        'enabled': ['tests:worker_plugin'],
+        'versions': {'tests:worker_plugin': '1.0'}}}
+
+    with mock.patch('datacat.db.connect'), \
+            mock.patch('datacat.web.core._ensure_tables', return_value=info), \
+            mock.patch('datacat.web.core.import_object',
+                       return_value=plugin):
+        finalize_app(app)
+        assert 'tests:worker_plugin.call_hook' not in celery_app.tasks
+
+        # Celery workers load the plugins at startup, registering
+        # their tasks.
+        signals.worker_init.send(sender=None)
+        assert 'tests:worker_plugin.call_hook' in celery_app.tasks
+
+    assert plugin.setup.call_count == 1
+    assert plugin.install.call_count == 0
+
+
+def test_app_restart(configured_app):
+    def _start_app(plugin):
+        app = Flask('datacat')
+        app.config.update(configured_app.config)
+        app.config['PLUGINS'] = ['tests:plugin']
+        with mock.patch('datacat.web.core.load_plugins',
+                        return_value=[plugin]) as load_plugins:
+            finalize_app(app)
+        return app, load_plugins.call_count
+
+    # Plugins list changed: plugin is installed at startup
+    plugin = _make_plugin('tests:plugin')
+    app, load_count = _start_app(plugin)
+    assert load_count == 1
+    assert plugin.install.call_count == 1
+    assert plugin.enable.call_count == 1
+    assert plugin.upgrade.call_count == 1
+
+    # Nothing changed: plugins are not imported at startup,
+    # and nothing is run when they are.
+    plugin = _make_plugin('tests:plugin')
+    app, load_count = _start_app(plugin)
+    assert load_count == 0
+    with mock.patch('datacat.web.core.load_plugins', return_value=[plugin]):
+        assert list(app.plugins) == [plugin]
+    assert plugin.install.call_count == 0
+    assert plugin.upgrade.call_count == 0
+
+    # New plugin version: only upgraded, once
+    plugin = _make_plugin('tests:plugin', '2.0')
+    app1, _ = _start_app(plugin)
+    app2, _ = _start_app(plugin)
+    with mock.patch('datacat.web.core.load_plugins', return_value=[plugin]):
+        list(app1.plugins)
+        list(app2.plugins)
+    assert plugin.install.call_count == 0
+    assert plugin.upgrade.call_count == 1
@@ -0,0 +1,111 @@
+import json
+import re
+import urlparse
+
+import mock
+
+from datacat.db.changes import ChangeToken
+from datacat.utils.plugin_manager import PluginManager
+
+
+def test_change_token():
+    assert ChangeToken.parse(None) == ChangeToken(0, 0)
+    assert ChangeToken.parse('') == ChangeToken(0, 0)
+    assert ChangeToken.parse('1234.56') == ChangeToken(1234, 56)
+    assert str(ChangeToken(1234, 56)) == '1234.56'
+    assert ChangeToken(10, 0) > ChangeToken(9, 100)
+
+
+def test_change_feed(configured_app):
+    apptc = configured_app.test_client()
+
+    resp = apptc.get('/api/1/admin/changes')
+    assert resp.status_code == 200
+    data = json.loads(resp.data)
+    assert data['complete'] is True
+    token = data['next']
+
+    # Create a dataset and a resource
+    resp = apptc.post('/api/1/admin/dataset/',
+                      headers={'Content-type': 'application/json'},
+                      data=json.dumps({'Hello': 'World'}))
+    assert resp.status_code == 201
+    path = urlparse.urlparse(resp.headers['Location']).path
+    dataset_id = int(re.match('/api/1/admin/dataset/([0-9]+)', path)
+                     .group(1))
+
+    resp = apptc.post('/api/1/admin/resource/', data='Some data')
+    assert resp.status_code == 201
+    path = urlparse.urlparse(resp.headers['Location']).path
+    resource_id = int(re.match('/api/1/admin/resource/([0-9]+)', path)
+                      .group(1))
+
+    resp = apptc.get('/api/1/admin/changes?since={0}'.format(token))
+    data = json.loads(resp.data)
+    assert [(x['type'], x['id'], x['operation'])
+            for x in data['changes']] == [
+        ('dataset', dataset_id, 'insert'),
+        ('resource', resource_id, 'insert'),
+    ]
+    token = data['next']
+
+    # Nothing changed
+    resp = apptc.get('/api/1/admin/changes?since={0}'.format(token))
+    data = json.loads(resp.data)
+    assert data['changes'] == []
+
+    # Deletes are recorded too
+    resp = apptc.delete('/api/1/admin/dataset/{0}'.format(dataset_id))
+    assert resp.status_code == 200
+
+    resp = apptc.get('/api/1/admin/changes?since={0}'.format(token))
+    data = json.loads(resp.data)
+    assert [(x['type'], x['id'], x['operation'])
+            for x in data['changes']] == [
+        ('dataset', dataset_id, 'delete'),
+    ]
+
+    resp = apptc.get('/api/1/admin/changes?since=invalid')
+    assert resp.status_code == 400
+
+
+def test_hook_outbox(configured_app):
+    from datacat.db import connect
+    from datacat.utils.plugin_manager import drain_outbox, replay_outbox
+
+    apptc = configured_app.test_client()
+    plugin = mock.Mock(_import_name='tests:outbox_plugin',
+                       _hooks={'dataset_create': [mock.Mock()]})
+    plugin.call_hook_async.return_value = []
+    plugins = PluginManager([plugin])
+    conn = connect(**configured_app.config['DATABASE'])
+
+    try:
+        # Register the consumer at the current end of the log
+        assert drain_outbox(plugins, conn) == 0
+
+        resp = apptc.post('/api/1/admin/dataset/',
+                          headers={'Content-type': 'application/json'},
+                          data=json.dumps({'Hello': 'World'}))
+        assert resp.status_code == 201
+        path = urlparse.urlparse(resp.headers['Location']).path
+        dataset_id = int(re.match('/api/1/admin/dataset/([0-9]+)', path)
+                         .group(1))
+
+        drain_outbox(plugins, conn)
+        assert plugin.call_hook_async.call_args_list == [
+            mock.call('dataset_create', dataset_id, {'Hello': 'World'})]
+
+        # Already delivered
+        plugin.call_hook_async.reset_mock()
+        drain_outbox(plugins, conn)
+        assert plugin.call_hook_async.call_count == 0
+
+        # Replay everything
+        replay_outbox(conn, 'tests:outbox_plugin')
+        drain_outbox(plugins, conn)
+        assert mock.call('dataset_create', dataset_id, {'Hello': 'World'}) \
+            in plugin.call_hook_async.call_args_list
+
+    finally:
+        conn.close()
@@ -1,7 +1,8 @@
 import pytest
 import psycopg2
 
-from datacat.db import create_tables, drop_tables, DbInfoDict
+from datacat.db import (
+    create_tables, drop_tables, DbInfoDict, get_counters, reconcile_counters)
 
 
 def test_table_create_drop(postgres_user_db_ac):
@@ -108,3 +109,62 @@ def test_db_info_table(postgres_user_db):
     assert sorted(list(db_info.iteritems())) == [
         ('foo', 'FOO'),
     ]
+
+
+def test_db_counters(postgres_user_db):
+    conn = postgres_user_db
+
+    with conn:
+        assert get_counters(conn) == {
+            'dataset.count': 0,
+            'dataset.changes': 0,
+            'resource.count': 0,
+            'resource.changes': 0,
+            'resource.bytes': 0,
+        }
+
+    with conn, conn.cursor() as cur:
+        cur.execute("""
+        INSERT INTO dataset (configuration) VALUES ('{}'), ('{}'), ('{}');
+        INSERT INTO resource (size) VALUES (100), (20);
+        """)
+
+    with conn:
+        assert get_counters(conn) == {
+            'dataset.count': 3,
+            'dataset.changes': 3,
+            'resource.count': 2,
+            'resource.changes': 2,
+            'resource.bytes': 120,
+        }
+
+    with conn, conn.cursor() as cur:
+        cur.execute("""
+        DELETE FROM dataset WHERE id = (SELECT min(id) FROM dataset);
+        UPDATE resource SET size = 50 WHERE size = 100;
+        """)
+
+    with conn:
+        assert get_counters(conn) == {
+            'dataset.count': 2,
+            'dataset.changes': 4,
+            'resource.count': 2,
+            'resource.changes': 3,
+            'resource.bytes': 70,
+        }
+
+    # Mess up counters, then reconcile (changes counters are left
+    # alone, they can't be recomputed)
+    with conn, conn.cursor() as cur:
+        cur.execute('UPDATE "counter" SET "value" = 1000;')
+
+    reconcile_counters(conn)
+
+    with conn:
+        assert get_counters(conn) == {
+            'dataset.count': 2,
+            'dataset.changes': 1000,
+            'resource.count': 2,
+            'resource.changes': 1000,
+            'resource.bytes': 70,
+        }
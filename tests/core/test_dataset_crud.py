@@ -2,6 +2,8 @@ import json
 import re
 import urlparse
 
+import mock
+
 
 def test_dataset_empty_listing(configured_app):
     apptc = configured_app.test_client()
@@ -9,6 +11,7 @@ def test_dataset_empty_listing(configured_app):
     resp = apptc.get('/api/1/admin/dataset/')
     assert resp.status_code == 200
     assert json.loads(resp.data) == []
+    assert resp.headers['X-Total-Count'] == '0'
 
 
 def test_dataset_crud(configured_app):
@@ -44,6 +47,7 @@ def test_dataset_crud(configured_app):
     assert len(data) == 1
     assert data[0]['id'] == dataset_id
     assert data[0]['configuration'] == {'Hello': 'World'}
+    assert resp.headers['X-Total-Count'] == '1'
 
     # ------------------------------------------------------------
     # Update and make sure it is updated
@@ -103,6 +107,7 @@ def test_dataset_crud(configured_app):
     resp = apptc.get('/api/1/admin/dataset/')
     assert resp.status_code == 200
     assert json.loads(resp.data) == []
+    assert resp.headers['X-Total-Count'] == '0'
 
 
 def test_dataset_crud_errors(configured_app):
@@ -123,3 +128,225 @@ def test_dataset_crud_errors(configured_app):
 
     resp = apptc.delete('/api/1/admin/dataset/12345')
     assert resp.status_code == 200
+
+
+def test_dataset_patch_if_match(configured_app):
+    apptc = configured_app.test_client()
+
+    resp = apptc.post('/api/1/admin/dataset/',
+                      headers={'Content-type': 'application/json'},
+                      data=json.dumps({'foo': 'FOO', 'bar': 'BAR'}))
+    assert resp.status_code == 201
+    path = urlparse.urlparse(resp.headers['Location']).path
+    match = re.match('/api/1/admin/dataset/([0-9]+)', path)
+    dataset_id = int(match.group(1))
+    url = '/api/1/admin/dataset/{0}'.format(dataset_id)
+
+    resp = apptc.get(url)
+    assert resp.status_code == 200
+    etag = resp.headers['ETag']
+
+    resp = apptc.patch(url, headers={'Content-type': 'application/json',
+                                     'If-Match': etag},
+                       data=json.dumps({'foo': 'NEW FOO'}))
+    assert resp.status_code == 200
+    new_etag = resp.headers['ETag']
+    assert new_etag != etag
+
+    # Trying again with the old version must fail
+    resp = apptc.patch(url, headers={'Content-type': 'application/json',
+                                     'If-Match': etag},
+                       data=json.dumps({'bar': 'NEW BAR'}))
+    assert resp.status_code == 412
+
+    resp = apptc.get(url)
+    assert resp.headers['ETag'] == new_etag
+    assert json.loads(resp.data) == {'foo': 'NEW FOO', 'bar': 'BAR'}
+
+    resp = apptc.patch('/api/1/admin/dataset/12345',
+                       headers={'Content-type': 'application/json',
+                                'If-Match': etag},
+                       data=json.dumps({'bar': 'NEW BAR'}))
+    assert resp.status_code == 404
+
+    resp = apptc.patch(url, headers={'Content-type': 'application/json'},
+                       data=json.dumps(['not', 'an', 'object']))
+    assert resp.status_code == 400
+
+
+def test_dataset_index_rendered_in_database(configured_app):
+    apptc = configured_app.test_client()
+
+    for i in xrange(3):
+        resp = apptc.post('/api/1/admin/dataset/',
+                          headers={'Content-type': 'application/json'},
+                          data=json.dumps({'title': 'Dataset {0}'.format(i)}))
+        assert resp.status_code == 201
+
+    resp = apptc.get('/api/1/admin/dataset/')
+    assert resp.status_code == 200
+    expected = json.loads(resp.data)
+
+    configured_app.config['RENDER_INDEX_IN_DATABASE'] = True
+    try:
+        resp = apptc.get('/api/1/admin/dataset/')
+    finally:
+        configured_app.config['RENDER_INDEX_IN_DATABASE'] = False
+
+    assert resp.status_code == 200
+    assert resp.headers['Content-type'] == 'application/json'
+    assert resp.headers['X-Total-Count'] == str(len(expected))
+    assert json.loads(resp.data) == expected
+
+
+def test_dataset_conditional_get(configured_app):
+    apptc = configured_app.test_client()
+
+    resp = apptc.get('/api/1/admin/dataset/')
+    assert resp.status_code == 200
+    index_etag = resp.headers['ETag']
+    total_count = resp.headers['X-Total-Count']
+
+    resp = apptc.get('/api/1/admin/dataset/',
+                     headers={'If-None-Match': index_etag})
+    assert resp.status_code == 304
+    assert resp.data == ''
+    assert resp.headers['X-Total-Count'] == total_count
+    assert resp.headers['Vary'] == 'Accept'
+
+    # The same URL, in a different format, has a different ETag
+    resp = apptc.get('/api/1/admin/dataset/',
+                     headers={'If-None-Match': index_etag,
+                              'Accept': 'application/x-ndjson'})
+    assert resp.status_code == 200
+    assert resp.headers['Vary'] == 'Accept'
+    assert resp.headers['ETag'] != index_etag
+
+    resp = apptc.post('/api/1/admin/dataset/',
+                      headers={'Content-type': 'application/json'},
+                      data=json.dumps({'foo': 'FOO'}))
+    assert resp.status_code == 201
+    url = urlparse.urlparse(resp.headers['Location']).path
+
+    # The collection changed
+    resp = apptc.get('/api/1/admin/dataset/',
+                     headers={'If-None-Match': index_etag})
+    assert resp.status_code == 200
+    assert resp.headers['ETag'] != index_etag
+    index_etag = resp.headers['ETag']
+
+    resp = apptc.get(url)
+    assert resp.status_code == 200
+    etag = resp.headers['ETag']
+    last_modified = resp.headers['Last-modified']
+
+    resp = apptc.get(url, headers={'If-None-Match': etag})
+    assert resp.status_code == 304
+    assert resp.headers['ETag'] == etag
+
+    resp = apptc.get(url, headers={'If-Modified-Since': last_modified})
+    assert resp.status_code == 304
+
+    resp = apptc.patch(url, headers={'Content-type': 'application/json'},
+                       data=json.dumps({'bar': 'BAR'}))
+    assert resp.status_code == 200
+
+    resp = apptc.get(url, headers={'If-None-Match': etag})
+    assert resp.status_code == 200
+    assert json.loads(resp.data) == {'foo': 'FOO', 'bar': 'BAR'}
+
+    # Deleting a dataset must change the collection ETag too
+    resp = apptc.delete(url)
+    assert resp.status_code == 200
+
+    resp = apptc.get('/api/1/admin/dataset/',
+                     headers={'If-None-Match': index_etag})
+    assert resp.status_code == 200
+
+
+def test_dataset_sparse_fields(configured_app):
+    apptc = configured_app.test_client()
+
+    resp = apptc.post('/api/1/admin/dataset/',
+                      headers={'Content-type': 'application/json'},
+                      data=json.dumps({
+                          'metadata': {'title': 'Hello',
+                                       'description': 'A long text'},
+                          'other': {'big': 'data'}}))
+    assert resp.status_code == 201
+    path = urlparse.urlparse(resp.headers['Location']).path
+    dataset_id = int(re.match('/api/1/admin/dataset/([0-9]+)', path)
+                     .group(1))
+
+    resp = apptc.get('/api/1/admin/dataset/'
+                     '?fields=id,configuration.metadata.title')
+    assert resp.status_code == 200
+    data = json.loads(resp.data)
+    assert [x for x in data if x['id'] == dataset_id] == [
+        {'id': dataset_id, 'configuration': {'metadata': {'title': 'Hello'}}}]
+
+    # Datasets left by other tests have the same shape
+    assert all(sorted(x) == ['configuration', 'id'] for x in data)
+
+    resp = apptc.get(path + '?fields=metadata.title,missing')
+    assert resp.status_code == 200
+    assert json.loads(resp.data) == {
+        'metadata': {'title': 'Hello'}, 'missing': None}
+    assert resp.headers['ETag']
+
+    resp = apptc.get('/api/1/admin/dataset/?fields=search_vector')
+    assert resp.status_code == 400
+
+    resp = apptc.get('/api/1/admin/dataset/?fields=id.foo')
+    assert resp.status_code == 400
+
+
+def test_dataset_async_hooks(configured_app):
+    apptc = configured_app.test_client()
+
+    with mock.patch.object(configured_app.plugins, 'async_hooks',
+                           frozenset(['dataset_create'])):
+        resp = apptc.post('/api/1/admin/dataset/',
+                          headers={'Content-type': 'application/json'},
+                          data=json.dumps({'foo': 'FOO'}))
+        assert resp.status_code == 201
+        task_id = resp.headers['X-Task-Id']
+
+        # Synchronous hooks don't return a task id
+        path = urlparse.urlparse(resp.headers['Location']).path
+        resp = apptc.put(path, headers={'Content-type': 'application/json'},
+                         data=json.dumps({'foo': 'BAR'}))
+        assert resp.status_code == 200
+        assert 'X-Task-Id' not in resp.headers
+
+    resp = apptc.get('/api/1/admin/task/{0}'.format(task_id))
+    assert resp.status_code == 200
+    assert json.loads(resp.data)['id'] == task_id
+
+
+def test_dataset_debounced_async_hooks(configured_app):
+    from datacat.db import db
+
+    apptc = configured_app.test_client()
+    plugins = configured_app.plugins
+
+    resp = apptc.post('/api/1/admin/dataset/',
+                      headers={'Content-type': 'application/json'},
+                      data=json.dumps({'foo': 'FOO'}))
+    assert resp.status_code == 201
+    path = urlparse.urlparse(resp.headers['Location']).path
+
+    with mock.patch.object(plugins, 'async_hooks',
+                           frozenset(['dataset_update'])), \
+            mock.patch.object(plugins, 'debounce', {'dataset_update': 10}):
+        resp = apptc.put(path, headers={'Content-type': 'application/json'},
+                         data=json.dumps({'foo': 'BAR'}))
+        assert resp.status_code == 200
+        assert resp.headers['X-Task-Id']
+
+    # Tasks are run eagerly in tests, so the latest (only) task
+    # was executed and its token removed.
+    with configured_app.app_context():
+        with db, db.cursor() as cur:
+            cur.execute('SELECT count(*) AS count FROM "hook_debounce"')
+            assert cur.fetchone()['count'] == 0
@@ -0,0 +1,52 @@
+import json
+import re
+import urlparse
+
+
+def _create_dataset(apptc, conf):
+    resp = apptc.post('/api/1/admin/dataset/',
+                      headers={'Content-type': 'application/json'},
+                      data=json.dumps(conf))
+    assert resp.status_code == 201
+    path = urlparse.urlparse(resp.headers['Location']).path
+    match = re.match('/api/1/admin/dataset/([0-9]+)', path)
+    return int(match.group(1))
+
+
+def test_dataset_search(configured_app):
+    apptc = configured_app.test_client()
+
+    roads_id = _create_dataset(apptc, {'metadata': {
+        'title': 'Roads of Trentino',
+        'description': 'Main roads, from OpenStreetMap'}})
+    rivers_id = _create_dataset(apptc, {'metadata': {
+        'title': 'Rivers of Trentino',
+        'description': 'Rivers and lakes, including roads crossing them'}})
+    _create_dataset(apptc, {'metadata': {'title': 'Population'}})
+
+    resp = apptc.get('/api/1/admin/dataset/search?q=roads')
+    assert resp.status_code == 200
+    assert resp.headers['X-Total-Count'] == '2'
+    data = json.loads(resp.data)
+
+    # Matches in title rank higher than matches in description
+    assert [x['id'] for x in data] == [roads_id, rivers_id]
+    assert data[0]['title'] == 'Roads of Trentino'
+    assert data[0]['highlight']['title'] == '<b>Roads</b> of Trentino'
+
+    resp = apptc.get('/api/1/admin/dataset/search?q=roads&limit=1&offset=1')
+    assert resp.status_code == 200
+    assert resp.headers['X-Total-Count'] == '2'
+    assert [x['id'] for x in json.loads(resp.data)] == [rivers_id]
+
+    # Updates are indexed too
+    resp = apptc.put('/api/1/admin/dataset/{0}'.format(rivers_id),
+                     headers={'Content-type': 'application/json'},
+                     data=json.dumps({'metadata': {'title': 'Lakes'}}))
+    assert resp.status_code == 200
+
+    resp = apptc.get('/api/1/admin/dataset/search?q=roads')
+    assert [x['id'] for x in json.loads(resp.data)] == [roads_id]
+
+    resp = apptc.get('/api/1/admin/dataset/search?q=')
+    assert resp.status_code == 400
@@ -0,0 +1,144 @@
+import json
+
+from flask import Flask, request
+from werkzeug.exceptions import BadRequest
+
+from datacat.web.utils import json_view, RawJSON
+
+
+def _make_app():
+    app = Flask(__name__)
+
+    @app.route('/object')
+    @json_view
+    def get_object():
+        return {'hello': 'world'}, 200, {'X-Foo': 'bar'}
+
+    @app.route('/list')
+    @json_view
+    def get_list():
+        return [{'id': 1}, {'id': 2}]
+
+    @app.route('/generator')
+    @json_view
+    def get_generator():
+        def generate():
+            yield {'id': 1}
+            yield RawJSON('{"id": 2}')
+            yield {'id': 3}
+        return generate(), 200, {'X-Total-Count': '3'}
+
+    @app.route('/empty-generator')
+    @json_view
+    def get_empty_generator():
+        return iter([])
+
+    @app.route('/failing-generator')
+    @json_view
+    def get_failing_generator():
+        def generate():
+            if request.args.get('fail_at') == 'start':
+                raise BadRequest('Invalid query')
+            yield {'id': 1}
+            raise ValueError('Something went wrong')
+        return generate()
+
+    return app
+
+
+def test_json_view():
+    apptc = _make_app().test_client()
+
+    resp = apptc.get('/object')
+    assert resp.status_code == 200
+    assert resp.headers['Content-type'] == 'application/json'
+    assert resp.headers['X-Foo'] == 'bar'
+    assert json.loads(resp.data) == {'hello': 'world'}
+
+    resp = apptc.get('/list')
+    assert resp.headers['Content-type'] == 'application/json'
+    assert json.loads(resp.data) == [{'id': 1}, {'id': 2}]
+
+
+def test_json_view_streaming():
+    apptc = _make_app().test_client()
+
+    resp = apptc.get('/generator')
+    assert resp.status_code == 200
+    assert resp.is_streamed
+    assert resp.headers['Content-type'] == 'application/json'
+    assert resp.headers['X-Total-Count'] == '3'
+    assert json.loads(resp.data) == [{'id': 1}, {'id': 2}, {'id': 3}]
+
+    resp = apptc.get('/empty-generator')
+    assert resp.status_code == 200
+    assert json.loads(resp.data) == []
+
+
+def test_json_view_ndjson():
+    apptc = _make_app().test_client()
+
+    resp = apptc.get('/generator?format=ndjson')
+    assert resp.status_code == 200
+    assert resp.headers['Content-type'] == 'application/x-ndjson'
+    assert [json.loads(x) for x in resp.data.splitlines()] == [
+        {'id': 1}, {'id': 2}, {'id': 3}]
+
+    resp = apptc.get('/list', headers={'Accept': 'application/x-ndjson'})
+    assert resp.headers['Content-type'] == 'application/x-ndjson'
+    assert resp.data == '{"id": 1}\n{"id": 2}\n'
+
+    # Objects are always sent as plain JSON
+    resp = apptc.get('/object?format=ndjson')
+    assert resp.headers['Content-type'] == 'application/json'
+    assert json.loads(resp.data) == {'hello': 'world'}
+
+    resp = apptc.get('/list', headers={'Accept': '*/*'})
+    assert resp.headers['Content-type'] == 'application/json'
+
+
+def test_json_view_streaming_errors():
+    apptc = _make_app().test_client()
+
+    # Errors before the first item still result in an error status
+    resp = apptc.get('/failing-generator?fail_at=start')
+    assert resp.status_code == 400
+
+    # Later errors end the stream: the array is left unterminated..
+    resp = apptc.get('/failing-generator')
+    assert resp.status_code == 200
+    assert resp.data == '[{"id": 1}'
+
+    # ..while an error record is sent in NDJSON streams
+    resp = apptc.get('/failing-generator?format=ndjson')
+    assert resp.status_code == 200
+    assert [json.loads(x) for x in resp.data.splitlines()] == [
+        {'id': 1}, {'error': 'Internal server error'}]
+
+
+def test_not_modified_response():
+    from datetime import datetime
+    from datacat.utils.http import not_modified_response
+
+    app = Flask(__name__)
+    mtime = datetime(2014, 10, 7, 12, 30, 15, 123456)
+
+    with app.test_request_context('/'):
+        assert not_modified_response(etag='"3"', last_modified=mtime) is None
+
+    with app.test_request_context('/', headers={'If-None-Match': '"3"'}):
+        resp = not_modified_response(etag='"3"', headers={'ETag': '"3"'})
+        assert resp.status_code == 304
+        assert resp.headers['ETag'] == '"3"'
+        assert not_modified_response(etag='"4"') is None
+        assert not_modified_response(last_modified=mtime) is None
+
+    with app.test_request_context('/', headers={'If-None-Match': 'W/"3"'}):
+        assert not_modified_response(etag='"3"').status_code == 304
+
+    with app.test_request_context('/', headers={
+            'If-Modified-Since': 'Tue, 07 Oct 2014 12:30:15 GMT'}):
+        assert not_modified_response(last_modified=mtime).status_code == 304
+        assert not_modified_response(
+            last_modified=mtime.replace(second=16)) is None
+        assert not_modified_response(etag='"3"') is None
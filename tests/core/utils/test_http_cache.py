@@ -0,0 +1,61 @@
+import io
+import os
+import time
+
+from datacat.utils.http_cache import HttpCache
+
+
+def test_http_cache(tmpdir):
+    cache = HttpCache(str(tmpdir.join('cache')), max_size=10)
+    url = 'http://example.com/foo'
+    assert cache.get(url) is None
+
+    entry = cache.store(url, {'etag': '"abc"', 'content-type': 'text/plain',
+                              'x-other': 'foo'}, io.BytesIO('Hello'))
+    assert cache.get(url) == entry
+    assert entry['etag'] == '"abc"'
+    assert entry['last_modified'] is None
+    assert entry['headers'] == {'etag': '"abc"', 'content-type': 'text/plain'}
+    assert entry['size'] == 5
+    with cache.open(entry) as fp:
+        assert fp.read() == 'Hello'
+
+    # Updating an entry replaces the data file
+    old_entry = entry
+    with cache.open(old_entry) as fp:
+        entry = cache.store(url, {'etag': '"def"'}, io.BytesIO('World'))
+        assert fp.read() == 'Hello'
+    assert entry['data_file'] != old_entry['data_file']
+    with cache.open(cache.get(url)) as fp:
+        assert fp.read() == 'World'
+    assert sorted(os.listdir(cache.directory)) == sorted([
+        entry['data_file'], os.path.basename(cache._meta_path(url))])
+
+
+def test_http_cache_eviction(tmpdir):
+    cache = HttpCache(str(tmpdir), max_size=10)
+    urls = ['http://example.com/{0}'.format(i) for i in xrange(3)]
+    entries = [cache.store(url, {'etag': '"x"'}, io.BytesIO('12345'))
+               for url in urls[:2]]
+
+    # Least recently used goes first
+    past = time.time() - 100
+    os.utime(cache._meta_path(urls[1]), (past, past))
+    cache.open(entries[0]).close()
+
+    cache.store(urls[2], {'etag': '"x"'}, io.BytesIO('12345'))
+    assert cache.get(urls[0]) is not None
+    assert cache.get(urls[1]) is None
+    assert cache.get(urls[2]) is not None
+
+    # Entries larger than the limit are kept until the next store
+    cache.store(urls[1], {'etag': '"x"'}, io.BytesIO('0123456789ABC'))
+    assert [cache.get(url) is not None for url in urls] == [
+        False, True, False]
+
+    # Old orphaned files are removed
+    orphan = tmpdir.join('orphan.data')
+    orphan.write('foo')
+    os.utime(str(orphan), (past - 3600, past - 3600))
+    cache.evict()
+    assert not orphan.check()
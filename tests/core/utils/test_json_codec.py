@@ -0,0 +1,79 @@
+import datetime
+
+from flask import Flask
+import pytest
+
+from datacat.utils import json_codec
+from datacat.utils.json_codec import JSONCodec
+
+
+def _available_backends():
+    for name in json_codec.BACKENDS:
+        try:
+            yield JSONCodec(name)
+        except ValueError:
+            pass
+
+
+@pytest.mark.parametrize('codec', list(_available_backends()))
+def test_json_codec_roundtrip(codec):
+    obj = {
+        'metadata': {'title': u'Strade del Trentino \u00e8',
+                     'tags': ['roads', 'osm']},
+        'resources': [{'url': 'internal:///1'}],
+        'geo': {'enabled': True, 'importer': 'find_shapefiles'},
+        'count': 12, 'ratio': 0.5, 'nothing': None,
+    }
+    assert codec.loads(codec.dumps(obj)) == obj
+
+
+@pytest.mark.parametrize('codec', list(_available_backends()))
+def test_json_codec_datetime(codec):
+    obj = {'mtime': datetime.datetime(2014, 10, 7, 12, 30, 15, 1234),
+           'date': datetime.date(2014, 10, 7)}
+    assert codec.loads(codec.dumps(obj)) == {
+        'mtime': '2014-10-07T12:30:15.001234',
+        'date': '2014-10-07'}
+
+    with pytest.raises(TypeError):
+        codec.dumps({'foo': object()})
+
+
+def test_json_codec_stdlib_fallback():
+    codec = JSONCodec('json')
+    assert codec.encoder_name == 'json'
+    assert codec.decoder_name == 'json'
+
+
+def test_json_codec_invalid_backend():
+    with pytest.raises(ValueError):
+        JSONCodec('does-not-exist')
+
+
+def test_json_codec_configure():
+    try:
+        json_codec.configure('json')
+        assert json_codec.get_codec().encoder_name == 'json'
+        assert json_codec.loads(json_codec.dumps([1, 2])) == [1, 2]
+    finally:
+        json_codec.configure()
+
+
+def test_json_codec_per_app():
+    app1, app2 = Flask('app1'), Flask('app2')
+    app1.config['JSON_BACKEND'] = 'json'
+    app2.config['JSON_BACKEND'] = None
+    json_codec.init_app(app1)
+    json_codec.init_app(app2)
+
+    with app1.app_context():
+        assert json_codec.get_codec().decoder_name == 'json'
+    with app2.app_context():
+        assert json_codec.get_codec() is app2.extensions['datacat.json_codec']
+    assert json_codec.get_codec() is json_codec._codec
+
+
+def test_json_codec_precise_float():
+    for codec in _available_backends():
+        assert codec.loads('[0.1, 1.0000000000000002]') == \
+            [0.1, 1.0000000000000002]
@@ -0,0 +1,126 @@
+import json
+import logging
+
+from celery import shared_task
+from flask import Flask
+
+from datacat.utils.metrics import Histogram, MetricsRegistry, registry
+from datacat.utils.plugin_manager import HookExecutionResult, PluginManager
+
+
+def test_histogram():
+    histogram = Histogram(buckets=[1, .1, 10])
+    for value in (.05, .5, .5, 5, 50):
+        histogram.observe(value)
+
+    assert histogram.to_dict() == {
+        'count': 5,
+        'sum': 56.05,
+        'buckets': [{'le': .1, 'count': 1},
+                    {'le': 1, 'count': 3},
+                    {'le': 10, 'count': 4}],
+    }
+
+
+def test_metrics_registry(caplog):
+    metrics = MetricsRegistry(slow_threshold=1)
+
+    with caplog.at_level(logging.DEBUG, logger='datacat.utils.metrics'):
+        metrics.record_hook_call(object(), 'dataset_create', .1)
+        metrics.record_hook_call(object(), 'dataset_create', 2,
+                                 ValueError('Failed'))
+
+    labels = {'plugin': 'object', 'hook': 'dataset_create'}
+    assert metrics.get_counter('hook_calls', **labels) == 2
+    assert metrics.get_counter('hook_exceptions', **labels) == 1
+    assert metrics.get_histogram('hook_duration_seconds', **labels).sum == 2.1
+
+    assert [x.levelno for x in caplog.records] == [
+        logging.DEBUG, logging.WARNING]
+    assert caplog.records[1].plugin == 'object'
+    assert caplog.records[1].duration == 2
+    assert caplog.records[1].slow is True
+    assert caplog.records[1].error == "ValueError('Failed',)"
+
+    snapshot = metrics.snapshot()
+    assert snapshot['counters'] == [
+        {'name': 'hook_calls', 'labels': labels, 'value': 2},
+        {'name': 'hook_exceptions', 'labels': labels, 'value': 1},
+    ]
+    assert [x['name'] for x in snapshot['histograms']] == [
+        'hook_duration_seconds']
+    json.dumps(snapshot)
+
+    metrics.reset()
+    assert metrics.snapshot() == {'counters': [], 'histograms': []}
+
+
+class _Plugin(object):
+    _import_name = 'tests:metrics_plugin'
+
+    def __init__(self):
+        self._hooks = {'dataset_create': [self.on_create]}
+
+    def on_create(self, dataset_id):
+        if dataset_id is None:
+            raise ValueError('Missing id')
+
+    def call_hook_async(self, hook_type, *args, **kwargs):
+        for handler in self._hooks.get(hook_type, ()):
+            try:
+                yield HookExecutionResult(self, handler(*args), None)
+            except Exception as e:
+                yield HookExecutionResult(self, None, e)
+
+
+def test_plugin_manager_metrics():
+    registry.reset()
+    labels = {'plugin': 'tests:metrics_plugin', 'hook': 'dataset_create'}
+
+    plugins = PluginManager([_Plugin()])
+    plugins.call_hook('dataset_create', 1)
+    plugins.call_hook('dataset_create', None)
+
+    parallel_plugins = PluginManager([_Plugin()], parallel=True)
+    with Flask(__name__).app_context():
+        parallel_plugins.call_hook('dataset_create', 1)
+
+    assert registry.get_counter('hook_calls', **labels) == 3
+    assert registry.get_counter('hook_exceptions', **labels) == 1
+    assert registry.get_histogram(
+        'hook_duration_seconds', **labels).count == 3
+
+
+@shared_task(name='tests.metrics_task')
+def _metrics_task(fail=False):
+    if fail:
+        raise ValueError('Failed')
+    return 'done'
+
+
+def test_task_metrics():
+    registry.reset()
+
+    assert _metrics_task.apply().get() == 'done'
+    _metrics_task.apply(kwargs={'fail': True})
+
+    assert registry.get_counter('task_calls', task='tests.metrics_task') == 2
+    assert registry.get_counter(
+        'task_exceptions', task='tests.metrics_task') == 1
+    assert registry.get_histogram(
+        'task_duration_seconds', task='tests.metrics_task').count == 2
+
+
+def test_metrics_endpoint():
+    from datacat.web.core import make_flask_app
+
+    registry.reset()
+    registry.record_task_call('tests.metrics_task', .5)
+
+    apptc = make_flask_app().test_client()
+    resp = apptc.get('/api/1/admin/metrics')
+    assert resp.status_code == 200
+    data = json.loads(resp.data)
+    assert data['counters'] == [{'name': 'task_calls',
+                                 'labels': {'task': 'tests.metrics_task'},
+                                 'value': 1}]
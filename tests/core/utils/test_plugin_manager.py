@@ -0,0 +1,440 @@
+import threading
+
+from celery import shared_task
+from flask import Flask
+import mock
+
+from datacat.db.changes import ChangeToken
+from datacat.utils.plugin_manager import (
+    HookCoalescer, HookExecutionResult, HookTimeout, PluginManager,
+    call_debounced_hook_task, call_hook_task, call_plugin_hook_task,
+    drain_outbox, drain_outbox_task, get_plugin_hook_task)
+
+
+def test_hook_coalescer():
+    hooks = HookCoalescer()
+    hooks.add('dataset', 1, 'create', {'v': 1})
+    hooks.add('dataset', 2, 'update', {'v': 1})
+    hooks.add('dataset', 1, 'update', {'v': 2})
+    hooks.add('dataset', 2, 'update', {'v': 2})
+    hooks.add('dataset', 3, 'update', {'v': 1})
+    hooks.add('dataset', 3, 'delete')
+    hooks.add('dataset', 4, 'create', {'v': 1})
+    hooks.add('dataset', 4, 'delete')
+    assert len(hooks) == 3
+
+    plugins = mock.Mock(**{'dispatch_hook.return_value': []})
+    hooks.call_hooks(plugins)
+    assert plugins.dispatch_hook.call_args_list == [
+        mock.call('dataset_create', 1, {'v': 2}),
+        mock.call('dataset_update', 2, {'v': 2}),
+        mock.call('dataset_delete', 3),
+    ]
+    assert len(hooks) == 0
+
+
+def test_hook_coalescer_update():
+    hooks, other = HookCoalescer(), HookCoalescer()
+    hooks.add('dataset', 1, 'create', {'v': 1})
+    other.add('dataset', 1, 'update', {'v': 2})
+    other.add('dataset', 2, 'update', {'v': 1})
+    hooks.update(other)
+
+    plugins = mock.Mock(**{'dispatch_hook.side_effect': [['t1'], ['t1']]})
+    assert hooks.call_hooks(plugins) == ['t1']
+    assert plugins.dispatch_hook.call_args_list == [
+        mock.call('dataset_create', 1, {'v': 2}),
+        mock.call('dataset_update', 2, {'v': 1}),
+    ]
+
+
+class _DummyPlugin(object):
+    _import_name = 'tests:dummy_plugin'
+
+    def __init__(self):
+        self.calls = []
+        self._hooks = dict(
+            (name, [lambda *a: None])
+            for name in ('dataset_create', 'dataset_update', 'dataset_delete'))
+
+    def call_hook_async(self, hook_type, *args, **kwargs):
+        self.calls.append((hook_type, args, kwargs))
+        yield HookExecutionResult(self, 'done', None)
+
+
+class _TasksPlugin(_DummyPlugin):
+    _import_name = 'tests:tasks_plugin'
+
+    def task(self, **kwargs):
+        return shared_task(**kwargs)
+
+
+def test_plugin_manager_dispatch_hook():
+    plugin, tasks_plugin = _DummyPlugin(), _TasksPlugin()
+    plugins = PluginManager([plugin, tasks_plugin],
+                            async_hooks=['dataset_update'])
+
+    assert plugins.dispatch_hook('dataset_create', 1, {'a': 1}) == []
+    assert plugin.calls == [('dataset_create', (1, {'a': 1}), {})]
+
+    # One task per plugin, using the plugin's own task if possible
+    plugin_task = get_plugin_hook_task(tasks_plugin)
+    assert plugin_task.name == 'tests:tasks_plugin.call_hook'
+    assert get_plugin_hook_task(plugin) is None
+
+    with mock.patch.object(call_plugin_hook_task, 'apply_async') as shared, \
+            mock.patch.object(plugin_task, 'apply_async') as own:
+        shared.return_value.id = 'task-1'
+        own.return_value.id = 'task-2'
+        task_ids = plugins.dispatch_hook('dataset_update', 1, {'a': 2})
+
+    assert task_ids == ['task-1', 'task-2']
+    shared.assert_called_once_with(
+        args=('tests:dummy_plugin', 'dataset_update', 1, {'a': 2}),
+        kwargs={}, serializer='json')
+    own.assert_called_once_with(
+        args=('dataset_update', 1, {'a': 2}), kwargs={}, serializer='json')
+    assert len(plugin.calls) == 1
+
+
+def test_plugin_hook_tasks():
+    plugin, tasks_plugin = _DummyPlugin(), _TasksPlugin()
+    app = Flask(__name__)
+    app.plugins = PluginManager([plugin, tasks_plugin])
+
+    with app.app_context():
+        result = get_plugin_hook_task(tasks_plugin).apply(
+            args=('dataset_delete', 1))
+        assert result.get() == [
+            {'plugin': 'tests:tasks_plugin', 'exception': None}]
+
+        result = call_plugin_hook_task.apply(
+            args=('tests:dummy_plugin', 'dataset_delete', 2))
+        assert result.get() == [
+            {'plugin': 'tests:dummy_plugin', 'exception': None}]
+
+        # Plugins disabled in the meantime are skipped
+        result = call_plugin_hook_task.apply(
+            args=('tests:other_plugin', 'dataset_delete', 2))
+        assert result.get() == []
+
+    assert plugin.calls == [('dataset_delete', (2,), {})]
+    assert tasks_plugin.calls == [('dataset_delete', (1,), {})]
+
+
+def test_call_hook_task():
+    plugin = _DummyPlugin()
+    app = Flask(__name__)
+    app.plugins = PluginManager([plugin])
+
+    with app.app_context():
+        result = call_hook_task.apply(args=('dataset_delete', 1))
+
+    assert result.get() == [
+        {'plugin': 'tests:dummy_plugin', 'exception': None}]
+    assert plugin.calls == [('dataset_delete', (1,), {})]
+
+
+class _HandlersPlugin(object):
+    def __init__(self, handlers, parallel_hooks=True):
+        self._hooks = {'dataset_create': handlers}
+        self.parallel_hooks = parallel_hooks
+
+    def call_hook_async(self, hook_type, *args, **kwargs):
+        for handler in self._hooks.get(hook_type, ()):
+            yield HookExecutionResult(self, handler(*args, **kwargs), None)
+
+
+def test_plugin_manager_parallel_hooks():
+    calls = []
+    started = dict((name, threading.Event()) for name in 'ab')
+
+    def make_handler(name, other):
+        # Only completes if the other handler runs concurrently
+        def handler(dataset_id):
+            started[name].set()
+            assert started[other].wait(5)
+            calls.append(name)
+            return name, dataset_id
+        return handler
+
+    def failing_handler(dataset_id):
+        raise ValueError('Failed')
+
+    def serial_handler(dataset_id):
+        calls.append('c')
+        return 'c', dataset_id
+
+    plugin1 = _HandlersPlugin([make_handler('a', 'b'), failing_handler])
+    plugin2 = _HandlersPlugin([make_handler('b', 'a')])
+    serial_plugin = _HandlersPlugin([serial_handler], parallel_hooks=False)
+    plugins = PluginManager([plugin1, serial_plugin, plugin2],
+                            parallel=True, max_workers=4)
+
+    app = Flask(__name__)
+    with app.app_context():
+        results = plugins.call_hook('dataset_create', 1)
+    plugins.close()
+
+    assert sorted(calls) == ['a', 'b', 'c']
+
+    # Results are in order
+    assert [x.plugin for x in results] == [
+        plugin1, plugin1, serial_plugin, plugin2]
+    assert [x.result for x in results] == [
+        ('a', 1), None, ('c', 1), ('b', 1)]
+    assert isinstance(results[1].exception, ValueError)
+    assert all(x.exception is None for x in results if x is not results[1])
+
+
+def test_plugin_manager_parallel_hooks_timeout():
+    release = threading.Event()
+
+    def slow_handler(dataset_id):
+        release.wait(5)
+
+    def fast_handler(dataset_id, configuration):
+        return 'done'
+
+    plugin = _HandlersPlugin([slow_handler])
+    plugin._hooks['dataset_update'] = [fast_handler]
+    plugins = PluginManager([plugin], parallel=True, max_workers=1,
+                            hook_timeout=.5)
+
+    app = Flask(__name__)
+    try:
+        with app.app_context():
+            results = plugins.call_hook('dataset_create', 1)
+            assert isinstance(results[0].exception, HookTimeout)
+
+            # The only worker is stuck, and was replaced
+            results = plugins.call_hook('dataset_update', 1, {})
+            assert results[0].result == 'done'
+            assert plugins._workers.stuck == 1
+    finally:
+        release.set()
+        plugins.close()
+
+
+def test_plugin_manager_hook_index():
+    def handler(dataset_id):
+        return dataset_id
+
+    plugin1 = _HandlersPlugin([handler])
+    plugin2 = _HandlersPlugin([])
+    plugin2._hooks['dataset_delete'] = [handler]
+    plugins = PluginManager([plugin1, plugin2])
+
+    assert plugins.get_hook_plugins('dataset_create') == (plugin1,)
+    assert plugins.get_hook_plugins('dataset_delete') == (plugin2,)
+    assert plugins.get_hook_plugins('dataset_update') == ()
+    assert [x.result for x in plugins.call_hook('dataset_create', 1)] == [1]
+
+    plugin3 = _HandlersPlugin([handler, handler])
+    plugins.enable_plugin(plugin3)
+    assert plugins.get_hook_plugins('dataset_create') == (plugin1, plugin3)
+    assert len(plugins.call_hook('dataset_create', 1)) == 3
+
+    plugins.disable_plugin(plugin1)
+    assert plugins.get_hook_plugins('dataset_create') == (plugin3,)
+    assert list(plugins) == [plugin2, plugin3]
+
+    # New handlers for indexed hook types are picked up
+    plugin3._hooks['dataset_create'].append(handler)
+    assert len(plugins.call_hook('dataset_create', 1)) == 3
+
+
+def _make_debounce_plugin(on_update):
+    plugin = _HandlersPlugin([])
+    plugin._hooks['dataset_update'] = [on_update]
+    plugin._hooks['dataset_delete'] = [lambda dataset_id: None]
+    return plugin
+
+
+def test_plugin_manager_debounce():
+    calls = []
+    done = threading.Event()
+
+    def on_update(dataset_id, configuration):
+        calls.append((dataset_id, configuration))
+        if len(calls) == 2:
+            done.set()
+
+    plugins = PluginManager([_make_debounce_plugin(on_update)],
+                            debounce={'dataset_update': .05})
+
+    app = Flask(__name__)
+    with app.app_context():
+        for i in xrange(5):
+            assert plugins.dispatch_hook(
+                'dataset_update', 1, {'v': i}) == []
+        plugins.dispatch_hook('dataset_update', 2, {'v': 0})
+        plugins.dispatch_hook('dataset_update', 3, {'v': 0})
+
+        # Deleting an object discards its pending updates
+        plugins.dispatch_hook('dataset_delete', 3)
+
+    assert done.wait(5)
+    assert sorted(calls) == [(1, {'v': 4}), (2, {'v': 0})]
+    assert len(plugins.debouncer) == 0
+
+
+def test_plugin_manager_debounce_max_wait():
+    calls = []
+    now = [1000.0]
+
+    plugins = PluginManager(
+        [_make_debounce_plugin(lambda *args: calls.append(args))],
+        debounce={'dataset_update': 10}, debounce_max_wait=25)
+    plugins.debouncer._clock = lambda: now[0]
+    deadline = plugins.debouncer.get_deadline
+
+    app = Flask(__name__)
+    with app.app_context(), \
+            mock.patch('datacat.utils.plugin_manager.atexit') as atexit:
+        plugins.dispatch_hook('dataset_update', 1, {'v': 0})
+        plugins.dispatch_hook('dataset_update', 2, {'v': 0})
+        plugins.dispatch_hook('dataset_update', 3, {'v': 0})
+        assert deadline('dataset_update', 1) == 1010
+
+        # Pending calls are run when the process exits
+        atexit.register.assert_called_once_with(plugins.debouncer.flush)
+
+        # Each call postpones the deadline, up to max_wait
+        for i in xrange(1, 4):
+            now[0] += 8
+            plugins.dispatch_hook('dataset_update', 1, {'v': i})
+        assert deadline('dataset_update', 1) == 1025
+        assert len(plugins.debouncer) == 3
+
+        # Deleting an object discards its pending updates
+        plugins.dispatch_hook('dataset_delete', 3)
+        assert deadline('dataset_update', 3) is None
+        assert len(plugins.debouncer) == 2
+
+        plugins.debouncer.flush()
+
+    assert sorted(calls) == [(1, {'v': 3}), (2, {'v': 0})]
+    assert len(plugins.debouncer) == 0
+
+
+def test_call_debounced_hook_task():
+    plugin, tasks_plugin = _DummyPlugin(), _TasksPlugin()
+    app = Flask(__name__)
+    app.plugins = PluginManager([plugin, tasks_plugin])
+
+    def _run(token_found):
+        with app.app_context(), \
+                mock.patch('datacat.utils.plugin_manager.db') as db, \
+                mock.patch('datacat.utils.plugin_manager'
+                           '._enqueue_plugin_hook') as enqueue:
+            cur = db.cursor.return_value.__enter__.return_value
+            cur.fetchone.return_value = ('token',) if token_found else None
+            enqueue.side_effect = ['task-1', 'task-2']
+            result = call_debounced_hook_task.apply(
+                args=('dataset_update', 1, {'v': 1}), task_id='token').get()
+        return result, enqueue.call_args_list
+
+    # One task per plugin, as for the other async hooks
+    assert _run(True) == (['task-1', 'task-2'], [
+        mock.call(plugin, 'dataset_update', (1, {'v': 1}), {}),
+        mock.call(tasks_plugin, 'dataset_update', (1, {'v': 1}), {})])
+
+    # Superseded by a later call
+    assert _run(False) == (None, [])
+
+
+def _make_failing_plugin():
+    failing = _DummyPlugin()
+    failing._import_name = 'tests:failing_plugin'
+    failing.call_hook_async = lambda *a, **kw: iter([
+        HookExecutionResult(failing, None, ValueError('Failed'))])
+    return failing
+
+
+_OUTBOX_EVENTS = [('dataset', 1, 'create', {'v': 1}),
+                  ('dataset', 1, 'update', {'v': 2}),
+                  ('dataset', 2, 'delete', None)]
+
+
+def test_drain_outbox():
+    plugin, failing = _DummyPlugin(), _make_failing_plugin()
+    plugins = PluginManager([plugin, failing])
+    conn = mock.MagicMock()
+
+    with mock.patch('datacat.utils.plugin_manager.outbox') as outbox, \
+            mock.patch('datacat.utils.plugin_manager'
+                       '.clear_resource_records') as clear_resource_records:
+        outbox.try_lock_consumer.return_value = True
+        outbox.get_cursor.return_value = ChangeToken(10, 0), 0
+        outbox.get_events.return_value = (
+            _OUTBOX_EVENTS, ChangeToken(12, 0), True)
+        assert drain_outbox(plugins, conn, max_attempts=3) == 3
+
+    # Resource records are loaded again for each hook call
+    assert clear_resource_records.call_count == 3
+
+    assert plugin.calls == [('dataset_create', (1, {'v': 2}), {}),
+                            ('dataset_delete', (2,), {})]
+
+    # Position is only advanced for the plugin that succeeded
+    assert outbox.set_cursor.call_args_list == [
+        mock.call(mock.ANY, 'tests:dummy_plugin', ChangeToken(12, 0))]
+    assert outbox.record_failure.call_args_list == [
+        mock.call(mock.ANY, 'tests:failing_plugin',
+                  "ValueError('Failed',)")]
+    assert not outbox.add_dead_letter.called
+
+    # Locks are released
+    assert outbox.unlock_consumer.call_args_list == [
+        mock.call(mock.ANY, 'tests:dummy_plugin'),
+        mock.call(mock.ANY, 'tests:failing_plugin')]
+
+
+def test_drain_outbox_dead_letter():
+    failing = _make_failing_plugin()
+    plugins = PluginManager([failing])
+    conn = mock.MagicMock()
+
+    with mock.patch('datacat.utils.plugin_manager.outbox') as outbox:
+        outbox.try_lock_consumer.return_value = True
+        outbox.get_cursor.return_value = ChangeToken(10, 0), 2
+        outbox.get_events.return_value = (
+            _OUTBOX_EVENTS, ChangeToken(12, 0), True)
+
+        # Last attempt: all the events are delivered, failed calls
+        # are moved to the dead letter table.
+        assert drain_outbox(plugins, conn, max_attempts=3) == 2
+
+    assert outbox.add_dead_letter.call_args_list == [
+        mock.call(mock.ANY, 'tests:failing_plugin', 'dataset_create',
+                  (1, {'v': 2}), "ValueError('Failed',)"),
+        mock.call(mock.ANY, 'tests:failing_plugin', 'dataset_delete',
+                  (2,), "ValueError('Failed',)")]
+    assert outbox.set_cursor.call_args_list == [
+        mock.call(mock.ANY, 'tests:failing_plugin', ChangeToken(12, 0))]
+
+    # Plugins locked by another dispatcher are skipped
+    with mock.patch('datacat.utils.plugin_manager.outbox') as outbox:
+        outbox.try_lock_consumer.return_value = False
+        assert drain_outbox(plugins, conn) == 0
+    assert not outbox.get_events.called
+    assert not outbox.unlock_consumer.called
+
+
+def test_outbox_dispatch():
+    plugins = PluginManager([_DummyPlugin()], outbox=True)
+    app = Flask(__name__)
+
+    @app.route('/')
+    def index():
+        task_ids = set()
+        for i in xrange(3):
+            task_ids.update(plugins.dispatch_hook('dataset_update', i, {}))
+        assert not apply_async.called
+        return ','.join(task_ids)
+
+    # A single task is enqueued for each request, after the view
+    with mock.patch.object(drain_outbox_task, 'apply_async') as apply_async:
+        resp = app.test_client().get('/')
+    apply_async.assert_called_once_with(task_id=resp.data, serializer='json')
@@ -1,11 +1,21 @@
 import datetime
+import hashlib
+import io
 import os
 import re
+import threading
+import time
 import urlparse
 
+from flask import Flask
+import mock
 import pytest
+from requests.structures import CaseInsensitiveDict
 
-from datacat.utils.resource_access import open_resource, ResourceAccessFailure
+from datacat.utils.resource_access import (
+    HttpResourceAccessor, InternalResourceAccessor, ResourceAccessFailure,
+    ResourceNotFound, clear_resource_records, forget_resource_record,
+    get_http_session, get_resource_accessors, open_resource)
 
 
 def test_open_internal_resource(configured_app_ctx):
@@ -61,3 +71,290 @@ def test_save_resource_to_file(configured_app_ctx, tmpdir):
 def test_open_unsupported_url(configured_app_ctx):
     with pytest.raises(ResourceAccessFailure):
         open_resource('invalid://foobar')
+
+
+def _mock_response(status_code=200, headers=None, body=''):
+    resp = mock.Mock(status_code=status_code, headers=headers or {})
+    resp.raw = io.BytesIO(body)
+    return resp
+
+
+def test_http_resource_single_request():
+    with mock.patch('datacat.utils.resource_access.get_http_session') \
+            as get_http_session:
+        session = get_http_session.return_value
+
+        # Metadata only: HEAD
+        session.request.return_value = _mock_response(
+            headers={'content-type': 'text/plain; charset=utf-8'})
+        resource = HttpResourceAccessor('http://example.com/foo')
+        assert resource.content_type == 'text/plain'
+        assert resource.etag is None
+        assert [x[0][0] for x in session.request.call_args_list] == ['HEAD']
+
+        # Data first: metadata from the same response
+        session.reset_mock()
+        session.request.return_value = _mock_response(
+            headers={'content-type': 'text/plain', 'etag': '"abc"'},
+            body='Hello')
+        resource = HttpResourceAccessor('http://example.com/foo')
+        assert resource.open_resource().read() == 'Hello'
+        assert resource.etag == '"abc"'
+        assert [x[0][0] for x in session.request.call_args_list] == ['GET']
+
+        # HEAD not supported: the GET response is used for data too
+        session.reset_mock()
+        head_resp = _mock_response(405)
+        session.request.side_effect = [
+            head_resp,
+            _mock_response(headers={'content-type': 'text/plain'},
+                           body='Hello')]
+        resource = HttpResourceAccessor('http://example.com/foo')
+        assert resource.content_type == 'text/plain'
+        assert resource.open_resource().read() == 'Hello'
+        assert [x[0][0] for x in session.request.call_args_list] == [
+            'HEAD', 'GET']
+        assert head_resp.close.called
+
+        # Unused GET responses are closed
+        get_resp = _mock_response(headers={'content-type': 'text/plain'})
+        session.request.side_effect = [_mock_response(501), get_resp]
+        resource = HttpResourceAccessor('http://example.com/foo')
+        assert resource.content_type == 'text/plain'
+        resource.close()
+        assert get_resp.close.called
+
+        # Error responses are closed before raising
+        session.request.side_effect = None
+        session.request.return_value = _mock_response(404)
+        with pytest.raises(ResourceNotFound):
+            HttpResourceAccessor('http://example.com/foo').open_resource()
+        assert session.request.return_value.close.called
+
+        session.request.return_value = _mock_response(500)
+        with pytest.raises(ResourceAccessFailure):
+            HttpResourceAccessor('http://example.com/foo').open_resource()
+        assert session.request.return_value.close.called
+
+
+def test_get_http_session():
+    assert get_http_session() is get_http_session()
+
+
+def test_http_resource_cache(tmpdir):
+    app = Flask(__name__)
+    app.config['HTTP_CACHE_DIR'] = str(tmpdir)
+    app.config['HTTP_CACHE_MAX_SIZE'] = 1024
+
+    with app.app_context(), \
+            mock.patch('datacat.utils.resource_access.get_http_session') \
+            as get_http_session:
+        session = get_http_session.return_value
+        session.request.return_value = _mock_response(
+            headers=CaseInsensitiveDict({
+                'content-type': 'text/plain', 'etag': '"abc"'}),
+            body='Hello')
+        resource = HttpResourceAccessor('http://example.com/foo')
+        assert resource.open_resource().read() == 'Hello'
+
+        # Revalidated, and served from the cache
+        session.request.return_value = _mock_response(304)
+        resource = HttpResourceAccessor('http://example.com/foo')
+        assert resource.open_resource().read() == 'Hello'
+        assert resource.content_type == 'text/plain'
+        assert session.request.call_args[1]['headers'] == {
+            'If-None-Match': '"abc"'}
+
+        # Responses without validators are not cached
+        session.request.return_value = _mock_response(
+            headers=CaseInsensitiveDict({'content-type': 'text/plain'}),
+            body='World')
+        resource = HttpResourceAccessor('http://example.com/bar')
+        assert resource.open_resource().read() == 'World'
+        assert len(tmpdir.listdir()) == 2
+
+
+def test_http_resource_segmented_download(tmpdir):
+    data = ''.join(chr(x % 256) for x in xrange(1000))
+    requests_made = []
+
+    def request(method, url, headers=None, **kwargs):
+        requests_made.append((method, (headers or {}).get('Range')))
+        if method == 'HEAD':
+            return _mock_response(headers=CaseInsensitiveDict({
+                'content-length': str(len(data)), 'accept-ranges': 'bytes',
+                'etag': '"abc"'}))
+        match = re.match(r'bytes=(\d+)-(\d+)', (headers or {}).get('Range'))
+        start, end = int(match.group(1)), int(match.group(2))
+        return _mock_response(206, body=data[start:end + 1])
+
+    app = Flask(__name__)
+    app.config['HTTP_SEGMENTED_MIN_SIZE'] = 100
+    filename = str(tmpdir.join('data'))
+    checksum = 'sha1:' + hashlib.sha1(data).hexdigest()
+
+    with app.app_context(), \
+            mock.patch('datacat.utils.resource_access.get_http_session') \
+            as get_http_session:
+        get_http_session.return_value.request.side_effect = request
+        resource = HttpResourceAccessor('http://example.com/foo')
+        with open(filename, 'wb') as fp:
+            resource.save_to_file(fp, segments=4, checksum=checksum)
+
+        assert sorted(requests_made) == [
+            ('GET', 'bytes=0-249'), ('GET', 'bytes=250-499'),
+            ('GET', 'bytes=500-749'), ('GET', 'bytes=750-999'),
+            ('HEAD', None)]
+        with open(filename, 'rb') as fp:
+            assert fp.read() == data
+
+        resource = HttpResourceAccessor('http://example.com/foo')
+        with pytest.raises(ResourceAccessFailure):
+            with open(filename, 'wb') as fp:
+                resource.save_to_file(fp, segments=4, checksum='sha1:abc')
+
+        # Ranges not actually supported: single stream
+        get_http_session.return_value.request.side_effect = [
+            _mock_response(headers=CaseInsensitiveDict({
+                'content-length': str(len(data)),
+                'accept-ranges': 'bytes'}))] + [
+            _mock_response(200, body=data) for _ in xrange(5)]
+        resource = HttpResourceAccessor('http://example.com/foo')
+        with open(filename, 'wb') as fp:
+            resource.save_to_file(fp, segments=4, checksum=checksum)
+        with open(filename, 'rb') as fp:
+            assert fp.read() == data
+
+
+def test_http_resource_segmented_download_failure(tmpdir):
+    failed = threading.Event()
+    finished = []
+
+    def request(method, url, headers=None, **kwargs):
+        if method == 'HEAD':
+            return _mock_response(headers=CaseInsensitiveDict({
+                'content-length': '1000', 'accept-ranges': 'bytes'}))
+        if headers['Range'].startswith('bytes=0-'):
+            failed.set()
+            return _mock_response(500)
+        failed.wait(5)
+        time.sleep(.05)
+        finished.append(headers['Range'])
+        return _mock_response(206, body='x' * 250)
+
+    app = Flask(__name__)
+    app.config['HTTP_SEGMENTED_MIN_SIZE'] = 100
+
+    with app.app_context(), \
+            mock.patch('datacat.utils.resource_access.get_http_session') \
+            as get_http_session:
+        get_http_session.return_value.request.side_effect = request
+        resource = HttpResourceAccessor('http://example.com/foo')
+        with open(str(tmpdir.join('data')), 'wb') as fp:
+            with pytest.raises(ResourceAccessFailure):
+                resource.save_to_file(fp, segments=4)
+
+    # All the other ranges completed before raising
+    assert len(finished) == 3
+
+
+def test_http_resource_save_to_file():
+    with mock.patch('datacat.utils.resource_access.get_http_session') \
+            as get_http_session:
+        get_http_session.return_value.request.return_value = _mock_response(
+            headers=CaseInsensitiveDict({'content-length': '5'}),
+            body='Hello')
+
+        # Size is checked on the data written, wherever dest starts
+        dest = io.BytesIO()
+        dest.write('Data: ')
+        HttpResourceAccessor('http://example.com/foo').save_to_file(dest)
+        assert dest.getvalue() == 'Data: Hello'
+
+        get_http_session.return_value.request.return_value = _mock_response(
+            headers=CaseInsensitiveDict({'content-length': '10'}),
+            body='Hello')
+        with pytest.raises(ResourceAccessFailure):
+            HttpResourceAccessor('http://example.com/foo').save_to_file(
+                io.BytesIO())
+
+
+def test_internal_resource_records_cache():
+    rows = dict((x, {'id': x, 'mimetype': 'text/plain', 'mtime': None,
+                     'data_oid': 100 + x}) for x in (1, 2, 3))
+
+    def execute(query, args):
+        if 'ANY' in query:
+            cur.result = [rows[x] for x in args['ids'] if x in rows]
+        else:
+            cur.result = [rows[args['id']]] if args['id'] in rows else []
+
+    app = Flask(__name__)
+    with app.app_context(), \
+            mock.patch('datacat.utils.resource_access.db') as db:
+        cur = db.cursor.return_value.__enter__.return_value
+        cur.execute.side_effect = execute
+        cur.__iter__.side_effect = lambda: iter(cur.result)
+        cur.fetchone.side_effect = lambda: (cur.result or [None])[0]
+
+        resource = InternalResourceAccessor('internal:///1')
+        assert resource.content_type == 'text/plain'
+        assert resource.last_modified is None
+        resource.open_resource()
+        assert cur.execute.call_count == 1
+
+        # Identity map: same resource, no queries
+        resource = InternalResourceAccessor('internal:///1')
+        assert resource.content_type == 'text/plain'
+        assert cur.execute.call_count == 1
+
+        # Batch loading
+        accessors = [InternalResourceAccessor('internal:///{0}'.format(x))
+                     for x in (1, 2, 3, 4)]
+        InternalResourceAccessor.preload(accessors)
+        assert cur.execute.call_count == 2
+        assert sorted(cur.execute.call_args[0][1]['ids']) == [2, 3, 4]
+        assert [x._resource_record['data_oid'] for x in accessors[:3]] == [
+            101, 102, 103]
+        assert cur.execute.call_count == 2
+        with pytest.raises(ResourceNotFound):
+            accessors[3].content_type
+
+        # Changed resources are loaded again
+        rows[2]['mimetype'] = 'text/csv'
+        forget_resource_record(2)
+        assert InternalResourceAccessor(
+            'internal:///2').content_type == 'text/csv'
+        InternalResourceAccessor('internal:///3').content_type
+        assert cur.execute.call_count == 4
+
+        clear_resource_records()
+        InternalResourceAccessor('internal:///1').content_type
+        assert cur.execute.call_count == 5
+
+
+def test_get_resource_accessors_cache():
+    app = Flask(__name__)
+    app.config['RESOURCE_ACCESSORS'] = {
+        'http': 'datacat.utils.resource_access:HttpResourceAccessor'}
+
+    with app.app_context(), \
+            mock.patch('datacat.utils.resource_access.import_object',
+                       return_value=HttpResourceAccessor) as import_object:
+        accessors = get_resource_accessors()
+        assert accessors == {'http': HttpResourceAccessor}
+        assert get_resource_accessors() is accessors
+        assert isinstance(open_resource('HTTP://example.com'),
+                          HttpResourceAccessor)
+        assert import_object.call_count == 1
+
+        # Changing the configuration invalidates the cache
+        app.config['RESOURCE_ACCESSORS']['internal'] = \
+            InternalResourceAccessor
+        assert get_resource_accessors() == {
+            'http': HttpResourceAccessor,
+            'internal': InternalResourceAccessor}
+        assert import_object.call_count == 2
+
+        with pytest.raises(ResourceAccessFailure):
+            open_resource('/no/scheme')
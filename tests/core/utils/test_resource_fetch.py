@@ -0,0 +1,190 @@
+import threading
+
+from flask import Flask
+import mock
+
+from datacat.utils.resource_access import ResourceNotFound
+from datacat.utils.resource_fetch import (
+    TokenBucket, fetch_dataset_resources, fetch_resources)
+
+
+class _Downloads(object):
+    """
+    Fake downloads, recording the ones running per host; each one
+    waits for a condition (a function of this object) to be true.
+    """
+
+    def __init__(self, conditions=None):
+        self.conditions = conditions or {}
+        self.started = set()
+        self.running = {}
+        self.max_running = {}
+        self.finished = {}
+        self.waited = {}
+        self._cond = threading.Condition()
+
+    def open_resource(self, url):
+        if url.endswith('missing'):
+            raise ResourceNotFound(url)
+        return _FakeAccessor(url, self)
+
+    def run(self, url):
+        host = url.split('/')[2]
+        with self._cond:
+            self.started.add(url)
+            self.running[host] = self.running.get(host, 0) + 1
+            self.max_running[host] = max(
+                self.running[host], self.max_running.get(host, 0))
+            self._cond.notify_all()
+            self.waited[url] = self._wait(url)
+            self.running[host] -= 1
+            self.finished[host] = self.finished.get(host, 0) + 1
+            self._cond.notify_all()
+
+    def _wait(self, url, timeout=5):
+        condition = self.conditions.get(url)
+        for _ in xrange(int(timeout * 100)):
+            if condition is None or condition(self):
+                return True
+            self._cond.wait(.01)
+        return False
+
+
+class _FakeAccessor(object):
+    def __init__(self, url, downloads):
+        self.url = url
+        self.downloads = downloads
+        self.content_type = 'text/plain'
+
+    def save_to_file(self, dest):
+        self.downloads.run(self.url)
+        dest.write('x' * 100)
+
+    def close(self):
+        pass
+
+
+class _FakeTime(object):
+    """Clock only advanced by sleeping"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = 0
+        self._lock = threading.Lock()
+
+    def time(self):
+        with self._lock:
+            return self.now
+
+    def sleep(self, seconds):
+        with self._lock:
+            self.now += seconds
+            self.slept += 1
+
+
+def _make_app():
+    app = Flask(__name__)
+    app.config.update(RESOURCE_FETCH_MAX_WORKERS=8,
+                      RESOURCE_FETCH_MAX_PER_HOST=2,
+                      RESOURCE_FETCH_MAX_BANDWIDTH=None)
+    return app
+
+
+def _fetch(downloads, urls, directory, **kwargs):
+    with _make_app().app_context(), \
+            mock.patch('datacat.utils.resource_fetch.open_resource',
+                       downloads.open_resource):
+        return list(fetch_resources(urls, directory, **kwargs))
+
+
+def test_fetch_resources(tmpdir):
+    b_urls = ['http://b/{0}'.format(i) for i in xrange(4)]
+    urls = ['http://a/0'] + b_urls + ['http://c/missing']
+
+    # Downloads from "b" wait for another one to run alongside them
+    # (if any is left), the one from "a" completes after all of them.
+    def _b_condition(d):
+        return d.running['b'] == 2 or d.started.issuperset(b_urls)
+
+    conditions = dict((url, _b_condition) for url in b_urls)
+    conditions['http://a/0'] = lambda d: d.finished.get('b') == 4
+    downloads = _Downloads(conditions)
+
+    results = _fetch(downloads, urls, str(tmpdir))
+
+    assert all(downloads.waited.values())
+    assert downloads.max_running['b'] == 2
+
+    # In order of completion
+    assert [x.url for x in results][-1] == 'http://a/0'
+    assert sorted(x.url for x in results) == sorted(urls)
+
+    failed = [x for x in results if x.exception is not None]
+    assert [x.url for x in failed] == ['http://c/missing']
+    assert isinstance(failed[0].exception, ResourceNotFound)
+
+    for result in results:
+        if result.exception is None:
+            assert result.content_type == 'text/plain'
+            with open(result.filename, 'rb') as fp:
+                assert fp.read() == 'x' * 100
+
+    assert _fetch(_Downloads(), [], str(tmpdir)) == []
+
+
+def test_fetch_resources_busy_host(tmpdir):
+    urls = ['http://{0}/{1}'.format(host, i)
+            for i in xrange(2) for host in 'abc']
+
+    # While a download from "a" is running, workers are not blocked
+    # waiting for the next one, and go on with the other hosts.
+    downloads = _Downloads({
+        'http://a/0': lambda d: 'http://c/1' in d.started})
+
+    results = _fetch(downloads, urls, str(tmpdir),
+                     max_workers=2, max_per_host=1)
+
+    assert all(downloads.waited.values())
+    assert max(downloads.max_running.values()) == 1
+    assert sorted(x.url for x in results) == sorted(urls)
+
+
+def test_fetch_dataset_resources_bandwidth(tmpdir):
+    configuration = {'resources': [
+        {'url': 'http://a/0'}, {'url': 'http://b/0'}, {'url': 'http://c/0'},
+        {'title': 'No URL'}]}
+    fake_time = _FakeTime()
+    start = fake_time.now
+
+    with _make_app().app_context(), \
+            mock.patch('datacat.utils.resource_fetch.open_resource',
+                       _Downloads().open_resource), \
+            mock.patch('datacat.utils.resource_fetch.time', fake_time):
+        results = list(fetch_dataset_resources(
+            configuration, str(tmpdir), max_bandwidth=100))
+
+    # 300 bytes at 100 bytes/s, with a 100 bytes burst
+    assert len(results) == 3
+    assert all(x.exception is None for x in results)
+    assert fake_time.now - start >= 2
+    assert fake_time.slept >= 2
+
+
+def test_token_bucket():
+    fake_time = _FakeTime()
+    with mock.patch('datacat.utils.resource_fetch.time', fake_time):
+        bucket = TokenBucket(1024, capacity=128)
+
+        # First 128 tokens are available right away
+        bucket.consume(128)
+        assert fake_time.slept == 0
+
+        for _ in xrange(4):
+            bucket.consume(128)
+        assert fake_time.slept == 4
+        assert fake_time.now == 1000.5
+
+        # Waits are capped to the time needed to fill the bucket
+        bucket.consume(320)
+        assert fake_time.slept == 7
+        assert fake_time.now == 1000.8125